@@ -0,0 +1,419 @@
+## Batch analysis of many reports in one request
+# Clinics send dozens of PDFs at once, and each used to need its own /analyze
+# call. A batch stores every file (zips are unpacked), analyses identical files
+# only once, pre-verifies and parses all reports in parallel, and feeds crew
+# runs to the shared job queue at batch priority as each report becomes ready.
+# Per-file results are published as they finish so they can be streamed.
+# The markers of every parsed report are kept, so the whole batch can be checked
+# against the reference ranges in one vectorised pass (see reference_eval.py).
+import logging
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from governor import PRIORITY_BATCH
+from jobs import QueueFullError
+from markers import extract_markers
+from observability import bind_context
+from pipeline import VERIFICATION
+from preverify import classify_report
+from reference_eval import MarkerTable, evaluate, find_demographics
+from report_cache import report_cache
+
+logger = logging.getLogger(__name__)
+
+ITEM_QUEUED = "queued"
+ITEM_PARSING = "parsing"
+ITEM_RUNNING = "running"
+ITEM_DONE = "done"
+ITEM_REJECTED = "rejected"
+ITEM_FAILED = "failed"
+ITEM_DUPLICATE = "duplicate"
+
+BATCH_RUNNING = "running"
+BATCH_DONE = "done"
+
+# Longest a batch thread waits for a slot before looking for a shutdown
+STOP_POLL_SECONDS = 0.5
+
+
+class BatchItem:
+    """One file of a batch."""
+
+    def __init__(self, index: int, upload):
+        self.index = index
+        self.filename = upload.filename
+        self.path = upload.path
+        self.sha256 = upload.sha256
+        self.size = upload.size
+        self.status = ITEM_QUEUED
+        # Index of the identical file this one shares its analysis with
+        self.duplicate_of = None
+        self.tasks = None
+        self.job_id = None
+        self.preverification = None
+        # Set once parsed: markers.Marker list and (sex code, age) of the patient
+        self.markers = None
+        self.demographics = None
+        self.result = None
+        self.error = None
+
+    def to_dict(self, include_result: bool = False) -> dict:
+        data = {
+            "index": self.index,
+            "filename": self.filename,
+            "sha256": self.sha256,
+            "size": self.size,
+            "status": self.status,
+            "duplicate_of": self.duplicate_of,
+            "job_id": self.job_id,
+            "preverification": self.preverification,
+            "error": self.error,
+        }
+        if include_result:
+            data["result"] = self.result
+        return data
+
+
+class Batch:
+    """A set of reports analysed with the same query and tasks.
+
+    Finished items are published as NDJSON-ready dicts to every listener (see
+    listen()); a listener joining late first receives everything published so far.
+    """
+
+    def __init__(self, batch_id: str, query: str, tasks: list, use_cache: bool = True, patient_id: str = None):
+        self.id = batch_id
+        self.query = query
+        self.tasks = tasks
+        self.use_cache = use_cache
+        # All reports of a batch with a patient id go to that patient's history
+        self.patient_id = patient_id
+        self.items = []
+        # First occurrence of every distinct file; only these are analysed
+        self.unique = []
+        self.created_at = time.time()
+        self.finished_at = None
+        self._by_hash = {}
+        self._published = []
+        self._listeners = []
+        self._remaining = 0
+        self._lock = threading.Lock()
+
+    def add(self, upload) -> BatchItem:
+        """Adds a stored upload; identical files become duplicates of the first one."""
+        item = BatchItem(len(self.items), upload)
+        primary = self._by_hash.get(upload.sha256)
+        if primary is None:
+            self._by_hash[upload.sha256] = item
+            self.unique.append(item)
+            self._remaining += 1
+        else:
+            item.status = ITEM_DUPLICATE
+            item.duplicate_of = primary.index
+        self.items.append(item)
+        return item
+
+    @property
+    def status(self) -> str:
+        return BATCH_DONE if self.finished_at is not None else BATCH_RUNNING
+
+    def finish_item(self, item: BatchItem, status: str, result: dict = None, error: str = None):
+        """Records the outcome of an analysed item, copies it to its duplicates and publishes them."""
+        with self._lock:
+            copies = [item] + [other for other in self.items if other.duplicate_of == item.index]
+            for each in copies:
+                each.status = status
+                each.result = result
+                each.error = error
+                self._publish({"type": "file", **each.to_dict(include_result=True)})
+            self._remaining -= 1
+            if self._remaining <= 0 and self.finished_at is None:
+                self.finished_at = time.time()
+                self._publish({"type": "summary", **self.to_dict(include_items=False)})
+                for channel in self._listeners:
+                    channel.emit("end")
+                self._listeners = []
+
+    def listen(self, channel):
+        """Sends everything published so far, then every new line, to an EventChannel.
+
+        Lines arrive as ("line", dict) events followed by a final ("end", None).
+        """
+        with self._lock:
+            for line in self._published:
+                channel.emit("line", line)
+            if self.finished_at is not None:
+                channel.emit("end")
+            else:
+                self._listeners.append(channel)
+
+    def unlisten(self, channel):
+        with self._lock:
+            if channel in self._listeners:
+                self._listeners.remove(channel)
+
+    def evaluate(self) -> dict:
+        """Checks the markers of every parsed, not rejected report in one pass.
+
+        Duplicates count once. Reports still being parsed are left out, so
+        calling this before the batch is done gives a partial picture.
+
+        Returns:
+            dict: The per-marker "cohort" summary and each file's out-of-range "findings".
+
+        Raises:
+            RuntimeError: If numpy is not installed.
+        """
+        table = MarkerTable()
+        parsed = [item for item in self.unique if item.markers is not None and item.status != ITEM_REJECTED]
+        for item in parsed:
+            table.add_report(item.index, item.markers, *item.demographics)
+        evaluation = evaluate(table)
+        flagged = {}
+        for row in evaluation.rows(flagged_only=True):
+            flagged.setdefault(row.pop("report"), []).append(row)
+        return {
+            "batch_id": self.id,
+            "status": self.status,
+            "cohort": evaluation.cohort_summary(),
+            "findings": [{"index": item.index, "filename": item.filename, "flagged": flagged.get(item.index, [])}
+                         for item in parsed],
+        }
+
+    def to_dict(self, include_items: bool = True) -> dict:
+        counts = {}
+        for item in self.items:
+            counts[item.status] = counts.get(item.status, 0) + 1
+        data = {
+            "batch_id": self.id,
+            "status": self.status,
+            "query": self.query,
+            "tasks": self.tasks,
+            "patient_id": self.patient_id,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "files": len(self.items),
+            "unique": len(self.unique),
+            "duplicates": len(self.items) - len(self.unique),
+            "counts": counts,
+        }
+        if include_items:
+            data["items"] = [item.to_dict() for item in self.items]
+        return data
+
+    def _publish(self, line: dict):
+        # Caller holds self._lock
+        self._published.append(line)
+        for channel in self._listeners:
+            channel.emit("line", line)
+
+
+class BatchRegistry:
+    """Batches by id; finished batches expire after `result_ttl` seconds."""
+
+    def __init__(self, result_ttl: float = None):
+        self.result_ttl = result_ttl if result_ttl is not None else config.JOB_RESULT_TTL_SECONDS
+        self._batches = {}
+        self._lock = threading.Lock()
+
+    def create(self, query: str, tasks: list, use_cache: bool = True, patient_id: str = None) -> Batch:
+        batch = Batch(str(uuid.uuid4()), query, tasks, use_cache, patient_id)
+        with self._lock:
+            self._prune()
+            self._batches[batch.id] = batch
+        return batch
+
+    def get(self, batch_id: str):
+        with self._lock:
+            self._prune()
+            return self._batches.get(batch_id)
+
+    def _prune(self):
+        # Caller holds self._lock
+        if self.result_ttl is None or self.result_ttl <= 0:
+            return
+        cutoff = time.time() - self.result_ttl
+        expired = [batch_id for batch_id, batch in self._batches.items()
+                   if batch.finished_at is not None and batch.finished_at < cutoff]
+        for batch_id in expired:
+            del self._batches[batch_id]
+
+
+class BatchRunner:
+    """Drives batches: parallel pre-verification and parsing, then crew runs on the job queue.
+
+    Args:
+        job_queue (JobQueue): The queue single-report requests use as well.
+        process_fn (callable): main.process_report; runs the crew and removes the file.
+        remove_fn (callable): Deletes a stored upload that will not be processed.
+        parse_fn (callable): Report text extractor used to fill the report cache.
+        parse_workers (int): Reports pre-verified and parsed at the same time.
+        max_in_flight (int): Job queue slots all batches together may hold, so
+            batches never crowd out interactive requests.
+        queue_timeout (float): Longest a parsed report waits for a slot before
+            it is marked failed; 0 waits as long as it takes.
+    """
+
+    def __init__(self, job_queue, process_fn, remove_fn, parse_fn, parse_workers: int = None,
+                 max_in_flight: int = None, queue_timeout: float = None):
+        self.job_queue = job_queue
+        self.process_fn = process_fn
+        self.remove_fn = remove_fn
+        self.parse_fn = parse_fn
+        parse_workers = config.BATCH_PARSE_WORKERS if parse_workers is None else parse_workers
+        max_in_flight = config.BATCH_MAX_IN_FLIGHT if max_in_flight is None else max_in_flight
+        self._parse_pool = ThreadPoolExecutor(max_workers=max(1, parse_workers), thread_name_prefix="batch-parse")
+        self._slots = threading.BoundedSemaphore(max(1, max_in_flight))
+        self.queue_timeout = config.BATCH_QUEUE_TIMEOUT_SECONDS if queue_timeout is None else queue_timeout
+        self._threads = set()
+        self._threads_lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def start(self, batch: Batch):
+        """Processes the batch on a background thread and returns immediately."""
+        thread = threading.Thread(target=bind_context(self._run), args=(batch,), name=f"batch-{batch.id[:8]}",
+                                  daemon=True)
+        with self._threads_lock:
+            self._threads.add(thread)
+        thread.start()
+
+    def shutdown(self, timeout: float = 5.0):
+        """Stops the batch threads, waiting up to `timeout` seconds for them.
+
+        Reports not handed to the job queue yet are marked failed; those
+        already queued are left to the job queue.
+        """
+        self._stopping.set()
+        self._parse_pool.shutdown(wait=False, cancel_futures=True)
+        with self._threads_lock:
+            threads = list(self._threads)
+        until = time.monotonic() + timeout
+        for thread in threads:
+            thread.join(max(0.0, until - time.monotonic()))
+
+    def _run(self, batch: Batch):
+        try:
+            # Completion order, collected by callbacks: as_completed never
+            # wakes up for parses cancelled by shutdown()
+            parsed = queue.Queue()
+            futures = {}
+            for item in batch.unique:
+                future = self._parse_pool.submit(bind_context(self._prepare), batch, item)
+                futures[future] = item
+                future.add_done_callback(parsed.put)
+            # Start each crew run as soon as its report is parsed
+            for _ in range(len(futures)):
+                future = parsed.get()
+                item = futures[future]
+                if future.cancelled():
+                    self._fail(batch, item, "Server shutting down")
+                    continue
+                if not future.result():
+                    continue
+                try:
+                    item.job_id = self._queue(batch, item).id
+                except Exception as e:
+                    logger.exception("Could not queue %s of batch %s", item.filename, batch.id)
+                    self._fail(batch, item, str(e))
+        finally:
+            with self._threads_lock:
+                self._threads.discard(threading.current_thread())
+
+    def _queue(self, batch: Batch, item: BatchItem):
+        """Hands a parsed report to the job queue once a batch slot and a queue slot are free.
+
+        Raises:
+            QueueFullError: If that takes longer than queue_timeout, or the runner shuts down.
+        """
+        wait_until = time.monotonic() + self.queue_timeout if self.queue_timeout > 0 else None
+        if not self._wait(self._slots.acquire, wait_until):
+            raise QueueFullError(self._wait_failure("batch slot"))
+
+        def submit(timeout: float):
+            try:
+                return self.job_queue.submit(
+                    self._analyse, batch, item, block=True, timeout=timeout,
+                    metadata={"batch_id": batch.id, "query": batch.query, "tasks": item.tasks,
+                              "file_processed": item.filename},
+                )
+            except QueueFullError:
+                return None
+        try:
+            job = self._wait(submit, wait_until)
+        except Exception:
+            self._slots.release()
+            raise
+        if job is None:
+            self._slots.release()
+            raise QueueFullError(self._wait_failure("job queue slot"))
+        return job
+
+    def _wait(self, acquire, wait_until: float = None):
+        """Calls acquire(timeout) in short steps until it returns something, wait_until passes or shutdown starts."""
+        while not self._stopping.is_set():
+            step = STOP_POLL_SECONDS
+            if wait_until is not None:
+                step = min(step, wait_until - time.monotonic())
+                if step <= 0:
+                    return None
+            acquired = acquire(timeout=step)
+            if acquired:
+                return acquired
+        return None
+
+    def _wait_failure(self, what: str) -> str:
+        if self._stopping.is_set():
+            return "Server shutting down"
+        return f"No {what} free within {self.queue_timeout:g}s"
+
+    def _fail(self, batch: Batch, item: BatchItem, error: str):
+        """Marks a report that will not be analysed failed and deletes its upload."""
+        self.remove_fn(item.path)
+        batch.finish_item(item, ITEM_FAILED, error=error)
+
+    def _prepare(self, batch: Batch, item: BatchItem) -> bool:
+        """Pre-verifies and parses one report; returns False if it will not be analysed."""
+        item.status = ITEM_PARSING
+        try:
+            preverification = classify_report(item.path)
+            item.preverification = preverification.to_dict()
+            if preverification.rejected:
+                self.remove_fn(item.path)
+                batch.finish_item(item, ITEM_REJECTED, error=preverification.reason)
+                return False
+            item.tasks = batch.tasks
+            if preverification.accepted:
+                item.tasks = [name for name in batch.tasks if name != VERIFICATION]
+            text = report_cache.get_or_parse(item.path, self.parse_fn, digest=item.sha256)
+            item.markers = extract_markers(text)
+            item.demographics = find_demographics(text)
+            item.status = ITEM_QUEUED
+            return True
+        except Exception as e:
+            logger.exception("Could not prepare %s of batch %s", item.filename, batch.id)
+            self.remove_fn(item.path)
+            batch.finish_item(item, ITEM_FAILED, error=f"Could not read report: {e}")
+            return False
+
+    def _analyse(self, batch: Batch, item: BatchItem) -> dict:
+        """Job queue entry point for one report of a batch."""
+        item.status = ITEM_RUNNING
+        try:
+            result = self.process_fn(
+                batch.query, item.path, item.filename, tasks=item.tasks, report_hash=item.sha256,
+                use_cache=batch.use_cache, priority=PRIORITY_BATCH, patient_id=batch.patient_id,
+            )
+        except Exception as e:
+            batch.finish_item(item, ITEM_FAILED, error=f"Error processing blood report: {e}")
+            raise
+        else:
+            # A partial result (deadline hit) still carries the analyses that finished
+            status = ITEM_DONE if result.get("status") in ("success", "partial") else ITEM_REJECTED
+            batch.finish_item(item, status, result=result)
+            return result
+        finally:
+            self._slots.release()
@@ -0,0 +1,364 @@
+## Upload-to-response benchmark
+# Drives main.app in-process through an ASGI client: synthetic lab PDFs are
+# uploaded to POST /analyze at a fixed concurrency and each job is polled until
+# it finishes. Per stage it reports p50/p95/p99 latency, throughput and peak
+# RSS, and compares the run against a stored baseline so regressions fail the
+# run (exit code 1). No network access or API keys are needed: the crew's LLM
+# work is replaced by benchmarks/mock_crew.py.
+#
+# Usage, from the repository root:
+#   python -m benchmarks.bench --requests 40 --concurrency 8 --pages 1,10,40
+#   python -m benchmarks.bench --save-baseline      # record the current numbers
+#   python -m benchmarks.bench --no-baseline        # measure without comparing
+#
+# Stages:
+#   upload      POST /analyze as seen by the client (storage + local pre-verification)
+#   verify      local pre-verification (preverify.classify_report) alone
+#   parse       PDF text extraction before the crew starts
+#   crew        the crew pipeline (run_pipeline), LLM verification gate included
+#   end_to_end  first upload attempt until the job reports done
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+STAGES = ("upload", "verify", "parse", "crew", "end_to_end")
+# Latency growth below this many milliseconds is treated as noise
+MIN_REGRESSION_MS = 5.0
+
+
+def percentile(values: list, q: float) -> float:
+    """q-th percentile (0-100) with linear interpolation between ranks."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class StageRecorder:
+    """Latency samples and peak RSS per stage.
+
+    A sampler thread reads the RSS every `sample_interval` seconds and charges
+    it to every stage active at that moment. PDF worker processes are not
+    included; only this process is measured.
+    """
+
+    def __init__(self, sample_interval: float = 0.005):
+        self.sample_interval = sample_interval
+        self.samples = {stage: [] for stage in STAGES}
+        self.peak_rss = {stage: 0 for stage in STAGES}
+        self._active = {stage: 0 for stage in STAGES}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample_loop, name="bench-rss", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def enter(self, stage: str):
+        with self._lock:
+            self._active[stage] += 1
+        self._sample()
+
+    def exit(self, stage: str, seconds: float):
+        self._sample()
+        with self._lock:
+            self._active[stage] -= 1
+            self.samples[stage].append(seconds)
+
+    def cancel(self, stage: str):
+        """Leaves a stage without recording a sample (e.g. a retried attempt)."""
+        with self._lock:
+            self._active[stage] -= 1
+
+    def wrap(self, stage: str, fn):
+        """fn, timed as `stage` on every call."""
+        def timed_call(*args, **kwargs):
+            self.enter(stage)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.exit(stage, time.perf_counter() - start)
+        return timed_call
+
+    def summary(self, wall_seconds: float) -> dict:
+        with self._lock:
+            return {
+                stage: {
+                    "count": len(values),
+                    "p50_ms": round(percentile(values, 50) * 1000, 2),
+                    "p95_ms": round(percentile(values, 95) * 1000, 2),
+                    "p99_ms": round(percentile(values, 99) * 1000, 2),
+                    "throughput_per_s": round(len(values) / wall_seconds, 3) if wall_seconds else 0.0,
+                    "peak_rss_mb": round(self.peak_rss[stage] / (1024 * 1024), 1),
+                }
+                for stage, values in self.samples.items()
+            }
+
+    def _sample(self):
+        rss = current_rss()
+        with self._lock:
+            for stage, active in self._active.items():
+                if active and rss > self.peak_rss[stage]:
+                    self.peak_rss[stage] = rss
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.sample_interval):
+            self._sample()
+
+
+def configure_environment(args, work_dir: str):
+    """Settings for a reproducible run; must happen before the app modules are imported."""
+    os.environ["UPLOAD_DIR"] = os.path.join(work_dir, "uploads")
+    os.environ["REPORT_CACHE_DIR"] = ""
+    # Every request should do the full work, not hit a cache from an earlier one
+    os.environ["RESULT_CACHE_BACKEND"] = "off"
+    os.environ["LLM_MAX_RPM"] = str(args.llm_rpm)
+    os.environ["LLM_MAX_TPM"] = "0"
+    os.environ["JOB_WORKERS"] = str(args.workers)
+    os.environ["CREW_POOL_SIZE"] = str(args.workers)
+
+
+# main.py name -> stage it is timed as
+INSTRUMENTED = {"classify_report": "verify", "parse_pdf_text": "parse", "run_pipeline": "crew"}
+
+
+def instrument(app_module, recorder: StageRecorder):
+    """Times the server-side stages by wrapping the functions main.py calls.
+
+    Returns:
+        callable: Restores the original functions.
+    """
+    originals = {name: getattr(app_module, name) for name in INSTRUMENTED}
+    for name, stage in INSTRUMENTED.items():
+        setattr(app_module, name, recorder.wrap(stage, originals[name]))
+
+    def restore():
+        for name, fn in originals.items():
+            setattr(app_module, name, fn)
+    return restore
+
+
+async def run_one(client, recorder: StageRecorder, pdf: bytes, name: str, tasks: str, poll_interval: float) -> dict:
+    """Uploads one report and waits for its job; returns its outcome."""
+    recorder.enter("end_to_end")
+    start = time.perf_counter()
+    rejected = 0
+    while True:
+        recorder.enter("upload")
+        attempt = time.perf_counter()
+        response = await client.post("/analyze", files={"file": (name, pdf, "application/pdf")}, data={"tasks": tasks})
+        elapsed = time.perf_counter() - attempt
+        if response.status_code != 429:
+            recorder.exit("upload", elapsed)
+            break
+        recorder.cancel("upload")
+        rejected += 1
+        await asyncio.sleep(float(response.headers.get("Retry-After", "1")) / 10)
+
+    if response.status_code != 202:
+        recorder.cancel("end_to_end")
+        return {"ok": False, "rejected": rejected, "error": f"upload returned {response.status_code}: {response.text[:200]}"}
+
+    job_id = response.json()["job_id"]
+    while True:
+        status = (await client.get(f"/jobs/{job_id}")).json()
+        if status["status"] in ("done", "failed"):
+            break
+        await asyncio.sleep(poll_interval)
+    recorder.exit("end_to_end", time.perf_counter() - start)
+    if status["status"] == "failed":
+        return {"ok": False, "rejected": rejected, "error": status.get("error")}
+    return {"ok": True, "rejected": rejected}
+
+
+async def run_scenario(app_module, args, pages: int, recorder: StageRecorder) -> dict:
+    """Sends args.requests uploads of `pages`-page reports with args.concurrency in flight."""
+    import httpx
+    from benchmarks.synthetic import make_lab_pdf
+
+    # Distinct reports, generated before the clock starts
+    pdfs = [make_lab_pdf(pages, seed=pages * 100000 + i) for i in range(args.requests)]
+    limit = asyncio.Semaphore(args.concurrency)
+    transport = httpx.ASGITransport(app=app_module.app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=args.timeout) as client:
+        async def bounded(i):
+            async with limit:
+                return await run_one(client, recorder, pdfs[i], f"report_{pages}p_{i}.pdf", args.tasks, args.poll_interval)
+
+        start = time.perf_counter()
+        outcomes = await asyncio.gather(*(bounded(i) for i in range(args.requests)))
+        wall = time.perf_counter() - start
+
+    errors = [o["error"] for o in outcomes if not o["ok"]]
+    return {
+        "pages": pages,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "wall_seconds": round(wall, 3),
+        "throughput_per_s": round(args.requests / wall, 3) if wall else 0.0,
+        "errors": len(errors),
+        "error_samples": errors[:3],
+        "queue_full_retries": sum(o["rejected"] for o in outcomes),
+        "stages": recorder.summary(wall),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Regressions of results against baseline, as human-readable lines."""
+    problems = []
+    if baseline.get("params") != results["params"]:
+        print("Baseline was recorded with different parameters; comparing anyway:")
+        print(f"  baseline: {baseline.get('params')}")
+        print(f"  current:  {results['params']}")
+    for key, scenario in results["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(key)
+        if base is None:
+            print(f"No baseline for scenario {key}; skipped")
+            continue
+        if scenario["errors"]:
+            problems.append(f"{key}: {scenario['errors']} failed requests")
+        if scenario["throughput_per_s"] < base["throughput_per_s"] * (1 - tolerance):
+            problems.append(f"{key}: throughput {scenario['throughput_per_s']}/s vs baseline {base['throughput_per_s']}/s")
+        for stage, stats in scenario["stages"].items():
+            base_stats = base["stages"].get(stage)
+            if not base_stats or not stats["count"]:
+                continue
+            for metric in ("p50_ms", "p95_ms", "p99_ms"):
+                now, before = stats[metric], base_stats[metric]
+                if now > before * (1 + tolerance) and now - before > MIN_REGRESSION_MS:
+                    problems.append(f"{key}/{stage}: {metric} {now} vs baseline {before}")
+            if base_stats["peak_rss_mb"] and stats["peak_rss_mb"] > base_stats["peak_rss_mb"] * (1 + tolerance):
+                problems.append(f"{key}/{stage}: peak RSS {stats['peak_rss_mb']} MB vs baseline {base_stats['peak_rss_mb']} MB")
+    return problems
+
+
+def print_report(results: dict):
+    for key, scenario in results["scenarios"].items():
+        print(f"\n{key}: {scenario['requests']} requests, concurrency {scenario['concurrency']}, "
+              f"{scenario['wall_seconds']}s, {scenario['throughput_per_s']} req/s, "
+              f"{scenario['errors']} errors, {scenario['queue_full_retries']} queue-full retries")
+        print(f"  {'stage':<11} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'per s':>8} {'peak MB':>8}")
+        for stage, stats in scenario["stages"].items():
+            print(f"  {stage:<11} {stats['count']:>6} {stats['p50_ms']:>9} {stats['p95_ms']:>9} "
+                  f"{stats['p99_ms']:>9} {stats['throughput_per_s']:>8} {stats['peak_rss_mb']:>8}")
+        for error in scenario["error_samples"]:
+            print(f"  error: {error}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the upload-to-response pipeline offline.")
+    parser.add_argument("--requests", type=int, default=20, help="Uploads per scenario")
+    parser.add_argument("--concurrency", type=int, default=4, help="Uploads in flight at once")
+    parser.add_argument("--pages", default="1,10", help="Comma separated page counts, one scenario each")
+    parser.add_argument("--tasks", default="", help="Pipeline tasks per request (default: config default)")
+    parser.add_argument("--workers", type=int, default=2, help="JOB_WORKERS / CREW_POOL_SIZE of the app")
+    parser.add_argument("--llm-latency-ms", type=float, default=50.0, help="Delay of each mock LLM call")
+    parser.add_argument("--llm-jitter-ms", type=float, default=0.0, help="Extra prompt-dependent delay")
+    parser.add_argument("--llm-rpm", type=int, default=0, help="LLM_MAX_RPM for the run (0: unlimited)")
+    parser.add_argument("--poll-interval", type=float, default=0.01, help="Seconds between job status polls")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per HTTP call timeout")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Write this run as the new baseline")
+    parser.add_argument("--no-baseline", action="store_true",
+                        help="Only measure; do not compare against (or require) a baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown")
+    parser.add_argument("--output", help="Also write the results JSON here")
+    return parser.parse_args(argv)
+
+
+async def run(args) -> dict:
+    import main as app_module
+    from benchmarks import mock_crew
+
+    mock_crew.install(args.llm_latency_ms, args.llm_jitter_ms)
+    results = {
+        "params": {
+            "requests": args.requests, "concurrency": args.concurrency, "tasks": args.tasks,
+            "workers": args.workers, "llm_latency_ms": args.llm_latency_ms, "llm_jitter_ms": args.llm_jitter_ms,
+            "llm_rpm": args.llm_rpm,
+        },
+        "scenarios": {},
+    }
+    async with app_module.app.router.lifespan_context(app_module.app):
+        for pages in [int(p) for p in args.pages.split(",") if p.strip()]:
+            recorder = StageRecorder()
+            restore = instrument(app_module, recorder)
+            recorder.start()
+            try:
+                results["scenarios"][f"{pages}_pages"] = await run_scenario(app_module, args, pages, recorder)
+            finally:
+                recorder.stop()
+                restore()
+    return results
+
+
+def cli(argv=None) -> int:
+    args = parse_args(argv)
+    if not (args.save_baseline or args.no_baseline or os.path.exists(args.baseline)):
+        # Without a baseline a regression run would pass whatever it measured
+        print(f"No baseline at {args.baseline}; record one with --save-baseline, "
+              "or pass --no-baseline to only measure.")
+        return 2
+    with tempfile.TemporaryDirectory(prefix="bench-") as work_dir:
+        configure_environment(args, work_dir)
+        results = asyncio.run(run(args))
+
+    print_report(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nBaseline written to {args.baseline}")
+        return 0
+
+    if args.no_baseline:
+        return 1 if any(s["errors"] for s in results["scenarios"].values()) else 0
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    problems = compare(results, baseline, args.tolerance)
+    if problems:
+        print("\n" + "!" * 60)
+        print(f"PERFORMANCE REGRESSION against {args.baseline} (tolerance {args.tolerance:.0%}):")
+        for problem in problems:
+            print(f"  - {problem}")
+        print("!" * 60)
+        return 1
+    print(f"\nNo regressions against {args.baseline} (tolerance {args.tolerance:.0%}).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -0,0 +1,72 @@
+## Deterministic stand-in for the crew's LLM work
+# Benchmarks must run without network access or API keys, and their numbers
+# must not depend on what a hosted model felt like answering. install() swaps
+# CrewInstance.kickoff for a version that still reads the report through the
+# real tools (report cache, marker parser, compaction) and still goes through
+# the rate governor, but answers with DeterministicLLM instead of a model.
+import hashlib
+import time
+
+import crew_pool
+from governor import GovernedLLM
+from pipeline import VERIFICATION
+from tools import BloodTestReportTool, read_report_markers
+from tool_bridge import call_sync
+
+
+class DeterministicLLM:
+    """Returns the same answer, after the same delay, for the same prompt.
+
+    Args:
+        latency_ms (float): Base delay of every call.
+        jitter_ms (float): Extra delay between 0 and jitter_ms, derived from the prompt hash.
+    """
+
+    def __init__(self, latency_ms: float = 50.0, jitter_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.calls = 0
+
+    def invoke(self, prompt):
+        self.calls += 1
+        digest = hashlib.sha256(str(prompt).encode("utf-8")).digest()
+        jitter = self.jitter_ms * digest[0] / 255.0
+        time.sleep((self.latency_ms + jitter) / 1000.0)
+        return f"Deterministic analysis {digest[:4].hex()} of a {len(str(prompt))} character prompt."
+
+    def call(self, prompt, *args, **kwargs):
+        return self.invoke(prompt)
+
+    def stream(self, prompt):
+        yield self.invoke(prompt)
+
+
+def install(latency_ms: float = 50.0, jitter_ms: float = 0.0) -> DeterministicLLM:
+    """Replaces CrewInstance.kickoff for the rest of the process.
+
+    Returns:
+        DeterministicLLM: The model answering every task (its `calls` counts them).
+    """
+    model = DeterministicLLM(latency_ms, jitter_ms)
+    llm = GovernedLLM(model)
+
+    def kickoff(self, task_name: str, inputs: dict, step_callback=None):
+        task = self.tasks[task_name]
+        file_path = inputs["file_path"]
+        description = (task.description.replace("{query}", inputs["query"]).replace("{file_path}", file_path)
+                       .replace("{history}", inputs.get("history", ""))
+                       .replace("{findings}", inputs.get("findings", "")))
+        if task_name == VERIFICATION:
+            report = call_sync(BloodTestReportTool.read_compact_tool(file_path))
+            answer = llm.invoke(f"{description}\n\n{report}")
+            verdict = "INVALID" if report.startswith("Error") else "VALID"
+            output = f"{verdict}: {answer}"
+        else:
+            markers = read_report_markers(file_path)
+            output = llm.invoke(f"{task.agent.role}\n{description}\n\n{markers}")
+        if step_callback:
+            step_callback(output)
+        return output
+
+    crew_pool.CrewInstance.kickoff = kickoff
+    return model
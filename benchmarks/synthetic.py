@@ -0,0 +1,83 @@
+## Synthetic lab report PDFs for benchmarks
+# Builds small, valid text PDFs with the standard Helvetica font and no
+# dependencies, so benchmark runs need neither sample files nor network access.
+# The same seed always yields the same bytes.
+import random
+
+from markers import MARKER_SYNONYMS, DEFAULT_RANGES
+
+LINES_PER_PAGE = 40
+
+HEADER = [
+    "City Diagnostic Laboratory - Blood Test Report",
+    "12 Main Street, Springfield | Phone 555-0100 | NABL accredited",
+]
+FOOTER = [
+    "This is an electronically generated report and does not require a signature.",
+]
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def build_pdf(pages: list) -> bytes:
+    """Renders pages (each a list of text lines) into a PDF document."""
+    count = len(pages)
+    font_ref = 3 + 2 * count
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [{}] /Count {} >>".format(
+            " ".join(f"{3 + 2 * i} 0 R" for i in range(count)), count),
+    ]
+    for i, lines in enumerate(pages):
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 {font_ref} 0 R >> >> /Contents {4 + 2 * i} 0 R >>"
+        )
+        stream = "BT /F1 9 Tf 12 TL 40 760 Td " + " ".join(f"({_escape(line)}) Tj T*" for line in lines) + " ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    out += b"".join(f"{offset:010d} 00000 n \n".encode("latin-1") for offset in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    return out
+
+
+def _marker_line(rng: random.Random, key: str) -> str:
+    display, unit, _synonyms = MARKER_SYNONYMS[key]
+    low, high = DEFAULT_RANGES[key]
+    low = low or 0.0
+    high = high or low * 2 or 100.0
+    # Mostly in range, sometimes either side of it
+    value = rng.uniform(low * 0.7, high * 1.3)
+    return f"{display} {value:.1f} {unit} {low:g} - {high:g}"
+
+
+def lab_report_pages(page_count: int, seed: int = 0) -> list:
+    """Text lines of a multi-page lab report: header, patient block, marker table, footer."""
+    rng = random.Random(seed)
+    keys = [key for key in MARKER_SYNONYMS if key in DEFAULT_RANGES]
+    pages = []
+    for number in range(1, page_count + 1):
+        lines = list(HEADER)
+        lines.append(f"Patient: Synthetic Patient {seed}  Sample: Serum  Page {number} of {page_count}")
+        lines.append("Test Result Units Reference Range")
+        body = LINES_PER_PAGE - len(lines) - len(FOOTER)
+        for _ in range(body):
+            lines.append(_marker_line(rng, rng.choice(keys)))
+        lines.extend(FOOTER)
+        pages.append(lines)
+    return pages
+
+
+def make_lab_pdf(page_count: int, seed: int = 0) -> bytes:
+    """A synthetic blood test report PDF with page_count pages."""
+    return build_pdf(lab_report_pages(max(1, page_count), seed))
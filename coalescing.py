@@ -0,0 +1,179 @@
+## Single-flight coalescing of identical in-flight analyses
+# Clinic portals retry: the same PDF with the same question often arrives
+# several times within seconds, and each copy ran its own crew. The result
+# cache only helps once the first run has finished. Requests are now keyed by
+# (file hash, normalized query, tasks, patient fields); while a run with that
+# key is in flight, later arrivals drop their copy of the upload and attach to
+# it instead: /analyze returns the running job's id, /analyze/stream replays the
+# run's events so far and then follows it live. The first request's job is
+# unchanged, so it stays subject to the normal queueing, timeouts and
+# cancellation, and everyone attached gets its outcome. A client disconnecting
+# only cancels the run once no other request is attached to it.
+import hashlib
+import json
+import threading
+import time
+
+import config
+from result_cache import normalize_query
+
+# Events after which a run has nothing more to say
+FINAL_EVENTS = ("result", "error")
+
+
+class InflightRun:
+    """One running analysis and the requests attached to it.
+
+    Events published by the run are kept so a request attaching late first
+    receives everything so far (see listen()). `attached` counts the requests
+    waiting for the outcome; polling requests stay attached until the end,
+    streaming ones detach() when their client goes away.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.job = None
+        self.followers = 0
+        self.attached = 1
+        self.started_at = time.time()
+        self.finished = False
+        self.cancel_reason = None
+        self.deadline = None
+        self._events = []
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def publish(self, event: str, data=None):
+        """Records an event and forwards it to every listener; usable as on_event."""
+        with self._lock:
+            self._events.append((event, data))
+            listeners = list(self._listeners)
+            if event in FINAL_EVENTS:
+                self.finished = True
+                self._listeners = []
+        for channel in listeners:
+            channel.emit(event, data)
+
+    def listen(self, channel):
+        """Sends the events so far, then every new one, to an EventChannel."""
+        with self._lock:
+            for event, data in self._events:
+                channel.emit(event, data)
+            if not self.finished:
+                self._listeners.append(channel)
+
+    def unlisten(self, channel):
+        with self._lock:
+            if channel in self._listeners:
+                self._listeners.remove(channel)
+
+    def detach(self, reason: str) -> bool:
+        """Drops one attached request and cancels the run for reason if nobody else waits for it.
+
+        Returns:
+            bool: True if the run was cancelled.
+        """
+        with self._lock:
+            self.attached -= 1
+            if self.attached > 0 or self.finished:
+                return False
+        self.cancel(reason)
+        return True
+
+    def _attach(self) -> bool:
+        # Caller holds the coalescer's lock; a cancelled run will not produce the
+        # full analysis a new request asks for
+        with self._lock:
+            if self.finished or self.cancel_reason is not None or self.attached <= 0:
+                return False
+            self.followers += 1
+            self.attached += 1
+            return True
+
+    def set_deadline(self, deadline):
+        """Hands the run its deadlines.Deadline once the job starts (it may be cancelled already)."""
+        with self._lock:
+            self.deadline = deadline
+            if self.cancel_reason is not None:
+                deadline.cancel(self.cancel_reason)
+
+    def cancel(self, reason: str):
+        """Cancels the run, now or as soon as its job starts."""
+        with self._lock:
+            if self.cancel_reason is None:
+                self.cancel_reason = reason
+            deadline = self.deadline
+        if deadline is not None:
+            deadline.cancel(reason)
+
+
+class Coalescer:
+    """In-flight runs by request key, with the coalescing counters.
+
+    Args:
+        enabled (bool): Off: every request leads a run of its own.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._runs = {}
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.coalesced = 0
+        self.runs_saved = 0
+
+    @staticmethod
+    def make_key(file_hash: str, query: str, tasks: list, *context) -> str:
+        """Key of a request: identical keys would produce the same analysis.
+
+        context is anything else that changes the outcome, e.g. the patient id.
+        """
+        payload = json.dumps([file_hash, normalize_query(query), list(tasks or []), *context])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def join(self, key: str) -> tuple:
+        """Attaches to the run in flight for key, or registers a new one.
+
+        Returns:
+            tuple: (InflightRun, True if the caller leads the run and must start it).
+        """
+        if not self.enabled:
+            return InflightRun(key), True
+        with self._lock:
+            run = self._runs.get(key)
+            if run is not None and run._attach():
+                self.coalesced += 1
+                return run, False
+            run = InflightRun(key)
+            self._runs[key] = run
+            self.runs += 1
+            return run, True
+
+    def finish(self, run: InflightRun, result: dict = None):
+        """Removes a finished run; later requests with its key start afresh (or hit the result cache)."""
+        with self._lock:
+            if self._runs.get(run.key) is run:
+                del self._runs[run.key]
+            # Followers of a run served from the result cache saved nothing
+            if result is not None and not result.get("cached"):
+                self.runs_saved += run.followers
+
+    def abandon(self, run: InflightRun):
+        """Forgets a run that never started (e.g. the job queue was full)."""
+        with self._lock:
+            if self._runs.get(run.key) is run:
+                del self._runs[run.key]
+                self.runs -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "in_flight": len(self._runs),
+                "runs": self.runs,
+                "coalesced_requests": self.coalesced,
+                "llm_runs_saved": self.runs_saved,
+            }
+
+
+coalescer = Coalescer(enabled=config.COALESCE_REQUESTS)
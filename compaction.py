@@ -0,0 +1,217 @@
+## Token-budgeted compaction of report text
+# read_data_tool handed the entire cleaned report to the agent, which carried it
+# into every LLM iteration: lab headers, addresses, disclaimers and the footer
+# repeated on every page included. compact_report() keeps one copy of text that
+# repeats across pages, moves the marker tables into compact rows (see
+# markers.py) and truncates whatever is left to a token budget.
+import math
+import re
+import threading
+from functools import lru_cache
+
+import config
+from governor import estimate_tokens, CHARS_PER_TOKEN
+from markers import extract_markers, format_markers, marker_spans
+
+# Words per shingle when looking for text repeated across pages
+SHINGLE_WORDS = 6
+# Longest run of words dropped as a disclaimer sentence. Extracted pages lose
+# their line breaks, so an unpunctuated header runs into the footer sentence;
+# a longer match is kept rather than taking the patient block with it.
+DISCLAIMER_MAX_WORDS = 30
+
+_DIGITS_RE = re.compile(r"\d+")
+_PAGE_NUMBER_RE = re.compile(r"\bpage\s*\d+\s*(?:of|/)\s*\d+\b", re.IGNORECASE)
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+# Sentences that never carry patient data
+_DISCLAIMER_RE = re.compile(
+    r"end of (?:the )?report|electronically (?:generated|signed|verified)|computer generated"
+    r"|system generated|medico[- ]?legal|disclaimer|for (?:the )?use of (?:the )?referring",
+    re.IGNORECASE,
+)
+
+
+class CompactReport:
+    """Result of compact_report()."""
+
+    def __init__(self, text: str, original: str, marker_count: int, repeated_words: int, truncated: bool):
+        self.text = text
+        self.original_chars = len(original)
+        self.compacted_chars = len(text)
+        self.original_tokens = estimate_tokens(original)
+        self.compacted_tokens = estimate_tokens(text)
+        self.marker_count = marker_count
+        self.repeated_words = repeated_words
+        self.truncated = truncated
+
+    def to_dict(self) -> dict:
+        return {
+            "original_chars": self.original_chars,
+            "compacted_chars": self.compacted_chars,
+            "original_tokens": self.original_tokens,
+            "compacted_tokens": self.compacted_tokens,
+            "markers": self.marker_count,
+            "repeated_words_removed": self.repeated_words,
+            "truncated": self.truncated,
+        }
+
+
+class CompactionMetrics:
+    """Original vs compacted size of every report compacted since startup."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reports = 0
+        self.served = 0
+        self.truncated = 0
+        self.original_tokens = 0
+        self.compacted_tokens = 0
+        self.original_chars = 0
+        self.compacted_chars = 0
+
+    def record(self, result: CompactReport):
+        with self._lock:
+            self.reports += 1
+            self.truncated += int(result.truncated)
+            self.original_tokens += result.original_tokens
+            self.compacted_tokens += result.compacted_tokens
+            self.original_chars += result.original_chars
+            self.compacted_chars += result.compacted_chars
+
+    def record_served(self):
+        with self._lock:
+            self.served += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "reports": self.reports,
+                "served": self.served,
+                "truncated": self.truncated,
+                "original_tokens": self.original_tokens,
+                "compacted_tokens": self.compacted_tokens,
+                "original_chars": self.original_chars,
+                "compacted_chars": self.compacted_chars,
+                "compaction_ratio": round(self.compacted_tokens / self.original_tokens, 4) if self.original_tokens else None,
+            }
+
+
+compaction_metrics = CompactionMetrics()
+
+
+def _remove_spans(text: str, spans: list) -> str:
+    pieces = []
+    position = 0
+    for start, end in spans:
+        pieces.append(text[position:start])
+        position = end
+    pieces.append(text[position:])
+    return " ".join(pieces)
+
+
+def _is_disclaimer(sentence: str) -> bool:
+    return len(sentence.split()) <= DISCLAIMER_MAX_WORDS and bool(_DISCLAIMER_RE.search(sentence))
+
+
+def _drop_disclaimers(page: str) -> str:
+    return " ".join(s for s in _SENTENCE_END_RE.split(page) if not _is_disclaimer(s))
+
+
+def _drop_repeated(pages_words: list, min_pages: int) -> tuple:
+    """Removes word runs that appear on at least min_pages pages, keeping the first copy.
+
+    Runs are compared as SHINGLE_WORDS-word shingles, case-insensitively and
+    with digits masked, so "Page 2"/"Page 3" or printed dates still match.
+
+    Returns:
+        tuple: (list of pages as text, number of words removed)
+    """
+    shingles = []
+    first_page = {}
+    pages_seen = {}
+    for page_index, words in enumerate(pages_words):
+        masked = [_DIGITS_RE.sub("#", word.lower()) for word in words]
+        keys = [tuple(masked[i:i + SHINGLE_WORDS]) for i in range(len(masked) - SHINGLE_WORDS + 1)]
+        shingles.append(keys)
+        for key in set(keys):
+            first_page.setdefault(key, page_index)
+            pages_seen[key] = pages_seen.get(key, 0) + 1
+
+    pages = []
+    removed = 0
+    for page_index, (words, keys) in enumerate(zip(pages_words, shingles)):
+        drop = set()
+        for i, key in enumerate(keys):
+            if pages_seen[key] >= min_pages and first_page[key] != page_index:
+                drop.update(range(i, i + SHINGLE_WORDS))
+        removed += len(drop)
+        pages.append(" ".join(word for i, word in enumerate(words) if i not in drop))
+    return pages, removed
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    if max_tokens <= 0:
+        return ""
+    cut = text[:max_tokens * CHARS_PER_TOKEN]
+    # Do not end on half a word
+    if len(cut) < len(text) and " " in cut:
+        cut = cut.rsplit(" ", 1)[0]
+    return cut
+
+
+@lru_cache(maxsize=max(1, config.COMPACTION_CACHE_ENTRIES))
+def _compact(text: str, token_budget: int) -> CompactReport:
+    pages = [page for page in text.split("\n") if page.strip()]
+    markers = extract_markers(text)
+
+    # Marker readings move to the rows section; the rest of each page is prose
+    prose = []
+    for page in pages:
+        page = _remove_spans(page, marker_spans(page))
+        page = _PAGE_NUMBER_RE.sub(" ", page)
+        prose.append(_drop_disclaimers(page).split())
+
+    min_pages = max(2, math.ceil(len(prose) * config.COMPACTION_REPEAT_SHARE))
+    prose, repeated_words = _drop_repeated(prose, min_pages)
+
+    sections = []
+    if markers:
+        sections.append("Lab markers:\n" + format_markers(markers))
+    body = "\n".join(page for page in prose if page)
+    truncated = False
+    if body:
+        heading = "Other report text:\n" if markers else "Report text:\n"
+        if token_budget > 0:
+            room = token_budget - estimate_tokens("\n\n".join(sections + [heading]))
+            if estimate_tokens(body) > room:
+                body = _truncate(body, room) + f"\n[... truncated to a budget of {token_budget} tokens]"
+                truncated = True
+        sections.append(heading + body)
+    compacted = "\n\n".join(sections)
+
+    # Short, clean reports can come out longer with the section headings
+    if len(compacted) >= len(text) and (token_budget <= 0 or estimate_tokens(text) <= token_budget):
+        compacted, truncated = text, False
+
+    result = CompactReport(compacted, text, len(markers), repeated_words, truncated)
+    compaction_metrics.record(result)
+    return result
+
+
+def compact_report(text: str, token_budget: int = None) -> CompactReport:
+    """Compacts report text for an agent prompt.
+
+    Results are memoized per (text, budget), so every agent iteration reading
+    the same report reuses one compaction.
+
+    Args:
+        text (str): Cleaned report text, one line per page (pdf_extract.extract_text).
+        token_budget (int, optional): Estimated token limit of the result; 0 or
+            less disables truncation. Defaults to config.COMPACTION_TOKEN_BUDGET.
+
+    Returns:
+        CompactReport: The compacted text plus original vs compacted sizes.
+    """
+    token_budget = config.COMPACTION_TOKEN_BUDGET if token_budget is None else token_budget
+    compaction_metrics.record_served()
+    return _compact(text or "", token_budget)
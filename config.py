@@ -0,0 +1,250 @@
+## Runtime configuration for the API process
+# Every knob can be overridden through the environment (or the .env file that
+# agents.py and tools.py already load), so deployments can be tuned without
+# touching code.
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+
+def _env_int(name: str, default: int) -> int:
+    """Reads an integer setting, falling back to the default on missing/bad values."""
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        print(f"Invalid integer for {name}={value!r}, using default {default}")
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    """Reads a float setting, falling back to the default on missing/bad values."""
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        print(f"Invalid number for {name}={value!r}, using default {default}")
+        return default
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    """Reads an on/off setting; "0", "false", "no", "off" and an empty value mean off."""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() not in ("0", "false", "no", "off", "")
+
+
+## Uploads
+# Directory uploaded reports are stored in while they are processed.
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "data")
+# Uploads larger than this are rejected with 413 while still streaming in.
+UPLOAD_MAX_BYTES = _env_int("UPLOAD_MAX_BYTES", 50 * 1024 * 1024)
+# Bytes read from the request per chunk; bounds per-upload memory.
+UPLOAD_CHUNK_SIZE = _env_int("UPLOAD_CHUNK_SIZE", 64 * 1024)
+# Uploads up to this size are kept in memory and never written to disk (see
+# upload_buffers.py); larger ones are spooled to UPLOAD_DIR. 0 disables.
+UPLOAD_MEMORY_THRESHOLD = _env_int("UPLOAD_MEMORY_THRESHOLD", 8 * 1024 * 1024)
+# Total bytes of uploads held in memory; uploads beyond it go to disk.
+UPLOAD_MEMORY_MAX_BYTES = _env_int("UPLOAD_MEMORY_MAX_BYTES", 256 * 1024 * 1024)
+# In-memory uploads nobody released are evicted after this long without use.
+UPLOAD_MEMORY_TTL_SECONDS = _env_float("UPLOAD_MEMORY_TTL_SECONDS", 3600.0)
+
+
+## Background job queue
+# Number of worker threads running crews concurrently. Threads (not processes)
+# because Crew/Agent objects are not picklable and the heavy lifting is LLM I/O.
+JOB_WORKERS = _env_int("JOB_WORKERS", 2)
+# Jobs allowed to wait for a free worker; beyond this /analyze answers 429.
+JOB_QUEUE_SIZE = _env_int("JOB_QUEUE_SIZE", 16)
+# How long finished jobs (and their results) stay queryable.
+JOB_RESULT_TTL_SECONDS = _env_float("JOB_RESULT_TTL_SECONDS", 3600.0)
+# Hint sent back in the Retry-After header when the queue is full.
+JOB_RETRY_AFTER_SECONDS = _env_int("JOB_RETRY_AFTER_SECONDS", 5)
+
+## Request deadlines (see deadlines.py)
+# Seconds an analysis may run (parsing, verification and analyses together),
+# counted from when its job starts. When it runs out, or the streaming client
+# disconnects, outstanding work is cancelled and the finished task outputs are
+# returned marked partial. 0 disables the limit.
+REQUEST_DEADLINE_SECONDS = _env_float("REQUEST_DEADLINE_SECONDS", 180.0)
+# Largest deadline a request may ask for with its deadline_seconds field.
+REQUEST_DEADLINE_MAX_SECONDS = _env_float("REQUEST_DEADLINE_MAX_SECONDS", 900.0)
+
+## Request coalescing (see coalescing.py)
+# Identical requests (same file, normalized query, tasks and patient fields)
+# arriving while one is in flight share its run instead of starting their own.
+COALESCE_REQUESTS = _env_bool("COALESCE_REQUESTS", True)
+
+## Parsed report text cache (see report_cache.py)
+# Entries kept in the in-memory LRU tier.
+REPORT_CACHE_MAX_ENTRIES = _env_int("REPORT_CACHE_MAX_ENTRIES", 128)
+# Directory for the on-disk tier; leave empty to keep the cache in memory only.
+REPORT_CACHE_DIR = os.getenv("REPORT_CACHE_DIR", "").strip()
+# Total size cap and entry lifetime of the on-disk tier.
+REPORT_CACHE_DISK_MAX_BYTES = _env_int("REPORT_CACHE_DISK_MAX_BYTES", 256 * 1024 * 1024)
+REPORT_CACHE_DISK_TTL_SECONDS = _env_float("REPORT_CACHE_DISK_TTL_SECONDS", 7 * 24 * 3600.0)
+
+## Analysis pipeline (see pipeline.py)
+# Tasks run when a request does not choose any. "verification" gates the rest,
+# which run concurrently.
+PIPELINE_DEFAULT_TASKS = os.getenv("PIPELINE_DEFAULT_TASKS", "verification,summary,nutrition,exercise")
+
+## Local pre-verification (see preverify.py)
+# Score at or below which an upload is rejected with 422 without any LLM call.
+PREVERIFY_REJECT_SCORE = _env_float("PREVERIFY_REJECT_SCORE", 0.15)
+# Score at or above which the LLM verification task is skipped.
+PREVERIFY_ACCEPT_SCORE = _env_float("PREVERIFY_ACCEPT_SCORE", 0.6)
+# Reports with more pages than this are rejected outright.
+PREVERIFY_MAX_PAGES = _env_int("PREVERIFY_MAX_PAGES", 50)
+
+## Tool execution (see tool_bridge.py)
+# Blocking tool work (PDF parsing) allowed to run at the same time.
+TOOL_MAX_CONCURRENCY = _env_int("TOOL_MAX_CONCURRENCY", 4)
+
+## PDF text extraction (see pdf_extract.py)
+# Worker processes parsing pages of large reports in parallel.
+PDF_WORKERS = _env_int("PDF_WORKERS", min(4, os.cpu_count() or 1))
+# Reports with fewer pages are parsed in-process; the pool is not worth it.
+PDF_PARALLEL_MIN_PAGES = _env_int("PDF_PARALLEL_MIN_PAGES", 8)
+# Pages handed to a worker per task (each task re-opens the file).
+PDF_PAGES_PER_TASK = _env_int("PDF_PAGES_PER_TASK", 4)
+# Only the first PDF_MAX_PAGES pages are extracted, bounding worst-case cost.
+PDF_MAX_PAGES = _env_int("PDF_MAX_PAGES", 100)
+
+## Crew result cache (see result_cache.py)
+# "memory", "sqlite" or "off".
+RESULT_CACHE_BACKEND = os.getenv("RESULT_CACHE_BACKEND", "memory").strip().lower()
+# Database file of the sqlite backend.
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", os.path.join("cache", "results.sqlite3"))
+RESULT_CACHE_TTL_SECONDS = _env_float("RESULT_CACHE_TTL_SECONDS", 24 * 3600.0)
+RESULT_CACHE_MAX_ENTRIES = _env_int("RESULT_CACHE_MAX_ENTRIES", 1024)
+
+## Crew instance pool (see crew_pool.py)
+# Pre-built crews; one is checked out per request. Defaults to one per job worker.
+CREW_POOL_SIZE = _env_int("CREW_POOL_SIZE", JOB_WORKERS)
+# Seconds a request waits for a free crew before failing.
+CREW_POOL_CHECKOUT_TIMEOUT = _env_float("CREW_POOL_CHECKOUT_TIMEOUT", 300.0)
+
+## Rate governor (see governor.py)
+# Process-wide budgets shared by every agent instead of per-agent max_rpm.
+LLM_MAX_RPM = _env_int("LLM_MAX_RPM", 60)
+LLM_MAX_TPM = _env_int("LLM_MAX_TPM", 200000)
+SEARCH_MAX_RPM = _env_int("SEARCH_MAX_RPM", 30)
+# Per-agent settings; AGENT_MAX_RPM=0 leaves throttling to the governor.
+AGENT_MAX_ITER = _env_int("AGENT_MAX_ITER", 5)
+AGENT_MAX_RPM = _env_int("AGENT_MAX_RPM", 0)
+
+## Web search (see search.py)
+# Point SERPER_BASE_URL at a local stub server to test without Serper.
+SERPER_BASE_URL = os.getenv("SERPER_BASE_URL", "https://google.serper.dev").rstrip("/")
+SERPER_API_KEY = os.getenv("SERPER_API_KEY", "")
+SEARCH_TIMEOUT_SECONDS = _env_float("SEARCH_TIMEOUT_SECONDS", 10.0)
+# Organic results kept per query.
+SEARCH_RESULTS = _env_int("SEARCH_RESULTS", 5)
+SEARCH_CACHE_TTL_SECONDS = _env_float("SEARCH_CACHE_TTL_SECONDS", 24 * 3600.0)
+SEARCH_CACHE_MAX_ENTRIES = _env_int("SEARCH_CACHE_MAX_ENTRIES", 1000)
+# Pre-computed results for common marker questions, served without a request.
+SEARCH_SEED_FILE = os.getenv("SEARCH_SEED_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "reference", "search_seed.json"))
+# Never call Serper: searches are answered from the local reference index and
+# agents are only given the local lookup tool.
+SEARCH_OFFLINE = _env_bool("SEARCH_OFFLINE", False)
+
+## Local medical reference index (see reference_index.py)
+# Markdown files whose "## " sections are the passages (the search seed answers are added).
+REFERENCE_CORPUS_DIR = os.getenv("REFERENCE_CORPUS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "reference", "corpus"))
+# Built on first use if missing; rebuild with `python reference_index.py build`.
+REFERENCE_INDEX_DIR = os.getenv("REFERENCE_INDEX_DIR", os.path.join("cache", "reference_index"))
+# Hashed embedding width; changing it rebuilds the index.
+REFERENCE_INDEX_DIM = _env_int("REFERENCE_INDEX_DIM", 1024)
+# Passages returned per lookup, and the cosine similarity a passage needs to be returned.
+REFERENCE_TOP_K = _env_int("REFERENCE_TOP_K", 3)
+REFERENCE_MIN_SCORE = _env_float("REFERENCE_MIN_SCORE", 0.1)
+
+## Observability (see observability.py)
+# Log every finished span as a JSON line with its request id (logger
+# "analyser.spans"). Off by default: a crew run finishes hundreds of spans.
+SPAN_LOG = _env_bool("SPAN_LOG", False)
+# Add a Server-Timing header (spans finished before the response) to responses.
+SERVER_TIMING = _env_bool("SERVER_TIMING", True)
+# Level of the application log on stderr (records carry their request id).
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").strip().upper() or "INFO"
+
+## Report compaction (see compaction.py)
+# Estimated tokens of report text handed to an agent; 0 disables truncation.
+COMPACTION_TOKEN_BUDGET = _env_int("COMPACTION_TOKEN_BUDGET", 1500)
+# Text found on at least this share of pages (and on 2 or more) counts as
+# header/footer boilerplate and is kept only once.
+COMPACTION_REPEAT_SHARE = _env_float("COMPACTION_REPEAT_SHARE", 0.5)
+# Compacted reports memoized per process.
+COMPACTION_CACHE_ENTRIES = _env_int("COMPACTION_CACHE_ENTRIES", 64)
+
+## Startup and serving (see startup.py, launch.py)
+# Warm-up of crewai, the agents, the crew pool and the PDF workers:
+#   background - start serving at once; /ready answers 503 until warm (default)
+#   blocking   - finish the warm-up before accepting requests
+#   off        - no warm-up; the first requests pay for the lazy imports
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "background").strip().lower()
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = _env_int("PORT", 8000)
+# Server processes started by launch.py. Each one has its own job queue, crew
+# pool and PDF workers, so memory grows with this number.
+WEB_WORKERS = _env_int("WEB_WORKERS", 2)
+
+## Patient marker history (see history.py)
+# SQLite file of the markers of every report analysed with a patient_id. Patient
+# health data is only stored when this is set (e.g. cache/history.sqlite3).
+HISTORY_DB_PATH = os.getenv("HISTORY_DB_PATH", "").strip()
+# Read numeric report dates like 03/04/2024 as day/month (off: month/day).
+HISTORY_DAY_FIRST = _env_bool("HISTORY_DAY_FIRST", True)
+# Changes smaller than this (in percent, with an unchanged flag) are summarised as stable.
+HISTORY_STABLE_PERCENT = _env_float("HISTORY_STABLE_PERCENT", 5.0)
+
+## OCR of scanned pages (see ocr.py)
+# Needs pytesseract, Pillow and the tesseract binary; pypdfium2 for rendering.
+OCR_ENABLED = _env_bool("OCR_ENABLED", True)
+# Pages whose text layer has fewer characters than this are read by OCR.
+OCR_MIN_CHARS = _env_int("OCR_MIN_CHARS", 20)
+# Worker processes of the OCR pool (one page per task).
+OCR_WORKERS = _env_int("OCR_WORKERS", min(2, os.cpu_count() or 1))
+# Pages are rendered at OCR_DPI, lowered if that would exceed OCR_MAX_PIXELS;
+# embedded scans above OCR_DPI are downscaled.
+OCR_DPI = _env_int("OCR_DPI", 300)
+OCR_MAX_PIXELS = _env_int("OCR_MAX_PIXELS", 12_000_000)
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+# Seconds for all OCR pages of one document; pages not done by then stay empty.
+OCR_DOCUMENT_TIMEOUT_SECONDS = _env_float("OCR_DOCUMENT_TIMEOUT_SECONDS", 120.0)
+# OCR text kept per process, by page-image hash.
+OCR_CACHE_ENTRIES = _env_int("OCR_CACHE_ENTRIES", 512)
+# Path of the tesseract binary if it is not on PATH.
+OCR_TESSERACT_CMD = os.getenv("OCR_TESSERACT_CMD", "")
+
+## Reference-range evaluation (see reference_eval.py)
+# Age/sex-stratified ranges (JSON list); markers.DEFAULT_RANGES covers the rest.
+REFERENCE_RANGES_PATH = os.getenv("REFERENCE_RANGES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "reference", "reference_ranges.json"))
+# Use the range printed on the report where there is one (off: always the tables).
+EVAL_PREFER_REPORT_RANGES = _env_bool("EVAL_PREFER_REPORT_RANGES", True)
+# Age assumed for reports that do not print one (picks the adult bands).
+EVAL_ASSUMED_AGE = _env_float("EVAL_ASSUMED_AGE", 40.0)
+# Severity tiers of out-of-range values: moderate/severe from this |z| on, or
+# from this far past the limit (as a fraction of the limit, for one-sided ranges too).
+EVAL_Z_MODERATE = _env_float("EVAL_Z_MODERATE", 3.0)
+EVAL_Z_SEVERE = _env_float("EVAL_Z_SEVERE", 4.0)
+EVAL_EXCESS_MODERATE = _env_float("EVAL_EXCESS_MODERATE", 0.25)
+EVAL_EXCESS_SEVERE = _env_float("EVAL_EXCESS_SEVERE", 0.5)
+
+## Batch analysis (see batches.py)
+# Reports accepted per batch, counting the PDFs inside uploaded zips.
+BATCH_MAX_FILES = _env_int("BATCH_MAX_FILES", 100)
+# Reports of a batch pre-verified and parsed at the same time.
+BATCH_PARSE_WORKERS = _env_int("BATCH_PARSE_WORKERS", PDF_WORKERS)
+# Job queue slots all batches together may hold; the rest stay free for
+# interactive requests. Defaults to one per job worker.
+BATCH_MAX_IN_FLIGHT = _env_int("BATCH_MAX_IN_FLIGHT", JOB_WORKERS)
+# Longest a parsed report waits for one of those slots (and then for a job
+# queue slot) before it is marked failed; 0 waits as long as it takes.
+BATCH_QUEUE_TIMEOUT_SECONDS = _env_float("BATCH_QUEUE_TIMEOUT_SECONDS", 1800.0)
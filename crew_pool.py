@@ -0,0 +1,224 @@
+## Pool of pre-built, isolated crew instances
+# run_crew used to build Crew objects per request around the module-level agent
+# and task singletons, which concurrent requests then mutated at the same time
+# (crewai interpolates inputs into task descriptions in place). Each pooled
+# instance owns its own agents, tasks and crews; a request checks one out,
+# uses it exclusively and returns it after it has been reset.
+# crewai and the agent/task modules are imported when the first instance is
+# built (lifespan warm-up or first request), not when this module is imported.
+import logging
+import queue
+import threading
+from contextlib import contextmanager
+
+import config
+from deadlines import check_deadline
+from observability import span
+
+logger = logging.getLogger(__name__)
+
+
+class CrewPoolTimeoutError(Exception):
+    """Raised when no crew instance frees up within the checkout timeout."""
+
+
+class CrewInstance:
+    """One isolated set of agents, tasks and single-task crews.
+
+    Args:
+        agents (dict): Agents by name (agents.build_agents()).
+        tasks (dict): Tasks by name (task.build_tasks(agents)).
+    """
+
+    def __init__(self, agents: dict, tasks: dict):
+        from crewai import Crew, Process
+
+        self.agents = agents
+        self.tasks = tasks
+        self.crews = {
+            name: Crew(
+                agents=[task.agent],
+                tasks=[task],
+                process=Process.sequential,
+                verbose=True
+            )
+            for name, task in tasks.items()
+        }
+        # Templates to restore after crewai interpolates kickoff inputs
+        self._templates = {
+            name: (task.description, task.expected_output) for name, task in tasks.items()
+        }
+        # Futures of kickoffs a run stopped waiting for (deadline or
+        # disconnect); the pool takes the instance back once they are done
+        self.stragglers = []
+
+    def kickoff(self, task_name: str, inputs: dict, step_callback=None):
+        """Runs the crew for one task (by task.py name, e.g. 'help_patients').
+
+        Every agent step is a cancellation point: once the request's deadline is
+        up the kickoff raises DeadlineExceeded instead of taking another step.
+
+        Args:
+            step_callback (callable, optional): Called with each intermediate agent step.
+        """
+        check_deadline()
+        crew = self.crews[task_name]
+
+        def on_step(step):
+            if step_callback:
+                step_callback(step)
+            check_deadline()
+        crew.step_callback = on_step
+        with span(f"task.{task_name}"):
+            return crew.kickoff(inputs)
+
+    def reset(self):
+        """Clears per-request state so the next checkout starts clean."""
+        for name, task in self.tasks.items():
+            description, expected_output = self._templates[name]
+            task.description = description
+            task.expected_output = expected_output
+            task.output = None
+        for crew in self.crews.values():
+            crew.step_callback = None
+            if getattr(crew, "memory", False) and hasattr(crew, "reset_memories"):
+                crew.reset_memories(command_type="all")
+
+
+def build_crew_instance() -> CrewInstance:
+    """Factory of fresh, fully independent crew instances."""
+    from agents import build_agents
+    from task import build_tasks
+
+    agents = build_agents()
+    return CrewInstance(agents, build_tasks(agents))
+
+
+class CrewPool:
+    """Fixed-size pool of crew instances, built up front.
+
+    Args:
+        factory (callable): Returns a new CrewInstance.
+        size (int): Number of instances.
+        checkout_timeout (float): Seconds checkout() waits for a free instance.
+    """
+
+    def __init__(self, factory=build_crew_instance, size: int = None, checkout_timeout: float = None):
+        self.factory = factory
+        self.size = max(1, size if size is not None else config.CREW_POOL_SIZE)
+        self.checkout_timeout = config.CREW_POOL_CHECKOUT_TIMEOUT if checkout_timeout is None else checkout_timeout
+        self._idle = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.replaced = 0
+        self.abandoned = 0
+        # Instances out of the pool until their cut-off kickoffs stop
+        self.held = 0
+
+    def warm(self):
+        """Builds every instance now instead of on first demand."""
+        with self._lock:
+            while self._created < self.size:
+                self._idle.put(self.factory())
+                self._created += 1
+
+    @contextmanager
+    def checkout(self, timeout: float = None):
+        """Context manager lending an instance for exclusive use.
+
+        Raises:
+            CrewPoolTimeoutError: If none is free within the timeout.
+        """
+        instance = self._acquire(self.checkout_timeout if timeout is None else timeout)
+        self.checkouts += 1
+        try:
+            yield instance
+        finally:
+            self._release(instance)
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "created": self._created,
+            "idle": self._idle.qsize(),
+            "checkouts": self.checkouts,
+            "replaced": self.replaced,
+            "abandoned": self.abandoned,
+            "held": self.held,
+        }
+
+    def _acquire(self, timeout: float) -> CrewInstance:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        # Build lazily up to the pool size if warm() was not called
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                build = True
+            else:
+                build = False
+        if build:
+            try:
+                return self.factory()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise CrewPoolTimeoutError(f"No crew instance free after {timeout}s (pool size {self.size})")
+
+    def _release(self, instance: CrewInstance):
+        if instance.stragglers:
+            # Cut-off kickoffs run on until their next deadline check. Building
+            # a replacement meanwhile would let them pile up beyond the pool
+            # size, so the instance keeps its slot until they stop.
+            self.abandoned += 1
+            self._hold_until_done(instance, instance.stragglers)
+            return
+        self._return(instance)
+
+    def _hold_until_done(self, instance: CrewInstance, futures: list):
+        """Returns instance to the pool once every one of futures is done."""
+        remaining = [len(futures)]
+        with self._lock:
+            self.held += 1
+        logger.info("Crew instance still running %d cancelled kickoff(s), returning it to the pool when they stop",
+                    len(futures))
+
+        def done(_future):
+            with self._lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+                self.held -= 1
+            instance.stragglers = []
+            self._return(instance)
+        for future in futures:
+            future.add_done_callback(done)
+
+    def _return(self, instance: CrewInstance):
+        try:
+            instance.reset()
+        except Exception:
+            # Do not hand out an instance in an unknown state
+            logger.exception("Crew instance reset failed, replacing it")
+            self._replace()
+            return
+        self._idle.put(instance)
+
+    def _replace(self):
+        """Puts a new instance in the place of one that cannot be reused."""
+        try:
+            instance = self.factory()
+            self.replaced += 1
+        except Exception:
+            logger.exception("Could not build a replacement crew instance")
+            with self._lock:
+                self._created -= 1
+            return
+        self._idle.put(instance)
@@ -0,0 +1,152 @@
+## Per-request deadlines and cancellation
+# run_crew had no timeout: a hung LLM or tool call held a job worker forever,
+# and a client hanging up changed nothing. Every analysis now runs under a
+# Deadline, carried in a contextvar so bind_context hands it to the branch and
+# tool threads. Threads cannot be killed, so cancellation is cooperative: the
+# pipeline stops waiting for its crews once the deadline passes (or the client
+# disconnects) and returns the tasks that finished, marked partial, while the
+# cut-off work fails at its next check (LLM call, tool call, agent step, PDF
+# page) instead of running on.
+import contextvars
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from contextlib import contextmanager
+
+import config
+
+REASON_DEADLINE = "deadline"
+REASON_DISCONNECTED = "client_disconnected"
+
+# Longest a wait on crew futures sleeps before looking for a cancellation
+POLL_SECONDS = 0.25
+
+_current = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Raised at a cancellation point once the request's deadline passed or it was cancelled."""
+
+    def __init__(self, deadline: "Deadline"):
+        super().__init__(deadline.describe())
+        self.reason = deadline.reason
+
+
+class Deadline:
+    """Time budget of one analysis, which can also be cancelled early.
+
+    The clock starts when the Deadline is created, i.e. when its job starts
+    running, so time spent queued for a worker does not count.
+
+    Args:
+        seconds (float, optional): Budget; 0 or less means no time limit (it can
+            still be cancelled). Defaults to config.REQUEST_DEADLINE_SECONDS.
+    """
+
+    def __init__(self, seconds: float = None):
+        self.seconds = config.REQUEST_DEADLINE_SECONDS if seconds is None else seconds
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + self.seconds if self.seconds > 0 else None
+        self.reason = None
+        self._lock = threading.Lock()
+
+    def cancel(self, reason: str = REASON_DISCONNECTED):
+        """Ends the budget now; the first reason given sticks."""
+        with self._lock:
+            if self.reason is None:
+                self.reason = reason
+
+    @property
+    def expired(self) -> bool:
+        if self.reason is None and self.expires_at is not None and time.monotonic() >= self.expires_at:
+            self.cancel(REASON_DEADLINE)
+        return self.reason is not None
+
+    def remaining(self):
+        """Seconds left (0 once expired or cancelled), or None without a time limit."""
+        if self.expired:
+            return 0.0
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def check(self):
+        """Raises DeadlineExceeded once expired or cancelled."""
+        if self.expired:
+            raise DeadlineExceeded(self)
+
+    def describe(self) -> str:
+        if self.reason == REASON_DISCONNECTED:
+            return "Cancelled: the client disconnected"
+        return f"Deadline of {self.seconds:g}s exceeded"
+
+    def to_dict(self) -> dict:
+        expired = self.expired
+        return {
+            "seconds": self.seconds,
+            "elapsed_seconds": round(time.monotonic() - self.started_at, 3),
+            "expired": expired,
+            "reason": self.reason,
+        }
+
+
+def current_deadline():
+    """Deadline of the analysis the calling code works for, or None."""
+    return _current.get()
+
+
+@contextmanager
+def deadline_scope(deadline: Deadline):
+    """Runs the block (and what bind_context hands to other threads) under deadline."""
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+async def bind_deadline(coro, deadline: Deadline):
+    """Awaits coro under deadline (for coroutines handed to another thread's event loop)."""
+    _current.set(deadline)
+    return await coro
+
+
+def check_deadline():
+    """Cancellation point: raises DeadlineExceeded if the current deadline is up."""
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.check()
+
+
+def deadline_expired() -> bool:
+    deadline = _current.get()
+    return deadline is not None and deadline.expired
+
+
+def remaining_time(timeout: float = None):
+    """The shorter of timeout and the time left before the current deadline (None: no limit)."""
+    deadline = _current.get()
+    remaining = deadline.remaining() if deadline is not None else None
+    if remaining is None:
+        return timeout
+    return remaining if timeout is None else min(timeout, remaining)
+
+
+def completed_before_deadline(futures):
+    """Yields futures as they complete, like as_completed, until the current deadline is up.
+
+    Futures still running at that point are simply not yielded; the caller
+    decides what to do with them.
+    """
+    deadline = _current.get()
+    pending = set(futures)
+    while pending:
+        if deadline is not None and deadline.expired:
+            return
+        timeout = None
+        if deadline is not None:
+            remaining = deadline.remaining()
+            # Wake up now and then to notice a cancellation
+            timeout = POLL_SECONDS if remaining is None else min(POLL_SECONDS, remaining)
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        yield from done
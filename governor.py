@@ -0,0 +1,247 @@
+## Process-wide rate governor for LLM and search calls
+# Every agent used to throttle itself with max_rpm=1, which kept the crew far
+# below the provider quota. One set of token buckets per resource now enforces
+# requests-per-minute and tokens-per-minute budgets for the whole process, and
+# interactive requests get ahead of batch work when both are waiting.
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+import config
+from deadlines import current_deadline
+from observability import span, LLM_CALLS, LLM_TOKENS
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BATCH = "batch"
+PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_BATCH)
+
+# Rough size of a token in English text; used instead of a real tokenizer
+CHARS_PER_TOKEN = 4
+
+# A contextvar, so bind_context hands it to the branch and tool threads
+_priority = contextvars.ContextVar("priority", default=PRIORITY_INTERACTIVE)
+
+
+def current_priority() -> str:
+    """Priority class of the calling code (interactive unless set otherwise)."""
+    return _priority.get()
+
+
+@contextmanager
+def priority_scope(priority: str):
+    """Runs the block, and the governed calls it makes, at `priority`."""
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown priority '{priority}'. Choose from: {', '.join(PRIORITIES)}")
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about CHARS_PER_TOKEN characters per token)."""
+    return max(1, len(text or "") // CHARS_PER_TOKEN)
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `per_minute` / 60 per second.
+
+    The level may go negative when usage is charged after the fact (e.g. LLM
+    completion tokens); later callers then wait for the debt to refill.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = float(per_minute) / 60.0
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` can be taken (0 if available now)."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        self._refill()
+        self.level -= amount
+
+
+class _Resource:
+    def __init__(self, rpm: int, tpm: int):
+        self.requests = TokenBucket(rpm) if rpm and rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm and tpm > 0 else None
+        self.waiting = {priority: 0 for priority in PRIORITIES}
+        self.granted = 0
+        self.waited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.tokens_used = 0
+
+
+class RateGovernor:
+    """Shared RPM/TPM budgets per resource ("llm", "search", ...).
+
+    Args:
+        limits (dict): resource -> (requests per minute, tokens per minute);
+            a falsy limit means unlimited.
+    """
+
+    def __init__(self, limits: dict):
+        self._cond = threading.Condition()
+        self._resources = {name: _Resource(rpm, tpm) for name, (rpm, tpm) in limits.items()}
+
+    def acquire(self, resource: str, tokens: int = 0, priority: str = None, deadline=None) -> float:
+        """Blocks until one request (and `tokens` tokens) fit the budget.
+
+        Batch callers wait while any interactive caller is waiting for the same
+        resource.
+
+        Args:
+            deadline (deadlines.Deadline, optional): Stop waiting when it is up.
+                Defaults to the calling request's deadline.
+
+        Returns:
+            float: Seconds spent waiting.
+
+        Raises:
+            DeadlineExceeded: If the deadline is up before the budget allows the call.
+        """
+        priority = priority or current_priority()
+        if deadline is None:
+            deadline = current_deadline()
+        start = time.monotonic()
+        with self._cond:
+            res = self._resources.get(resource)
+            if res is None:
+                return 0.0
+            res.waiting[priority] += 1
+            try:
+                while True:
+                    if deadline is not None:
+                        deadline.check()
+                    if priority == PRIORITY_BATCH and res.waiting[PRIORITY_INTERACTIVE]:
+                        self._cond.wait(0.05)
+                        continue
+                    wait = 0.0
+                    if res.requests:
+                        wait = max(wait, res.requests.wait_time(1))
+                    if res.tokens and tokens:
+                        wait = max(wait, res.tokens.wait_time(tokens))
+                    if wait <= 0:
+                        break
+                    remaining = deadline.remaining() if deadline is not None else None
+                    self._cond.wait(wait if remaining is None else min(wait, remaining))
+                if res.requests:
+                    res.requests.take(1)
+                if res.tokens and tokens:
+                    res.tokens.take(tokens)
+            finally:
+                res.waiting[priority] -= 1
+                self._cond.notify_all()
+
+            waited = time.monotonic() - start
+            res.granted += 1
+            res.tokens_used += tokens
+            res.total_wait += waited
+            res.max_wait = max(res.max_wait, waited)
+            if waited > 0.001:
+                res.waited += 1
+        return waited
+
+    def charge(self, resource: str, tokens: int):
+        """Bills tokens only known after the call (e.g. the completion)."""
+        with self._cond:
+            res = self._resources.get(resource)
+            if res is None or not tokens:
+                return
+            res.tokens_used += tokens
+            if res.tokens:
+                res.tokens.take(tokens)
+
+    def stats(self) -> dict:
+        """Per-resource grants, queue wait times and current waiters."""
+        with self._cond:
+            return {
+                name: {
+                    "granted": res.granted,
+                    "waited": res.waited,
+                    "total_wait_seconds": round(res.total_wait, 4),
+                    "avg_wait_seconds": round(res.total_wait / res.granted, 4) if res.granted else 0.0,
+                    "max_wait_seconds": round(res.max_wait, 4),
+                    "waiting": dict(res.waiting),
+                    "tokens_used": res.tokens_used,
+                }
+                for name, res in self._resources.items()
+            }
+
+
+class GovernedLLM:
+    """Wraps an LLM so every call goes through the governor's "llm" budget.
+
+    Prompt tokens are reserved up front, completion tokens charged afterwards.
+    Attributes other than the call methods are forwarded to the wrapped LLM.
+    Calls are refused (DeadlineExceeded) once the request's deadline is up.
+    """
+
+    def __init__(self, llm, governor: "RateGovernor" = None, resource: str = "llm"):
+        self._llm = llm
+        self._governor = governor
+        self._resource = resource
+
+    @property
+    def governor(self) -> "RateGovernor":
+        return self._governor or rate_governor
+
+    def _acquire(self, prompt, attributes: dict):
+        prompt_tokens = estimate_tokens(str(prompt))
+        waited = self.governor.acquire(self._resource, prompt_tokens)
+        attributes["wait_ms"] = round(waited * 1000, 2)
+        attributes["prompt_tokens"] = prompt_tokens
+        LLM_CALLS.inc(resource=self._resource)
+        LLM_TOKENS.inc(prompt_tokens, resource=self._resource, kind="prompt")
+
+    def _charge(self, output, attributes: dict):
+        completion_tokens = estimate_tokens(str(output))
+        self.governor.charge(self._resource, completion_tokens)
+        attributes["completion_tokens"] = attributes.get("completion_tokens", 0) + completion_tokens
+        LLM_TOKENS.inc(completion_tokens, resource=self._resource, kind="completion")
+
+    def invoke(self, prompt, *args, **kwargs):
+        with span("llm", resource=self._resource) as attributes:
+            self._acquire(prompt, attributes)
+            result = self._llm.invoke(prompt, *args, **kwargs)
+            self._charge(result, attributes)
+            return result
+
+    def call(self, prompt, *args, **kwargs):
+        with span("llm", resource=self._resource) as attributes:
+            self._acquire(prompt, attributes)
+            result = self._llm.call(prompt, *args, **kwargs)
+            self._charge(result, attributes)
+            return result
+
+    def stream(self, prompt, *args, **kwargs):
+        with span("llm", resource=self._resource, stream=True) as attributes:
+            self._acquire(prompt, attributes)
+            for chunk in self._llm.stream(prompt, *args, **kwargs):
+                self._charge(chunk, attributes)
+                yield chunk
+
+    def __getattr__(self, name):
+        return getattr(self._llm, name)
+
+
+rate_governor = RateGovernor({
+    "llm": (config.LLM_MAX_RPM, config.LLM_MAX_TPM),
+    "search": (config.SEARCH_MAX_RPM, 0),
+})
@@ -0,0 +1,419 @@
+## Longitudinal marker history per patient
+# Every /analyze call was stateless: the upload was deleted afterwards, so
+# comparing a patient's new report with earlier ones meant uploading and parsing
+# all of them again and handing several full reports to the doctor agent. With
+# a patient id, the markers extracted from each report are now kept in a local
+# SQLite file indexed by (patient, marker, date). Trends and "changed since the
+# last report" summaries are plain index lookups, and only that summary of
+# deltas reaches the agent.
+import datetime
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+import config
+from markers import extract_markers, MARKER_SYNONYMS, FLAG_LOW, FLAG_HIGH
+
+NO_PATIENT = "No patient history was provided for this report."
+NO_EARLIER_REPORTS = "This is the first report on file for this patient; there are no earlier values to compare."
+
+_MONTHS = "jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec"
+_DATE_PATTERN = (
+    r"\d{4}-\d{1,2}-\d{1,2}"
+    r"|\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}"
+    r"|\d{1,2}[ -](?:" + _MONTHS + r")[a-z]*[ ,-]+\d{4}"
+)
+_DATE_RE = re.compile(r"(?<!\d)(?:" + _DATE_PATTERN + r")(?!\d)", re.IGNORECASE)
+# Dates labelled as the sample or report date win over any other date (e.g. birth date)
+_LABELLED_DATE_RE = re.compile(
+    r"(?:collected|collection|sample|sampling|drawn|reported|report|received|registered)"
+    r"[\w ]{0,12}?[:\-]?\s*(?P<date>" + _DATE_PATTERN + r")",
+    re.IGNORECASE,
+)
+_DATE_FORMATS_DAY_FIRST = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%d/%m/%y", "%d-%m-%y", "%d.%m.%y",
+                           "%d %b %Y", "%d-%b-%Y", "%d %B %Y", "%d-%B-%Y", "%d %b, %Y", "%d %B, %Y")
+_DATE_FORMATS_MONTH_FIRST = ("%Y-%m-%d", "%m/%d/%Y", "%m-%d-%Y", "%m.%d.%Y", "%m/%d/%y", "%m-%d-%y", "%m.%d.%y",
+                             "%d %b %Y", "%d-%b-%Y", "%d %B %Y", "%d-%B-%Y", "%d %b, %Y", "%d %B, %Y")
+
+
+def parse_date(text: str):
+    """ISO date (YYYY-MM-DD) of a date string, or None if it is not one.
+
+    Numeric dates are read day first unless config.HISTORY_DAY_FIRST is off.
+    """
+    text = (text or "").strip()
+    if not text:
+        return None
+    text = re.sub(r"\bsept\b", "sep", text, flags=re.IGNORECASE)
+    formats = _DATE_FORMATS_DAY_FIRST if config.HISTORY_DAY_FIRST else _DATE_FORMATS_MONTH_FIRST
+    for fmt in formats:
+        try:
+            return datetime.datetime.strptime(text, fmt).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def find_report_date(text: str):
+    """Sample/report date printed in the report text, as an ISO date, or None."""
+    for match in _LABELLED_DATE_RE.finditer(text or ""):
+        date = parse_date(match.group("date"))
+        if date:
+            return date
+    for match in _DATE_RE.finditer(text or ""):
+        date = parse_date(match.group(0))
+        if date:
+            return date
+    return None
+
+
+class MarkerChange:
+    """One marker of a report next to its last earlier reading."""
+
+    def __init__(self, row: tuple, previous: tuple = None):
+        self.marker, self.value, self.unit, self.flag = row
+        self.previous_value = self.previous_unit = self.previous_flag = self.previous_date = None
+        if previous is not None:
+            self.previous_value, self.previous_unit, self.previous_flag, self.previous_date = previous
+
+    @property
+    def name(self) -> str:
+        return MARKER_SYNONYMS[self.marker][0] if self.marker in MARKER_SYNONYMS else self.marker
+
+    @property
+    def comparable(self) -> bool:
+        return self.previous_value is not None and self.previous_unit == self.unit
+
+    @property
+    def delta(self):
+        return round(self.value - self.previous_value, 4) if self.comparable else None
+
+    @property
+    def percent(self):
+        if not self.comparable or not self.previous_value:
+            return None
+        return round(100.0 * (self.value - self.previous_value) / abs(self.previous_value), 1)
+
+    @property
+    def stable(self) -> bool:
+        percent = self.percent
+        return (self.comparable and self.flag == self.previous_flag
+                and (percent is None or abs(percent) < config.HISTORY_STABLE_PERCENT))
+
+    def to_dict(self) -> dict:
+        return {
+            "marker": self.marker,
+            "name": self.name,
+            "value": self.value,
+            "unit": self.unit,
+            "flag": self.flag,
+            "previous_value": self.previous_value,
+            "previous_unit": self.previous_unit,
+            "previous_flag": self.previous_flag,
+            "previous_date": self.previous_date,
+            "delta": self.delta,
+            "percent": self.percent,
+            "stable": self.stable,
+        }
+
+    def to_row(self) -> str:
+        """e.g. 'Glucose: 130 mg/dL (was 110 on 2024-01-10; +20, +18.2%) high, was normal'."""
+        row = f"{self.name}: {self.value:g} {self.unit or ''}".rstrip()
+        if self.comparable:
+            row += f" (was {self.previous_value:g} on {self.previous_date}; {self.delta:+g}"
+            if self.percent is not None:
+                row += f", {self.percent:+g}%"
+            row += ")"
+        elif self.previous_value is not None:
+            row += f" (was {self.previous_value:g} {self.previous_unit or ''} on {self.previous_date}; different unit)"
+        if self.flag:
+            row += f" {self.flag}"
+            if self.previous_flag and self.previous_flag != self.flag:
+                row += f", was {self.previous_flag}"
+        return row
+
+
+class ReportChanges:
+    """A report's markers compared with the patient's earlier readings."""
+
+    def __init__(self, patient_id: str, report_hash: str, report_date: str, earlier_reports: int,
+                 changes: list, dropped: list):
+        self.patient_id = patient_id
+        self.report_hash = report_hash
+        self.report_date = report_date
+        self.earlier_reports = earlier_reports
+        self.changes = changes
+        # Markers of the previous report that this one does not have
+        self.dropped = dropped
+        # reports row inserted by the record_report() call that produced this, if any
+        self.recorded_rowid = None
+
+    def to_dict(self) -> dict:
+        return {
+            "patient_id": self.patient_id,
+            "report_hash": self.report_hash,
+            "report_date": self.report_date,
+            "earlier_reports": self.earlier_reports,
+            "changes": [change.to_dict() for change in self.changes],
+            "not_repeated": self.dropped,
+        }
+
+    def to_text(self) -> str:
+        """Compact summary of the deltas for an agent prompt."""
+        if not self.earlier_reports:
+            return NO_EARLIER_REPORTS
+        changed = [c for c in self.changes if c.previous_value is not None and not c.stable]
+        stable = [c for c in self.changes if c.stable]
+        new = [c for c in self.changes if c.previous_value is None]
+        lines = [f"Report dated {self.report_date}, compared with {self.earlier_reports} earlier report(s) of this patient."]
+        if changed:
+            lines.append("Changed since the last reading:")
+            lines.extend(change.to_row() for change in changed)
+        if stable:
+            lines.append("Stable (within {:g}%): {}".format(
+                config.HISTORY_STABLE_PERCENT, ", ".join(change.name for change in stable)))
+        if new:
+            lines.append("First measured in this report: " + ", ".join(change.name for change in new))
+        if self.dropped:
+            lines.append("Measured before but not in this report: " + ", ".join(
+                MARKER_SYNONYMS[key][0] if key in MARKER_SYNONYMS else key for key in self.dropped))
+        return "\n".join(lines)
+
+
+class MarkerHistory:
+    """SQLite store of extracted markers per (patient, report).
+
+    Args:
+        path (str): Database file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.recorded = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS reports ("
+                "patient_id TEXT NOT NULL, report_hash TEXT NOT NULL, report_date TEXT NOT NULL, "
+                "filename TEXT, recorded_at REAL NOT NULL, PRIMARY KEY (patient_id, report_hash))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS markers ("
+                "patient_id TEXT NOT NULL, report_hash TEXT NOT NULL, report_date TEXT NOT NULL, "
+                "marker TEXT NOT NULL, value REAL NOT NULL, unit TEXT, ref_low REAL, ref_high REAL, flag TEXT, "
+                "PRIMARY KEY (patient_id, report_hash, marker))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS markers_patient_marker_date ON markers (patient_id, marker, report_date)")
+            conn.execute("CREATE INDEX IF NOT EXISTS reports_patient_date ON reports (patient_id, report_date)")
+
+    @contextmanager
+    def _connect(self):
+        """Connection for one operation: committed (or rolled back) and closed at the end.
+
+        sqlite3's own context manager only ends the transaction; the connection
+        and its file handle would stay open.
+        """
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def record(self, patient_id: str, report_hash: str, markers: list, report_date: str = None,
+               filename: str = None) -> Optional[int]:
+        """Stores a report's markers; re-recording the same report replaces them.
+
+        Args:
+            markers (list[Marker]): From markers.extract_markers.
+            report_date (str, optional): ISO date; defaults to today.
+
+        Returns:
+            int: rowid of the reports row this call inserted, or None if the
+                report was already on file.
+        """
+        report_date = report_date or datetime.date.today().isoformat()
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT report_date FROM reports WHERE patient_id = ? AND report_hash = ?",
+                               (patient_id, report_hash)).fetchone()
+            if row is not None and report_date != row[0]:
+                conn.execute("UPDATE reports SET report_date = ? WHERE patient_id = ? AND report_hash = ?",
+                             (report_date, patient_id, report_hash))
+            rowid = None
+            if row is None:
+                rowid = conn.execute(
+                    "INSERT INTO reports (patient_id, report_hash, report_date, filename, recorded_at) "
+                    "VALUES (?, ?, ?, ?, ?)", (patient_id, report_hash, report_date, filename, time.time())).lastrowid
+            conn.execute("DELETE FROM markers WHERE patient_id = ? AND report_hash = ?", (patient_id, report_hash))
+            conn.executemany(
+                "INSERT INTO markers (patient_id, report_hash, report_date, marker, value, unit, ref_low, ref_high, flag) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(patient_id, report_hash, report_date, m.key, m.value, m.unit, m.ref_low, m.ref_high, m.flag)
+                 for m in markers],
+            )
+        self.recorded += 1
+        return rowid
+
+    def record_report(self, patient_id: str, report_hash: str, text: str, filename: str = None,
+                      report_date: str = None) -> ReportChanges:
+        """Extracts and stores a report's markers and compares them with earlier reports.
+
+        The report date is report_date if given, else the date printed in the
+        report, else today.
+        """
+        date = parse_date(report_date) or find_report_date(text)
+        rowid = self.record(patient_id, report_hash, extract_markers(text), date, filename)
+        changes = self.changes(patient_id, report_hash)
+        changes.recorded_rowid = rowid
+        return changes
+
+    def changes(self, patient_id: str, report_hash: str = None):
+        """The report's markers next to each marker's last earlier reading.
+
+        Args:
+            report_hash (str, optional): Defaults to the patient's latest report.
+
+        Returns:
+            ReportChanges: Or None if the patient or report is unknown.
+        """
+        with self._lock, self._connect() as conn:
+            reports = conn.execute(
+                "SELECT report_hash, report_date, recorded_at FROM reports WHERE patient_id = ? "
+                "ORDER BY report_date, recorded_at", (patient_id,)).fetchall()
+            if not reports:
+                return None
+            if report_hash is None:
+                report_hash = reports[-1][0]
+            position = next((i for i, report in enumerate(reports) if report[0] == report_hash), None)
+            if position is None:
+                return None
+            _hash, report_date, recorded_at = reports[position]
+            current = conn.execute(
+                "SELECT marker, value, unit, flag FROM markers WHERE patient_id = ? AND report_hash = ? ORDER BY rowid",
+                (patient_id, report_hash)).fetchall()
+
+            # Latest earlier reading of every marker, via the (patient, marker, date) index
+            earlier = {}
+            for marker, value, unit, flag, date in conn.execute(
+                    "SELECT m.marker, m.value, m.unit, m.flag, m.report_date FROM markers m "
+                    "JOIN reports r ON r.patient_id = m.patient_id AND r.report_hash = m.report_hash "
+                    "WHERE m.patient_id = ? AND (m.report_date < ? OR (m.report_date = ? AND r.recorded_at < ?)) "
+                    "ORDER BY m.report_date, r.recorded_at",
+                    (patient_id, report_date, report_date, recorded_at)):
+                earlier[marker] = (value, unit, flag, date)
+
+            dropped = []
+            if position > 0:
+                previous_hash = reports[position - 1][0]
+                measured = {row[0] for row in current}
+                dropped = [row[0] for row in conn.execute(
+                    "SELECT marker FROM markers WHERE patient_id = ? AND report_hash = ? ORDER BY rowid",
+                    (patient_id, previous_hash)) if row[0] not in measured]
+
+        changes = [MarkerChange(row, earlier.get(row[0])) for row in current]
+        return ReportChanges(patient_id, report_hash, report_date, position, changes, dropped)
+
+    def trend(self, patient_id: str, marker: str = None, limit: int = None) -> dict:
+        """Readings per marker, oldest first.
+
+        Args:
+            marker (str, optional): Marker key (e.g. 'glucose'); all markers if omitted.
+            limit (int, optional): Most recent readings kept per marker.
+
+        Returns:
+            dict: marker key -> list of {date, value, unit, flag, report_hash}.
+        """
+        query = ("SELECT marker, report_date, value, unit, flag, report_hash FROM markers "
+                 "WHERE patient_id = ?")
+        params = [patient_id]
+        if marker:
+            query += " AND marker = ?"
+            params.append(marker)
+        query += " ORDER BY marker, report_date"
+        with self._lock, self._connect() as conn:
+            rows = conn.execute(query, params).fetchall()
+        trends = {}
+        for key, date, value, unit, flag, report_hash in rows:
+            trends.setdefault(key, []).append(
+                {"date": date, "value": value, "unit": unit, "flag": flag, "report_hash": report_hash})
+        if limit:
+            trends = {key: points[-limit:] for key, points in trends.items()}
+        return trends
+
+    def reports(self, patient_id: str) -> list:
+        """The patient's reports, oldest first, with their marker and abnormal counts."""
+        with self._lock, self._connect() as conn:
+            rows = conn.execute(
+                "SELECT r.report_hash, r.report_date, r.filename, COUNT(m.marker), "
+                "SUM(CASE WHEN m.flag IN (?, ?) THEN 1 ELSE 0 END) "
+                "FROM reports r LEFT JOIN markers m ON m.patient_id = r.patient_id AND m.report_hash = r.report_hash "
+                "WHERE r.patient_id = ? GROUP BY r.report_hash ORDER BY r.report_date, r.recorded_at",
+                (FLAG_LOW, FLAG_HIGH, patient_id)).fetchall()
+        return [{"report_hash": report_hash, "report_date": date, "filename": filename,
+                 "markers": count, "abnormal": abnormal or 0}
+                for report_hash, date, filename, count, abnormal in rows]
+
+    def forget_report(self, patient_id: str, report_hash: str, rowid: int = None):
+        """Deletes one report of a patient (e.g. one that failed verification).
+
+        Args:
+            rowid (int, optional): Only delete the report if it is this row
+                (ReportChanges.recorded_rowid), so undoing a request never removes
+                the same report recorded earlier by another one.
+
+        Returns:
+            bool: Whether a report was deleted.
+        """
+        query = "DELETE FROM reports WHERE patient_id = ? AND report_hash = ?"
+        params = [patient_id, report_hash]
+        if rowid is not None:
+            query += " AND rowid = ?"
+            params.append(rowid)
+        with self._lock, self._connect() as conn:
+            if not conn.execute(query, params).rowcount:
+                return False
+            conn.execute("DELETE FROM markers WHERE patient_id = ? AND report_hash = ?", (patient_id, report_hash))
+        return True
+
+    def forget(self, patient_id: str) -> int:
+        """Deletes everything stored for a patient; returns the number of reports removed."""
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM markers WHERE patient_id = ?", (patient_id,))
+            return conn.execute("DELETE FROM reports WHERE patient_id = ?", (patient_id,)).rowcount
+
+    def stats(self) -> dict:
+        with self._lock, self._connect() as conn:
+            patients, reports = conn.execute("SELECT COUNT(DISTINCT patient_id), COUNT(*) FROM reports").fetchone()
+            readings = conn.execute("SELECT COUNT(*) FROM markers").fetchone()[0]
+        return {"patients": patients, "reports": reports, "readings": readings, "recorded": self.recorded}
+
+
+def create_marker_history():
+    """The store at config.HISTORY_DB_PATH, or None if history is disabled."""
+    if not config.HISTORY_DB_PATH:
+        return None
+    return MarkerHistory(config.HISTORY_DB_PATH)
+
+
+_marker_history = None
+_marker_history_lock = threading.Lock()
+
+
+def get_marker_history():
+    """The process-wide store, opened on first use; None unless HISTORY_DB_PATH is set.
+
+    Opening it creates the database file, so importing this module does no I/O.
+    """
+    global _marker_history
+    if not config.HISTORY_DB_PATH:
+        return None
+    with _marker_history_lock:
+        if _marker_history is None:
+            _marker_history = create_marker_history()
+        return _marker_history
@@ -0,0 +1,142 @@
+## Background job queue for long-running crew executions
+# /analyze used to call the blocking `run_crew` straight from an async handler,
+# which froze the event loop for the whole LLM run. Jobs are now handed to a
+# bounded thread pool and clients poll for the outcome.
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from observability import bind_context
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while every worker and queue slot is taken."""
+
+
+class Job:
+    """State of a single submitted job."""
+
+    def __init__(self, job_id: str, metadata: dict = None):
+        self.id = job_id
+        self.status = JOB_QUEUED
+        self.metadata = metadata or {}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JOB_DONE, JOB_FAILED)
+
+    def to_dict(self) -> dict:
+        """Status view of the job (without the result payload)."""
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            **self.metadata,
+        }
+
+
+class JobQueue:
+    """Bounded worker pool that tracks job status by id.
+
+    At most `workers` jobs run at once and at most `max_queued` more wait for a
+    worker; further submissions raise QueueFullError so the API can push back.
+    """
+
+    def __init__(self, workers: int = None, max_queued: int = None, result_ttl: float = None):
+        self.workers = max(1, workers if workers is not None else config.JOB_WORKERS)
+        self.max_queued = max(0, max_queued if max_queued is not None else config.JOB_QUEUE_SIZE)
+        self.result_ttl = result_ttl if result_ttl is not None else config.JOB_RESULT_TTL_SECONDS
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job-worker")
+        # One slot per job that is either waiting or running
+        self._slots = threading.BoundedSemaphore(self.workers + self.max_queued)
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, metadata: dict = None, block: bool = False, timeout: float = None,
+               **kwargs) -> Job:
+        """Schedules fn(*args, **kwargs) and returns its Job without waiting for it to run.
+
+        Args:
+            block (bool, optional): Wait for a free slot instead of failing (batch work).
+            timeout (float, optional): Longest wait when blocking; None waits forever.
+
+        Raises:
+            QueueFullError: If no slot is free (within the timeout when blocking).
+        """
+        acquired = self._slots.acquire(timeout=timeout) if block else self._slots.acquire(blocking=False)
+        if not acquired:
+            raise QueueFullError(f"Job queue is full ({self.workers} running, {self.max_queued} queued)")
+
+        job = Job(str(uuid.uuid4()), metadata)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        try:
+            # The job, and its failure log, keep the submitting request's id and spans
+            self._executor.submit(bind_context(self._run), job, fn, args, kwargs)
+        except Exception:
+            # Executor shut down underneath us; give the slot back
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            self._slots.release()
+            raise
+        return job
+
+    def get(self, job_id: str):
+        """Returns the Job for job_id, or None if unknown or expired."""
+        with self._lock:
+            self._prune()
+            return self._jobs.get(job_id)
+
+    def stats(self) -> dict:
+        """Counts of jobs per status, for health/diagnostics."""
+        counts = {JOB_QUEUED: 0, JOB_RUNNING: 0, JOB_DONE: 0, JOB_FAILED: 0}
+        with self._lock:
+            for job in self._jobs.values():
+                counts[job.status] += 1
+        return {"workers": self.workers, "max_queued": self.max_queued, **counts}
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+    def _run(self, job: Job, fn, args, kwargs):
+        job.status = JOB_RUNNING
+        job.started_at = time.time()
+        try:
+            job.result = fn(*args, **kwargs)
+            job.status = JOB_DONE
+        except Exception as e:
+            logger.exception("Job %s failed", job.id)
+            job.error = str(e)
+            job.status = JOB_FAILED
+        finally:
+            job.finished_at = time.time()
+            self._slots.release()
+
+    def _prune(self):
+        # Caller holds self._lock
+        if self.result_ttl is None or self.result_ttl <= 0:
+            return
+        cutoff = time.time() - self.result_ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
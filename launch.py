@@ -0,0 +1,69 @@
+## Production launcher
+# `python main.py` runs a single development server with auto-reload, which
+# watches the source tree and serves everything from one process. This starts
+# uvicorn with several worker processes and no reloader instead:
+#
+#   python launch.py                      # HOST, PORT, WEB_WORKERS from the environment
+#   python launch.py --workers 4 --port 9000
+#   python launch.py --measure-imports    # where does `import main` spend its time?
+#
+# Each worker warms up on its own (see startup.py); point readiness probes at /ready.
+import argparse
+import subprocess
+import sys
+
+import config
+
+
+def measure_imports(module: str = "main", top: int = 15) -> int:
+    """Imports module in a fresh interpreter with -X importtime and prints the slowest imports.
+
+    Returns:
+        int: The child interpreter's exit code.
+    """
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          capture_output=True, text=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        # "import time:      self [us] |  cumulative | imported package"
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        rows.append((int(fields[1]), int(fields[0]), fields[2].rstrip()))
+    if proc.returncode != 0:
+        print(proc.stderr[-2000:])
+        print(f"import {module} failed with exit code {proc.returncode}")
+        return proc.returncode
+
+    total = next((cumulative for cumulative, _self, name in rows if name.strip() == module), None)
+    if total is not None:
+        print(f"import {module}: {total / 1000:.1f} ms")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for cumulative, self_us, name in sorted(rows, reverse=True)[:top]:
+        print(f"{cumulative / 1000:>14.1f} {self_us / 1000:>9.1f}  {name.strip()}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Blood Test Report Analyser API in production mode.")
+    parser.add_argument("--host", default=config.HOST)
+    parser.add_argument("--port", type=int, default=config.PORT)
+    parser.add_argument("--workers", type=int, default=config.WEB_WORKERS,
+                        help="server processes (default: WEB_WORKERS)")
+    parser.add_argument("--measure-imports", action="store_true",
+                        help="report the import time of main.py and its slowest imports, then exit")
+    parser.add_argument("--top", type=int, default=15, help="imports listed by --measure-imports")
+    args = parser.parse_args()
+
+    if args.measure_imports:
+        sys.exit(measure_imports("main", args.top))
+
+    import uvicorn
+    uvicorn.run("main:app", host=args.host, port=args.port, workers=max(1, args.workers),
+                reload=False)
+
+
+if __name__ == "__main__":
+    main()
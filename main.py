@@ -1,74 +1,325 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+import time
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
 import os
 import uuid
 import asyncio # Import asyncio for running async functions if needed in tools
+import logging
+from contextlib import asynccontextmanager
+from typing import List
 
-# CrewAI imports
-from crewai import Crew, Process # Corrected: Import Crew and Process
-# Assuming 'doctor' agent is correctly defined in agents.py
-# and 'help_patients' task is correctly defined in task.py
-# Make sure these files are structured to expose these objects directly.
-from agents import doctor
-from task import help_patients
-# You also need to ensure the @tool decorated functions (like read_blood_test_report)
-# are accessible, either by importing them directly if they are in your 'tools.py'
-# and marked with @tool, or by ensuring the agent's setup correctly accesses them.
-# For simplicity, assuming the @tool functions are available via the agent's tools.
-
-app = FastAPI(title="Blood Test Report Analyser")
-
-def run_crew(query: str, file_path: str): # file_path is now mandatory
-    """To run the whole crew"""
-    
-    # IMPORTANT: Modify the task description to explicitly mention the file path,
-    # or ensure your agent is smart enough to infer it from the context
-    # and use the read_blood_test_report tool with this path.
-    # A common pattern is to make the task description dynamic based on inputs.
-    
-    # Here's one way to make the task explicitly aware of the file_path:
-    # We create a new task instance for each run to ensure it uses the specific file_path.
-    # Alternatively, ensure your agents' `goal` or `backstory`
-    # guides them to use the tool with available context.
-    
-    # A robust way is to pass the file_path as part of the task's context,
-    # and the agent uses it when it decides to call the tool.
-    # The agent will look at its tools and the task description/context.
-    # If `read_blood_test_report` is given to the agent, and the task needs
-    # to process a file, the agent should ideally pick it up.
-    
-    # Let's ensure the `help_patients` task is correctly configured to use
-    # the file path when calling `read_blood_test_report`.
-    # Your `read_blood_test_report` function (from tools.py)
-    # should be designed to take a `path` argument.
-    
-    # The `help_patients` task description should implicitly guide the agent
-    # to use the `read_blood_test_report` tool with the provided file.
-    # The `kickoff` inputs are available to the entire crew and its agents/tasks.
-    # The agent's reasoning will link 'file_path' from `inputs` to the `path` argument of `read_blood_test_report`.
-    
-    medical_crew = Crew(
-        agents=[doctor],
-        tasks=[help_patients],
-        process=Process.sequential,
-        verbose=True # It's good to have verbose output for debugging CrewAI runs
-    )
+# The crew pipeline (verification gate + concurrent analyses) lives in pipeline.py.
+# crewai, the agents (agents.py), the tasks (task.py) and their tools are only
+# imported by the warm-up or the first crew run, so importing main stays fast.
+from pipeline import (run_pipeline, parse_task_selection, ReportRejectedError, VERIFICATION,
+                      get_definitions_fingerprint, crew_pool)
 
-    # Pass both query and file_path to the crew's kickoff method.
-    # The agents, guided by their roles and task descriptions, will access these inputs.
-    result = medical_crew.kickoff({'query': query, 'file_path': file_path})
-    return result
+import config
+from jobs import JobQueue, QueueFullError, JOB_DONE, JOB_FAILED
+from report_cache import report_cache, file_sha256
+from result_cache import result_cache, make_key
+from uploads import store_upload, UploadTooLargeError, is_zip_upload, extract_zip_reports
+from upload_buffers import upload_buffers, discard_upload
+from preverify import classify_report
+from starlette.concurrency import run_in_threadpool
+from tool_bridge import tool_metrics
+from compaction import compaction_metrics
+from governor import rate_governor, priority_scope, PRIORITY_INTERACTIVE
+import pdf_extract
+# Same parser as tools.parse_pdf_text, without importing the crewai tool stack
+from pdf_extract import extract_text as parse_pdf_text
+from search import search_service
+from reference_index import reference_index
+from ocr import ocr_cache
+from history import get_marker_history, parse_date
+from reference_eval import evaluate_report, warm_reference_table
+from streaming import EventChannel, format_sse, format_ndjson
+from coalescing import coalescer
+from deadlines import Deadline, deadline_scope, current_deadline, REASON_DISCONNECTED
+from batches import BatchRegistry, BatchRunner, ITEM_DUPLICATE
+from observability import (registry, span, request_scope, new_request_id, current_request_id,
+                           format_server_timing, configure_logging, HTTP_REQUESTS, HTTP_SECONDS,
+                           HTTP_IN_FLIGHT, UPLOADS_REJECTED, CREW_RUNS_IN_FLIGHT, CREW_RUNS_PARTIAL)
+from fastapi.responses import StreamingResponse
+from startup import startup
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+startup.record("import_main", time.perf_counter() - _import_started)
+
+def _import_crew_stack():
+    # Loads crewai and langchain here rather than in the first request
+    import agents, task, tools  # noqa: F401
+
+# Timed in this order; the first step pays for most of the imports
+WARMUP_STEPS = [
+    ("import_crew_stack", _import_crew_stack),
+    ("definitions_fingerprint", get_definitions_fingerprint),
+    ("crew_pool", crew_pool.warm),
+    ("pdf_workers", pdf_extract.warm_pool),
+    # Optional: a missing numpy or unwritable index directory is logged, not fatal
+    ("reference_ranges", warm_reference_table),
+    ("reference_index", reference_index.warm),
+]
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load crewai and build the pooled crew instances before the first request
+    # needs them. In the default background mode the server accepts requests
+    # meanwhile; /ready tells load balancers when it is warm.
+    warmup = None
+    if config.STARTUP_WARMUP == "off":
+        startup.mark_ready()
+    elif config.STARTUP_WARMUP == "blocking":
+        await run_in_threadpool(startup.run_warmup, WARMUP_STEPS)
+    else:
+        warmup = asyncio.create_task(run_in_threadpool(startup.run_warmup, WARMUP_STEPS))
+    yield
+    if warmup is not None and not warmup.done():
+        warmup.cancel()
+    # Joins the batch threads, so keep the event loop free meanwhile
+    await run_in_threadpool(batch_runner.shutdown)
+    job_queue.shutdown(wait=False)
+
+app = FastAPI(title="Blood Test Report Analyser", lifespan=lifespan)
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    """Request id, HTTP metrics and the Server-Timing header for every request.
+
+    The id comes from the X-Request-ID header or is generated; it is echoed
+    back and carried by every span and log line the request produces, including
+    those of its background job.
+    """
+    request_id = request.headers.get("X-Request-ID") or new_request_id()
+    with request_scope(request_id) as timings:
+        start = time.perf_counter()
+        status = 500
+        HTTP_IN_FLIGHT.inc()
+        try:
+            response = await call_next(request)
+            status = response.status_code
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            elapsed = time.perf_counter() - start
+            route = request.scope.get("route")
+            route = getattr(route, "path", "unmatched")
+            HTTP_REQUESTS.inc(method=request.method, route=route, status=status)
+            HTTP_SECONDS.observe(elapsed, method=request.method, route=route)
+    response.headers["X-Request-ID"] = request_id
+    if config.SERVER_TIMING:
+        response.headers["Server-Timing"] = format_server_timing(timings, elapsed)
+    return response
+
+# Crew runs block for the whole LLM conversation, so they execute on a bounded
+# worker pool instead of the event loop (sizes come from config.py)
+job_queue = JobQueue()
+
+def run_crew(query: str, file_path: str, tasks: list = None, report_hash: str = None,
+             use_cache: bool = True, on_event=None, history: str = None,
+             findings: str = None): # file_path is now mandatory
+    """To run the whole crew
+
+    Verification runs first as a gate, then the selected analyses run
+    concurrently and their outputs are merged (see pipeline.py). Results are
+    cached by (report hash, normalized query, tasks, agent/task definitions,
+    patient history summary, reference-range findings); use_cache=False forces a fresh run (which still
+    refreshes the cache). on_event receives progress events (see pipeline.run_pipeline).
+    The run stops at the current deadline (deadlines.deadline_scope) and then
+    returns the finished tasks with "partial" set.
+    """
+    if tasks is None:
+        tasks = parse_task_selection()
+    if report_hash is None:
+        report_hash = file_sha256(file_path)
+
+    with span("run_crew", tasks=tasks) as attributes, CREW_RUNS_IN_FLIGHT.track_inprogress():
+        context = "\n".join(part for part in (history, findings) if part)
+        key = make_key(report_hash, query, tasks, get_definitions_fingerprint(), context)
+        if use_cache:
+            cached = result_cache.get(key)
+            if cached is not None:
+                attributes["cached"] = True
+                if on_event:
+                    for name, output in cached["analyses"].items():
+                        on_event("task", {"name": name, "output": output, "cached": True})
+                return {**cached, "cached": True}
+        else:
+            result_cache.bypassed += 1
+
+        # The kickoff inputs ('query' and 'file_path') are interpolated into every
+        # task description, so each agent knows which file to hand to its reader tools.
+        attributes["cached"] = False
+        result = run_pipeline(query=query, file_path=file_path, tasks=tasks, on_event=on_event, history=history,
+                              findings=findings)
+        # Partial results (some branch failed or was cut off) are not worth remembering
+        if result["partial"]:
+            attributes["partial"] = True
+            CREW_RUNS_PARTIAL.inc(reason=result["stop_reason"] or "unknown")
+        elif not result["errors"]:
+            result_cache.put(key, result)
+        return {**result, "cached": False}
 
 @app.get("/")
 async def root():
-    """Health check endpoint"""
+    """Health check endpoint (liveness; answers while the warm-up is still running)"""
     return {"message": "Blood Test Report Analyser API is running"}
 
-@app.post("/analyze")
-async def analyze_blood_report(
-    file: UploadFile = File(...),
-    query: str = Form(default="Summarise my Blood Test Report")
-):
-    """Analyze blood test report and provide comprehensive health recommendations"""
+@app.get("/ready")
+async def ready():
+    """Readiness: 200 once crewai, the crew pool and the PDF workers are warm, 503 before"""
+    status = startup.snapshot()
+    return JSONResponse(status_code=200 if startup.ready else 503, content=status)
+
+def process_report(query: str, file_path: str, filename: str, tasks: list = None,
+                   report_hash: str = None, use_cache: bool = True, on_event=None,
+                   priority: str = PRIORITY_INTERACTIVE, patient_id: str = None, report_date: str = None,
+                   deadline: Deadline = None):
+    """Runs the crew for a stored upload and removes the file afterwards.
+
+    This is the unit of work executed by the background job queue. `priority`
+    is the rate governor class its LLM and search calls run under. With a
+    `patient_id` the report's markers are added to that patient's history and
+    the changes since earlier reports are handed to the summary task.
+    Parsing and the crew run stop at `deadline` (by default
+    config.REQUEST_DEADLINE_SECONDS from now); the result then has status
+    "partial" and lists the tasks that did not finish.
+    """
+    if deadline is None:
+        deadline = Deadline()
+    with priority_scope(priority), deadline_scope(deadline):
+        return _process_report(query, file_path, filename, tasks, report_hash, use_cache, on_event,
+                               patient_id, report_date)
+
+def record_history(patient_id: str, report_hash: str, text: str, filename: str, report_date: str = None):
+    """Adds a parsed report to the patient's marker history; returns its ReportChanges or None."""
+    marker_history = get_marker_history() if patient_id and text is not None else None
+    if marker_history is None:
+        return None
+    try:
+        with span("history") as attributes:
+            changes = marker_history.record_report(patient_id, report_hash, text, filename, report_date)
+            attributes["earlier_reports"] = changes.earlier_reports
+        return changes
+    except Exception:
+        # History is an extra; the analysis goes ahead without it
+        logger.exception("Could not record history of %s for patient %s", filename, patient_id)
+        return None
+
+def evaluate_findings(text: str, filename: str):
+    """Checks the report's markers against the reference ranges; returns its Evaluation or None."""
+    if not text:
+        return None
+    try:
+        with span("reference_ranges") as attributes:
+            evaluation = evaluate_report(text)
+            if evaluation is not None:
+                attributes["flagged"] = len(evaluation.flagged())
+        return evaluation
+    except Exception:
+        # The summary task falls back to judging the marker flags itself
+        logger.exception("Could not evaluate the reference ranges of %s", filename)
+        return None
+
+def _process_report(query, file_path, filename, tasks, report_hash, use_cache, on_event,
+                    patient_id=None, report_date=None):
+    try:
+        text = None
+        # Parse once up front: fills the text cache the agents' tools read from,
+        # so the concurrent branches do not all wait on the first tool call
+        try:
+            with span("parse"):
+                text = report_cache.get_or_parse(file_path, parse_pdf_text, digest=report_hash)
+            if on_event:
+                on_event("parsed", {"pages": text.count("\n"), "characters": len(text)})
+        except Exception as e:
+            # The reader tools report the problem to the agents themselves
+            logger.warning("Could not pre-parse %s: %s", file_path, e)
+            if on_event:
+                on_event("parse_error", {"detail": str(e)})
+
+        if report_hash is None:
+            report_hash = file_sha256(file_path)
+        changes = record_history(patient_id, report_hash, text, filename, report_date)
+        if changes is not None and on_event:
+            on_event("history", changes.to_dict())
+        evaluation = evaluate_findings(text, filename)
+        findings = evaluation.rows(flagged_only=True) if evaluation is not None else None
+        if findings is not None and on_event:
+            on_event("findings", {"flagged": findings})
+
+        try:
+            response = run_crew(query=query, file_path=file_path, tasks=tasks,
+                                report_hash=report_hash, use_cache=use_cache, on_event=on_event,
+                                history=changes.to_text() if changes is not None else None,
+                                findings=evaluation.findings_text() if evaluation is not None else None)
+        except ReportRejectedError as e:
+            if changes is not None and changes.recorded_rowid is not None:
+                # Not a blood report after all; drop what this request added to the
+                # patient's history (a copy recorded earlier stays)
+                get_marker_history().forget_report(patient_id, report_hash, changes.recorded_rowid)
+            return {
+                "status": "rejected",
+                "query": query,
+                "verification": e.verification_output,
+                "file_processed": filename
+            }
+        partial = response.get("partial", False)
+        deadline = current_deadline()
+        return {
+            "status": "partial" if partial else "success",
+            "query": query,
+            "analysis": response["analysis"],
+            "analyses": response["analyses"],
+            "verification": response["verification"],
+            "errors": response["errors"],
+            "incomplete": response.get("incomplete", []),
+            "cached": response["cached"],
+            "tasks": tasks,
+            "history": changes.to_dict() if changes is not None else None,
+            "findings": findings,
+            "deadline": deadline.to_dict() if deadline is not None else None,
+            "file_processed": filename
+        }
+    finally:
+        # Clean up the uploaded file after processing
+        remove_upload(file_path)
+
+def remove_upload(file_path: str):
+    """Deletes a stored upload (or releases its in-memory buffer), logging instead of raising on failure."""
+    report_cache.forget_path(file_path)
+    try:
+        if discard_upload(file_path):
+            logger.info("Cleaned up file: %s", file_path)
+    except OSError:
+        logger.exception("Error removing file %s", file_path)
+
+# Batches share job_queue with single reports; their crew runs are limited to
+# config.BATCH_MAX_IN_FLIGHT queue slots and run at batch priority
+batch_registry = BatchRegistry()
+batch_runner = BatchRunner(job_queue, process_report, remove_upload, pdf_extract.extract_text_pooled)
+
+async def accept_upload(file: UploadFile, query: str, tasks: str) -> tuple:
+    """Validates the form, stores the upload and pre-verifies it.
+
+    Shared by /analyze and /analyze/stream. On any failure the stored file is
+    removed and an HTTPException is raised.
+
+    Returns:
+        tuple: (StoredUpload, query, selected task names, PreverificationResult)
+    """
+    try:
+        selected_tasks = parse_task_selection(tasks)
+    except ValueError as e:
+        UPLOADS_REJECTED.inc(reason="bad_request")
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Ensure query is not empty if it's passed as Form data
+    if not query.strip(): # Use .strip() to handle whitespace-only strings
+        query = "Summarise my Blood Test Report"
 
     # Generate a unique filename to avoid conflicts, including original extension
     file_extension = os.path.splitext(file.filename)[1]
@@ -76,49 +327,504 @@ async def analyze_blood_report(
         file_extension = ".pdf" # Default to PDF if no extension provided
     
     file_id = str(uuid.uuid4())
-    file_path = os.path.join("data", f"blood_test_report_{file_id}{file_extension}")
+    file_path = os.path.join(config.UPLOAD_DIR, f"blood_test_report_{file_id}{file_extension}")
 
+    upload = None
     try:
-        os.makedirs("data", exist_ok=True)
-
-        # Write the uploaded file content to the new path
-        # Use await with file.read() as it's an async operation
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
+        # Read the upload in chunks, hashing it on the way. Small reports stay in
+        # memory; larger ones are spooled to file_path instead of being buffered whole
+        with span("upload") as attributes:
+            upload = await store_upload(file, file_path)
+            attributes["bytes"] = upload.size
+            attributes["in_memory"] = upload.in_memory
+        report_cache.register_path(upload.path, upload.sha256)
 
-        # Ensure query is not empty if it's passed as Form data
-        if not query.strip(): # Use .strip() to handle whitespace-only strings
-            query = "Summarise my Blood Test Report"
+        # Cheap local classification before any LLM call: clear rejects fail
+        # here, clear blood reports skip the LLM verification task
+        with span("preverify") as attributes:
+            preverification = await run_in_threadpool(classify_report, upload.path, file.content_type)
+            attributes["verdict"] = preverification.verdict
+        if preverification.rejected:
+            UPLOADS_REJECTED.inc(reason="not_a_report")
+            raise HTTPException(
+                status_code=422,
+                detail={"message": "The uploaded file is not a valid blood test report",
+                        **preverification.to_dict()},
+            )
+        if preverification.accepted:
+            selected_tasks = [name for name in selected_tasks if name != VERIFICATION]
 
-        # Now, call run_crew with the path to the saved file
-        response = run_crew(query=query.strip(), file_path=file_path)
+    except HTTPException:
+        if upload is not None:
+            remove_upload(upload.path)
+        raise
 
-        return {
-            "status": "success",
-            "query": query,
-            "analysis": str(response), # Convert response to string for API output
-            "file_processed": file.filename
-        }
+    except UploadTooLargeError as e:
+        UPLOADS_REJECTED.inc(reason="too_large")
+        raise HTTPException(status_code=413, detail=str(e))
 
     except Exception as e:
+        UPLOADS_REJECTED.inc(reason="error")
         # Log the full exception for debugging in production
-        print(f"Error during file processing or CrewAI run: {e}")
-        import traceback
-        traceback.print_exc() # Print full traceback to console/logs
+        logger.exception("Error during file upload")
+        if upload is not None:
+            remove_upload(upload.path)
 
         raise HTTPException(status_code=500, detail=f"Error processing blood report: {str(e)}")
 
+    return upload, query.strip(), selected_tasks, preverification
+
+def history_fields(patient_id: str, report_date: str) -> dict:
+    """Validated patient_id/report_date form fields as process_report keyword arguments."""
+    patient_id = (patient_id or "").strip()
+    report_date = (report_date or "").strip()
+    if len(patient_id) > 128:
+        UPLOADS_REJECTED.inc(reason="bad_request")
+        raise HTTPException(status_code=400, detail="patient_id must be at most 128 characters")
+    if report_date and parse_date(report_date) is None:
+        UPLOADS_REJECTED.inc(reason="bad_request")
+        raise HTTPException(status_code=400, detail=f"Unrecognised report_date: {report_date}")
+    return {"patient_id": patient_id or None, "report_date": report_date or None}
+
+def deadline_field(deadline_seconds: float) -> float:
+    """Validated deadline_seconds form field: 0 means config.REQUEST_DEADLINE_SECONDS."""
+    if deadline_seconds is None or deadline_seconds == 0:
+        return config.REQUEST_DEADLINE_SECONDS
+    if deadline_seconds < 0 or deadline_seconds > config.REQUEST_DEADLINE_MAX_SECONDS:
+        UPLOADS_REJECTED.inc(reason="bad_request")
+        raise HTTPException(
+            status_code=400,
+            detail=f"deadline_seconds must be between 0 and {config.REQUEST_DEADLINE_MAX_SECONDS:g}",
+        )
+    return deadline_seconds
+
+def submit_report_job(fn, upload, query: str, selected_tasks: list, preverification, *args, **kwargs):
+    """Queues fn for a stored upload, translating a full queue into 429."""
+    try:
+        return job_queue.submit(
+            fn, *args,
+            metadata={"query": query, "tasks": selected_tasks, "file_processed": upload.filename,
+                      "preverification": preverification.to_dict(), "request_id": current_request_id()},
+            **kwargs,
+        )
+    except QueueFullError as e:
+        UPLOADS_REJECTED.inc(reason="queue_full")
+        remove_upload(upload.path)
+        raise HTTPException(
+            status_code=429,
+            detail=f"Server is busy, please retry later: {e}",
+            headers={"Retry-After": str(config.JOB_RETRY_AFTER_SECONDS)},
+        )
+
+def start_report_run(upload, query: str, selected_tasks: list, preverification, use_cache: bool,
+                     history: dict, deadline_seconds: float = None) -> tuple:
+    """Queues the crew run for an accepted upload, or attaches to an identical one in flight.
+
+    A request matching a run in flight (same file, normalized query, tasks,
+    patient fields, cache use and deadline) drops its copy of the upload and
+    shares that run's job, events and deadline (see coalescing.py). Cache use
+    and deadline are part of the match so a no_cache request never gets a
+    cached answer and nobody inherits a shorter deadline than they asked for.
+
+    Returns:
+        tuple: (InflightRun, True if the request was attached to an existing run)
+    """
+    if deadline_seconds is None:
+        deadline_seconds = config.REQUEST_DEADLINE_SECONDS
+    key = coalescer.make_key(upload.sha256, query, selected_tasks,
+                             history.get("patient_id"), history.get("report_date"),
+                             bool(use_cache), float(deadline_seconds))
+    run, leader = coalescer.join(key)
+    if not leader:
+        remove_upload(upload.path)
+        return run, True
+    try:
+        run.job = submit_report_job(
+            process_report_coalesced, upload, query, selected_tasks, preverification,
+            run, query, upload.path, upload.filename, selected_tasks, upload.sha256, use_cache,
+            deadline_seconds=deadline_seconds, **history,
+        )
+    except HTTPException as e:
+        run.publish("error", {"detail": e.detail})
+        coalescer.abandon(run)
+        raise
+    return run, False
+
+def process_report_coalesced(run, *args, deadline_seconds: float = None, **kwargs):
+    """process_report_streaming publishing to a coalesced run, which ends when the report is done.
+
+    The run's deadline starts now, when the job starts; cancelling the run
+    (all its streaming clients gone) cancels it.
+    """
+    result = None
+    deadline = Deadline(deadline_seconds)
+    run.set_deadline(deadline)
+    try:
+        result = process_report_streaming(run.publish, *args, deadline=deadline, **kwargs)
+        return result
     finally:
-        # Clean up the uploaded file after processing
-        if os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-                print(f"Cleaned up file: {file_path}")
-            except OSError as e:
-                print(f"Error removing file {file_path}: {e}") # Log if deletion fails
+        coalescer.finish(run, result)
+
+@app.post("/analyze", status_code=202)
+async def analyze_blood_report(
+    file: UploadFile = File(...),
+    query: str = Form(default="Summarise my Blood Test Report"),
+    tasks: str = Form(default=""),
+    no_cache: bool = Form(default=False),
+    patient_id: str = Form(default=""),
+    report_date: str = Form(default=""),
+    deadline_seconds: float = Form(default=0)
+):
+    """Queue a blood test report for analysis and return the job id right away
+
+    `tasks` is a comma separated subset of verification, summary, nutrition and
+    exercise; empty runs the configured default pipeline. `no_cache` skips the
+    result cache lookup for this request. With `patient_id` the report joins
+    that patient's marker history and the summary covers the changes since
+    earlier reports; `report_date` overrides the date printed in the report.
+    An identical request already in flight is not run again: the response
+    carries that request's job id and `coalesced: true`. The analysis stops
+    after `deadline_seconds` (0: the configured default) from when its job
+    starts; the result then has status `partial` and lists the `incomplete` tasks.
+    """
+    with span("analyze_blood_report") as attributes:
+        history = history_fields(patient_id, report_date)
+        deadline_seconds = deadline_field(deadline_seconds)
+        upload, query, selected_tasks, preverification = await accept_upload(file, query, tasks)
+
+        # Hand the crew run to the worker pool; the file is removed by the job
+        run, coalesced = start_report_run(upload, query, selected_tasks, preverification, not no_cache, history,
+                                          deadline_seconds)
+        attributes["coalesced"] = coalesced
+        job = run.job
+
+    return {
+        "status": job.status,
+        "job_id": job.id,
+        "coalesced": coalesced,
+        "status_url": f"/jobs/{job.id}",
+        "result_url": f"/jobs/{job.id}/result",
+    }
+
+async def store_batch_file(file: UploadFile, max_files: int) -> list:
+    """Stores one part of a batch upload: a PDF, or every PDF inside a zip.
+
+    Returns:
+        list: StoredUpload per report.
+    """
+    if is_zip_upload(file.filename, file.content_type):
+        zip_path = os.path.join(config.UPLOAD_DIR, f"batch_{uuid.uuid4()}.zip")
+        archive = await store_upload(file, zip_path)
+        try:
+            return await run_in_threadpool(extract_zip_reports, archive.path, config.UPLOAD_DIR, max_files)
+        finally:
+            remove_upload(archive.path)
+
+    file_extension = os.path.splitext(file.filename or "")[1] or ".pdf"
+    file_path = os.path.join(config.UPLOAD_DIR, f"blood_test_report_{uuid.uuid4()}{file_extension}")
+    return [await store_upload(file, file_path)]
+
+@app.post("/analyze/batch", status_code=202)
+async def analyze_blood_report_batch(
+    files: List[UploadFile] = File(...),
+    query: str = Form(default="Summarise my Blood Test Report"),
+    tasks: str = Form(default=""),
+    no_cache: bool = Form(default=False),
+    patient_id: str = Form(default="")
+):
+    """Queue many blood test reports at once and return a single batch id
+
+    `files` takes PDFs and/or zip archives of PDFs. Identical files are analysed
+    once. Reports are pre-verified and parsed in parallel, and their crew runs
+    share the job queue at batch priority. Per-file results stream from
+    `results_url` as NDJSON as they finish. With `patient_id` every report is
+    added to that patient's marker history, dated by the date it prints.
+    """
+    patient_id = history_fields(patient_id, "")["patient_id"]
+    try:
+        selected_tasks = parse_task_selection(tasks)
+    except ValueError as e:
+        UPLOADS_REJECTED.inc(reason="bad_request")
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if not query.strip():
+        query = "Summarise my Blood Test Report"
+
+    stored = []
+    try:
+        for file in files:
+            stored.extend(await store_batch_file(file, config.BATCH_MAX_FILES - len(stored)))
+            if len(stored) > config.BATCH_MAX_FILES:
+                raise ValueError(f"A batch may contain at most {config.BATCH_MAX_FILES} reports")
+        if not stored:
+            raise ValueError("The batch contains no PDF reports")
+    except (HTTPException, UploadTooLargeError, ValueError) as e:
+        for upload in stored:
+            remove_upload(upload.path)
+        if isinstance(e, HTTPException):
+            raise
+        if isinstance(e, UploadTooLargeError):
+            UPLOADS_REJECTED.inc(reason="too_large")
+            raise HTTPException(status_code=413, detail=str(e))
+        UPLOADS_REJECTED.inc(reason="bad_request")
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        UPLOADS_REJECTED.inc(reason="error")
+        logger.exception("Error during batch upload")
+        for upload in stored:
+            remove_upload(upload.path)
+        raise HTTPException(status_code=500, detail=f"Error processing blood reports: {str(e)}")
+
+    batch = batch_registry.create(query.strip(), selected_tasks, not no_cache, patient_id)
+    for upload in stored:
+        item = batch.add(upload)
+        if item.status == ITEM_DUPLICATE:
+            # Same bytes as an earlier file; it shares that file's analysis
+            remove_upload(upload.path)
+        else:
+            report_cache.register_path(upload.path, upload.sha256)
+    batch_runner.start(batch)
+
+    return {
+        "status": batch.status,
+        "batch_id": batch.id,
+        "files": len(batch.items),
+        "unique": len(batch.unique),
+        "duplicates": len(batch.items) - len(batch.unique),
+        "status_url": f"/batches/{batch.id}",
+        "results_url": f"/batches/{batch.id}/results",
+    }
+
+def process_report_streaming(on_event, *args, **kwargs):
+    """process_report that also emits its outcome as a final 'result' or 'error' event."""
+    try:
+        result = process_report(*args, on_event=on_event, **kwargs)
+    except Exception as e:
+        on_event("error", {"detail": f"Error processing blood report: {e}"})
+        raise
+    on_event("result", result)
+    return result
+
+@app.post("/analyze/stream")
+async def analyze_blood_report_stream(
+    file: UploadFile = File(...),
+    query: str = Form(default="Summarise my Blood Test Report"),
+    tasks: str = Form(default=""),
+    no_cache: bool = Form(default=False),
+    patient_id: str = Form(default=""),
+    report_date: str = Form(default=""),
+    deadline_seconds: float = Form(default=0)
+):
+    """Analyze a blood test report, streaming progress as server-sent events
+
+    Events, in order: `upload`, `preverification`, `queued`, `parsed`,
+    `history` (with a `patient_id`), `findings` (the out-of-range markers),
+    `verification` (if it runs), `step` (intermediate agent steps), `task` /
+    `task_error` per analysis as it completes, `task_incomplete` per task cut
+    off by the deadline, then `result` or `error`.
+    A request identical to one in flight follows that run (`queued` has
+    `coalesced: true`) and first receives the events it has already sent.
+    Disconnecting cancels the analysis unless other requests still wait for it.
+    """
+    history = history_fields(patient_id, report_date)
+    deadline_seconds = deadline_field(deadline_seconds)
+    upload, query, selected_tasks, preverification = await accept_upload(file, query, tasks)
+
+    channel = EventChannel(asyncio.get_running_loop())
+    run, coalesced = start_report_run(upload, query, selected_tasks, preverification, not no_cache, history,
+                                      deadline_seconds)
+    job = run.job
+
+    async def event_stream():
+        try:
+            yield format_sse("upload", {"file": upload.filename, "bytes": upload.size, "sha256": upload.sha256})
+            yield format_sse("preverification", preverification.to_dict())
+            yield format_sse("queued", {"job_id": job.id, "tasks": selected_tasks, "coalesced": coalesced,
+                                        "status_url": f"/jobs/{job.id}"})
+            run.listen(channel)
+            while True:
+                event, data = await channel.get()
+                yield format_sse(event, data)
+                if event in ("result", "error"):
+                    break
+        finally:
+            run.unlisten(channel)
+            # Ends in the middle of the run only when the client went away
+            if run.detach(REASON_DISCONNECTED):
+                logger.info("Client of job %s disconnected; cancelling the analysis", job.id)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """Report whether a queued analysis is queued, running, done or failed"""
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """Return the analysis of a finished job (202 while it is still pending)"""
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    if job.status == JOB_FAILED:
+        raise HTTPException(status_code=500, detail=f"Error processing blood report: {job.error}")
+    if job.status != JOB_DONE:
+        return JSONResponse(status_code=202, content=job.to_dict())
+    return job.result
+
+@app.get("/batches/{batch_id}")
+async def get_batch_status(batch_id: str):
+    """Progress of a batch and the status of each of its files"""
+    batch = batch_registry.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail=f"Unknown batch: {batch_id}")
+    return batch.to_dict()
+
+@app.get("/batches/{batch_id}/findings")
+async def get_batch_findings(batch_id: str):
+    """Reference-range check of every parsed report of a batch, from one vectorised pass
+
+    `cohort` has per-marker counts (readings, low, high, severity tiers, mean
+    z-score); `findings` lists each file's out-of-range markers, most severe
+    first. No LLM is involved, so this is available while the batch is running.
+    """
+    batch = batch_registry.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail=f"Unknown batch: {batch_id}")
+    try:
+        return await run_in_threadpool(batch.evaluate)
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+@app.get("/batches/{batch_id}/results")
+async def stream_batch_results(batch_id: str):
+    """Stream per-file results as NDJSON, one line per file as it finishes
+
+    Lines already finished are sent first. Each file line has `"type": "file"`;
+    the stream ends with one `"type": "summary"` line once the batch is done.
+    """
+    batch = batch_registry.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail=f"Unknown batch: {batch_id}")
+
+    channel = EventChannel(asyncio.get_running_loop())
+    batch.listen(channel)
+
+    async def line_stream():
+        try:
+            while True:
+                event, data = await channel.get()
+                if event == "end":
+                    break
+                yield format_ndjson(data)
+        finally:
+            batch.unlisten(channel)
+
+    return StreamingResponse(line_stream(), media_type="application/x-ndjson")
+
+def _require_history():
+    marker_history = get_marker_history()
+    if marker_history is None:
+        raise HTTPException(status_code=404, detail="Patient history is disabled (HISTORY_DB_PATH is empty)")
+    return marker_history
+
+@app.get("/patients/{patient_id}/reports")
+async def get_patient_reports(patient_id: str):
+    """The patient's analysed reports, oldest first, with marker and abnormal counts"""
+    reports = await run_in_threadpool(_require_history().reports, patient_id)
+    if not reports:
+        raise HTTPException(status_code=404, detail=f"No reports on file for patient {patient_id}")
+    return {"patient_id": patient_id, "reports": reports}
+
+@app.get("/patients/{patient_id}/trends")
+async def get_patient_trends(patient_id: str, marker: str = None, limit: int = None):
+    """Readings per marker over time (all markers, or one marker key such as `glucose`)"""
+    trends = await run_in_threadpool(_require_history().trend, patient_id, marker, limit)
+    return {"patient_id": patient_id, "trends": trends}
+
+@app.get("/patients/{patient_id}/changes")
+async def get_patient_changes(patient_id: str, report_hash: str = None):
+    """A report's markers against the patient's earlier readings (default: the latest report)"""
+    changes = await run_in_threadpool(_require_history().changes, patient_id, report_hash)
+    if changes is None:
+        raise HTTPException(status_code=404, detail=f"No such report on file for patient {patient_id}")
+    return {**changes.to_dict(), "summary": changes.to_text()}
+
+@app.delete("/patients/{patient_id}")
+async def delete_patient_history(patient_id: str):
+    """Delete everything stored for a patient"""
+    removed = await run_in_threadpool(_require_history().forget, patient_id)
+    return {"patient_id": patient_id, "reports_removed": removed}
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """Hit/miss counters of the crew result, report text, web search and OCR caches, and in-memory uploads"""
+    return {"results": result_cache.stats(), "report_text": report_cache.stats(), "search": search_service.stats(),
+            "upload_buffers": upload_buffers.stats(), "ocr": ocr_cache.stats(),
+            "reference_index": reference_index.stats(), "coalescing": coalescer.stats()}
+
+@app.get("/governor/stats")
+async def get_governor_stats():
+    """Rate governor budgets usage and queue wait times per resource"""
+    return rate_governor.stats()
+
+@app.get("/tools/metrics")
+async def get_tool_metrics():
+    """Per-tool call counts, errors and latency since startup"""
+    return tool_metrics.snapshot()
+
+def _component_metrics() -> list:
+    """Counters and gauges the caches, queues and pools keep themselves, read at scrape time."""
+    results = result_cache.stats()
+    report_text = report_cache.stats()
+    search = search_service.stats()
+    jobs = job_queue.stats()
+    pool = crew_pool.stats()
+    coalescing = coalescer.stats()
+    return [
+        ("analyser_cache_hits_total", "counter", "Cache hits by cache.", [
+            ({"cache": "results"}, results["hits"]),
+            ({"cache": "report_text"}, report_text["hits"]),
+            ({"cache": "search"}, search["hits"]),
+        ]),
+        ("analyser_cache_misses_total", "counter", "Cache misses by cache.", [
+            ({"cache": "results"}, results["misses"]),
+            ({"cache": "report_text"}, report_text["misses"]),
+            ({"cache": "search"}, search["misses"]),
+        ]),
+        ("analyser_jobs", "gauge", "Background jobs by status.", [
+            ({"status": status}, jobs[status]) for status in ("queued", "running", "done", "failed")
+        ]),
+        ("analyser_crew_pool_idle", "gauge", "Idle pooled crew instances.", [({}, pool["idle"])]),
+        ("analyser_crew_pool_size", "gauge", "Configured crew pool size.", [({}, pool["size"])]),
+        ("analyser_crew_pool_held", "gauge", "Crew instances waiting for cancelled kickoffs to stop.",
+         [({}, pool["held"])]),
+        ("analyser_coalesced_requests_total", "counter", "Requests attached to an identical run in flight.",
+         [({}, coalescing["coalesced_requests"])]),
+        ("analyser_llm_runs_saved_total", "counter", "Crew runs not started thanks to coalescing.",
+         [({}, coalescing["llm_runs_saved"])]),
+    ]
+
+registry.add_collector(_component_metrics)
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics: span and HTTP histograms, counters and in-flight gauges"""
+    return Response(content=registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/compaction/stats")
+async def get_compaction_stats():
+    """Original vs compacted size of the report text handed to agents"""
+    return compaction_metrics.snapshot()
 
 if __name__ == "__main__":
     import uvicorn
-    # reload=True is good for development, disable in production for performance
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    # Development server with auto-reload; use launch.py in production
+    uvicorn.run("main:app", host=config.HOST, port=config.PORT, reload=True)
\ No newline at end of file
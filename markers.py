@@ -0,0 +1,286 @@
+## Deterministic lab-marker extraction
+# Pulls typed markers (name, value, unit, reference range, flag) out of report
+# text in a single regex pass, so tools and agents can work from a few compact
+# rows instead of sending the whole report through the LLM.
+import re
+
+# Canonical marker -> (display name, canonical unit, spellings seen on reports)
+MARKER_SYNONYMS = {
+    "hemoglobin": ("Hemoglobin", "g/dL", ["hemoglobin", "haemoglobin", "hgb", "hb"]),
+    "hematocrit": ("Hematocrit", "%", ["hematocrit", "haematocrit", "hct", "packed cell volume", "pcv"]),
+    "rbc": ("RBC", "10^6/uL", ["rbc", "red blood cells", "red blood cell count", "rbc count", "erythrocytes"]),
+    "wbc": ("WBC", "10^3/uL", ["wbc", "white blood cells", "white blood cell count", "wbc count",
+                               "total leukocyte count", "tlc", "leukocytes"]),
+    "platelets": ("Platelets", "10^3/uL", ["platelets", "platelet count", "plt"]),
+    "mcv": ("MCV", "fL", ["mcv", "mean corpuscular volume"]),
+    "glucose": ("Glucose", "mg/dL", ["glucose", "fasting glucose", "fasting blood glucose", "fasting blood sugar",
+                                     "blood sugar", "fbs", "fasting plasma glucose"]),
+    "hba1c": ("HbA1c", "%", ["hba1c", "hb a1c", "a1c", "glycated hemoglobin", "glycosylated hemoglobin",
+                             "hemoglobin a1c"]),
+    "total_cholesterol": ("Total Cholesterol", "mg/dL", ["total cholesterol", "cholesterol total",
+                                                         "cholesterol", "serum cholesterol"]),
+    "ldl": ("LDL Cholesterol", "mg/dL", ["ldl cholesterol", "ldl-c", "ldl", "ldl cholesterol direct",
+                                         "low density lipoprotein"]),
+    "hdl": ("HDL Cholesterol", "mg/dL", ["hdl cholesterol", "hdl-c", "hdl", "high density lipoprotein"]),
+    "triglycerides": ("Triglycerides", "mg/dL", ["triglycerides", "triglyceride", "tg"]),
+    "vitamin_d": ("Vitamin D", "ng/mL", ["vitamin d", "vitamin d3", "vit d", "25-oh vitamin d",
+                                         "25-hydroxy vitamin d", "25(oh)d", "vitamin d total"]),
+    "vitamin_b12": ("Vitamin B12", "pg/mL", ["vitamin b12", "vit b12", "b12", "cobalamin", "cyanocobalamin"]),
+    "iron": ("Iron", "ug/dL", ["iron", "serum iron"]),
+    "ferritin": ("Ferritin", "ng/mL", ["ferritin", "serum ferritin"]),
+    "tsh": ("TSH", "uIU/mL", ["tsh", "thyroid stimulating hormone"]),
+    "creatinine": ("Creatinine", "mg/dL", ["creatinine", "serum creatinine"]),
+    "urea": ("Urea", "mg/dL", ["blood urea nitrogen", "bun", "urea"]),
+    "uric_acid": ("Uric Acid", "mg/dL", ["uric acid"]),
+    "sodium": ("Sodium", "mmol/L", ["sodium", "serum sodium"]),
+    "potassium": ("Potassium", "mmol/L", ["potassium"]),
+    "calcium": ("Calcium", "mg/dL", ["calcium", "serum calcium"]),
+    "alt": ("ALT", "U/L", ["alt", "sgpt", "alanine aminotransferase"]),
+    "ast": ("AST", "U/L", ["ast", "sgot", "aspartate aminotransferase"]),
+}
+
+# Unit spellings -> canonical unit
+UNIT_ALIASES = {
+    "g/dl": "g/dL", "gm/dl": "g/dL", "g/l": "g/L",
+    "mg/dl": "mg/dL", "mg%": "mg/dL",
+    "mmol/l": "mmol/L", "mmol/mol": "mmol/mol", "meq/l": "mmol/L",
+    "ng/ml": "ng/mL", "nmol/l": "nmol/L", "pg/ml": "pg/mL", "pmol/l": "pmol/L",
+    "ug/dl": "ug/dL", "µg/dl": "ug/dL", "mcg/dl": "ug/dL", "umol/l": "umol/L", "µmol/l": "umol/L",
+    "uiu/ml": "uIU/mL", "µiu/ml": "uIU/mL", "miu/l": "uIU/mL", "mu/l": "uIU/mL",
+    "u/l": "U/L", "iu/l": "U/L",
+    "fl": "fL", "%": "%",
+    "10^3/ul": "10^3/uL", "x10^3/ul": "10^3/uL", "10^3/µl": "10^3/uL", "thou/ul": "10^3/uL",
+    "k/ul": "10^3/uL", "10^9/l": "10^3/uL",
+    "10^6/ul": "10^6/uL", "x10^6/ul": "10^6/uL", "mill/ul": "10^6/uL", "m/ul": "10^6/uL",
+    "10^12/l": "10^6/uL",
+}
+
+# (marker, unit as reported) -> factor into the marker's canonical unit
+UNIT_CONVERSIONS = {
+    ("hemoglobin", "g/L"): 0.1,
+    ("glucose", "mmol/L"): 18.016,
+    ("total_cholesterol", "mmol/L"): 38.67,
+    ("ldl", "mmol/L"): 38.67,
+    ("hdl", "mmol/L"): 38.67,
+    ("triglycerides", "mmol/L"): 88.57,
+    ("vitamin_d", "nmol/L"): 1 / 2.496,
+    ("vitamin_b12", "pmol/L"): 1 / 0.7378,
+    ("creatinine", "umol/L"): 1 / 88.42,
+    ("uric_acid", "umol/L"): 1 / 59.48,
+}
+
+# Adult reference ranges used when the report does not print one
+DEFAULT_RANGES = {
+    "hemoglobin": (12.0, 17.5),
+    "hematocrit": (36.0, 50.0),
+    "rbc": (4.0, 5.9),
+    "wbc": (4.0, 11.0),
+    "platelets": (150.0, 450.0),
+    "mcv": (80.0, 100.0),
+    "glucose": (70.0, 99.0),
+    "hba1c": (4.0, 5.6),
+    "total_cholesterol": (0.0, 200.0),
+    "ldl": (0.0, 100.0),
+    "hdl": (40.0, None),
+    "triglycerides": (0.0, 150.0),
+    "vitamin_d": (30.0, 100.0),
+    "vitamin_b12": (200.0, 900.0),
+    "iron": (60.0, 170.0),
+    "ferritin": (20.0, 300.0),
+    "tsh": (0.4, 4.0),
+    "creatinine": (0.6, 1.3),
+    "urea": (7.0, 20.0),
+    "uric_acid": (3.5, 7.2),
+    "sodium": (135.0, 145.0),
+    "potassium": (3.5, 5.1),
+    "calcium": (8.5, 10.5),
+    "alt": (7.0, 56.0),
+    "ast": (10.0, 40.0),
+}
+
+FLAG_LOW = "low"
+FLAG_HIGH = "high"
+FLAG_NORMAL = "normal"
+
+_SYNONYM_TO_MARKER = {
+    synonym: key
+    for key, (_display, _unit, synonyms) in MARKER_SYNONYMS.items()
+    for synonym in synonyms
+}
+
+
+def _alternation(words) -> str:
+    # Longest first so "ldl cholesterol" wins over "ldl" and "hba1c" over "hb"
+    return "|".join(re.escape(w) for w in sorted(words, key=len, reverse=True))
+
+
+_NUMBER = r"\d+(?:[.,]\d+)?"
+_SYNONYM = r"(?<![A-Za-z0-9])(?:" + _alternation(_SYNONYM_TO_MARKER) + r")(?![A-Za-z0-9])"
+_MARKER_RE = re.compile(
+    r"(?<![A-Za-z0-9])(?P<name>" + _alternation(_SYNONYM_TO_MARKER) + r")(?![A-Za-z0-9])"
+    # Filler between name and value: separators and parenthesised notes like
+    # "(HB)" or "(25-OH)", but never a bare digit, a line break or the name of
+    # another marker (pages are one line, so "Hemoglobin: not done Glucose 95"
+    # must not give hemoglobin the glucose value)
+    r"(?:\([^)\n]*\)|(?!" + _SYNONYM + r")[^\d\n()]){0,40}?"
+    r"(?P<value>" + _NUMBER + r")"
+    r"(?:\s*(?P<unit>" + _alternation(UNIT_ALIASES) + r")(?![A-Za-z0-9]))?"
+    r"(?:[ \t]*\(?[ \t]*(?:ref(?:erence)?(?:[ \t]*(?:range|interval))?[ \t]*:?)?[ \t]*"
+    r"(?:(?P<low>" + _NUMBER + r")[ \t]*(?:-|–|to)[ \t]*(?P<high>" + _NUMBER + r")"
+    r"|(?P<cmp>[<>]=?)[ \t]*(?P<bound>" + _NUMBER + r"))[ \t]*\)?)?"
+    r"(?:[ \t]*(?P<flag>high|low|normal|abnormal|h|l)(?![A-Za-z]))?",
+    re.IGNORECASE,
+)
+
+
+class Marker:
+    """A single lab value extracted from a report."""
+
+    def __init__(self, key: str, value: float, unit: str = None, ref_low: float = None,
+                 ref_high: float = None, flag: str = None, raw_name: str = None, ref_source: str = None):
+        self.key = key
+        self.name = MARKER_SYNONYMS[key][0]
+        self.value = value
+        self.unit = unit
+        self.ref_low = ref_low
+        self.ref_high = ref_high
+        self.flag = flag
+        self.raw_name = raw_name
+        # "report" if the range was printed next to the value, "default" if it came from DEFAULT_RANGES
+        self.ref_source = ref_source
+
+    def to_dict(self) -> dict:
+        return {
+            "marker": self.key,
+            "name": self.name,
+            "value": self.value,
+            "unit": self.unit,
+            "ref_low": self.ref_low,
+            "ref_high": self.ref_high,
+            "flag": self.flag,
+        }
+
+    def to_row(self) -> str:
+        """Compact one-line form, e.g. 'Glucose: 110 mg/dL (ref 70-99) high'."""
+        row = f"{self.name}: {_fmt(self.value)}"
+        if self.unit:
+            row += f" {self.unit}"
+        if self.ref_low is not None and self.ref_high is not None:
+            row += f" (ref {_fmt(self.ref_low)}-{_fmt(self.ref_high)})"
+        elif self.ref_high is not None:
+            row += f" (ref <{_fmt(self.ref_high)})"
+        elif self.ref_low is not None:
+            row += f" (ref >{_fmt(self.ref_low)})"
+        if self.flag:
+            row += f" {self.flag}"
+        return row
+
+    def __repr__(self):
+        return f"Marker({self.to_row()!r})"
+
+
+def _fmt(number: float) -> str:
+    return f"{number:g}"
+
+
+def _to_float(text: str) -> float:
+    return float(text.replace(",", "."))
+
+
+def _normalize_flag(flag: str):
+    if not flag:
+        return None
+    flag = flag.lower()
+    if flag in ("h", "high"):
+        return FLAG_HIGH
+    if flag in ("l", "low"):
+        return FLAG_LOW
+    if flag == "normal":
+        return FLAG_NORMAL
+    return None  # "abnormal" without a direction; recomputed from the range
+
+
+def _flag_from_range(value: float, low: float, high: float):
+    if low is None and high is None:
+        return None
+    if low is not None and value < low:
+        return FLAG_LOW
+    if high is not None and value > high:
+        return FLAG_HIGH
+    return FLAG_NORMAL
+
+
+def extract_markers(text: str) -> list:
+    """Extracts known lab markers from report text in one pass.
+
+    Values are converted to each marker's canonical unit where a conversion is
+    known. When a marker appears several times (e.g. in a summary page) the
+    first occurrence wins.
+
+    Args:
+        text (str): Report text, e.g. the output of read_data_tool.
+
+    Returns:
+        list[Marker]: Markers in the order they appear in the report.
+    """
+    if not text:
+        return []
+
+    found = {}
+    for match in _MARKER_RE.finditer(text):
+        key = _SYNONYM_TO_MARKER[match.group("name").lower()]
+        if key in found:
+            continue
+
+        display, canonical_unit, _synonyms = MARKER_SYNONYMS[key]
+        value = _to_float(match.group("value"))
+        unit = UNIT_ALIASES.get((match.group("unit") or "").lower())
+
+        low = high = None
+        if match.group("low") is not None:
+            low, high = _to_float(match.group("low")), _to_float(match.group("high"))
+        elif match.group("cmp"):
+            bound = _to_float(match.group("bound"))
+            if match.group("cmp").startswith("<"):
+                low, high = None, bound
+            else:
+                low, high = bound, None
+
+        factor = UNIT_CONVERSIONS.get((key, unit))
+        if factor is not None:
+            value = round(value * factor, 2)
+            low = round(low * factor, 2) if low is not None else None
+            high = round(high * factor, 2) if high is not None else None
+            unit = canonical_unit
+        elif unit is None:
+            unit = canonical_unit
+
+        ref_source = "report" if low is not None or high is not None else None
+        # Only fall back to the default range when the value is in its unit
+        if ref_source is None and unit == canonical_unit and key in DEFAULT_RANGES:
+            low, high = DEFAULT_RANGES[key]
+            ref_source = "default"
+
+        flag = _normalize_flag(match.group("flag")) or _flag_from_range(value, low, high)
+        found[key] = Marker(key, value, unit, low, high, flag, raw_name=match.group("name"), ref_source=ref_source)
+
+    return list(found.values())
+
+
+def marker_spans(text: str) -> list:
+    """(start, end) offsets of every marker reading in the text, repeats included."""
+    if not text:
+        return []
+    return [match.span() for match in _MARKER_RE.finditer(text)]
+
+
+def format_markers(markers: list) -> str:
+    """Compact text record of markers, one row each, for tools and LLM prompts."""
+    if not markers:
+        return "No recognised lab markers found in the report."
+    return "\n".join(marker.to_row() for marker in markers)
+
+
+def abnormal_markers(markers: list) -> list:
+    """Markers flagged outside their reference range."""
+    return [m for m in markers if m.flag in (FLAG_LOW, FLAG_HIGH)]
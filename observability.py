@@ -0,0 +1,347 @@
+## Spans, request ids and Prometheus metrics
+# When /analyze was slow the only signals were print() and tracebacks. Work is
+# now wrapped in spans: each one records its duration in a histogram, can be
+# logged as one JSON line carrying the request id (SPAN_LOG, through the
+# "analyser.spans" logger), and, for the part of a request that runs before the
+# response is sent, feeds the Server-Timing header.
+# /metrics renders every metric in the Prometheus text format.
+# Modules log through logging.getLogger(__name__); configure_logging() prints
+# those records with the id of the request they were logged for.
+import contextvars
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import config
+
+# Histogram buckets in seconds, from cache hits up to full crew runs
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+request_id_var = contextvars.ContextVar("request_id", default=None)
+_span_stack = contextvars.ContextVar("span_stack", default=())
+_timings = contextvars.ContextVar("server_timings", default=None)
+
+logger = logging.getLogger("analyser.observability")
+span_logger = logging.getLogger("analyser.spans")
+if config.SPAN_LOG and not span_logger.handlers:
+    # Bare JSON lines on stderr, unless the deployment configured the logger itself
+    _span_handler = logging.StreamHandler()
+    _span_handler.setFormatter(logging.Formatter("%(message)s"))
+    span_logger.addHandler(_span_handler)
+    span_logger.setLevel(logging.INFO)
+    span_logger.propagate = False
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamps each record with the id of the request it was logged for ("-" outside one)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get() or "-"
+        return True
+
+
+def configure_logging():
+    """Sends log records to stderr, with their request id, at config.LOG_LEVEL.
+
+    Does nothing if the deployment has already configured the root logger.
+    """
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    handler = logging.StreamHandler()
+    handler.addFilter(RequestIdFilter())
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    root.addHandler(handler)
+    root.setLevel(config.LOG_LEVEL)
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+def current_request_id():
+    """Id of the request the calling code works for, or None outside a request."""
+    return request_id_var.get()
+
+
+def bind_context(fn):
+    """Wraps fn so it runs in a copy of the caller's context (request id, open spans).
+
+    Worker pools do not carry contextvars over to their threads; wrap each
+    submitted callable once per submission.
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.run(fn, *args, **kwargs)
+    return run
+
+
+async def bind_coroutine(coro, request_id=None, spans=None):
+    """Awaits coro with the given request id and span stack (for coroutines
+    handed to another thread's event loop)."""
+    request_id_var.set(request_id)
+    _span_stack.set(spans or ())
+    return await coro
+
+
+def coroutine_in_context(coro):
+    """coro, bound to the calling thread's request id and open spans."""
+    return bind_coroutine(coro, request_id_var.get(), _span_stack.get())
+
+
+@contextmanager
+def request_scope(request_id: str):
+    """Marks the block as handling request_id and collects its span timings.
+
+    Yields:
+        list: (span name, seconds) of spans finished in this request's context.
+    """
+    timings = []
+    id_token = request_id_var.set(request_id)
+    timings_token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(timings_token)
+        request_id_var.reset(id_token)
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """Monotonic count per label set."""
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                                for key, value in items]
+
+
+class Gauge(_Metric):
+    """Current value per label set (e.g. work in flight)."""
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def render(self) -> list:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                                for key, value in items]
+
+
+class Histogram(_Metric):
+    """Cumulative bucket counts, sum and count per label set."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self) -> list:
+        with self._lock:
+            items = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items()]
+        lines = self.header()
+        for key, (counts, total, count) in items:
+            for bound, bucket_count in zip(self.buckets, counts):
+                labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Owns the metrics and renders them, plus values read from collectors at scrape time.
+
+    A collector is a callable returning (name, kind, help, [(labels dict, value), ...])
+    tuples; it exposes counters the components already keep (cache hits, job
+    counts) without counting them twice.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help_text: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: tuple = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def add_collector(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collector in collectors:
+            try:
+                families = collector()
+            except Exception:
+                logger.exception("Metrics collector %r failed", collector)
+                continue
+            for name, kind, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+
+registry = MetricsRegistry()
+
+SPAN_SECONDS = registry.histogram(
+    "analyser_span_duration_seconds", "Duration of instrumented spans.", ("span", "status"))
+HTTP_REQUESTS = registry.counter(
+    "analyser_http_requests_total", "HTTP requests by route and status code.", ("method", "route", "status"))
+HTTP_SECONDS = registry.histogram(
+    "analyser_http_request_duration_seconds", "Time until the response starts.", ("method", "route"))
+HTTP_IN_FLIGHT = registry.gauge("analyser_http_requests_in_flight", "HTTP requests being handled.")
+UPLOADS_REJECTED = registry.counter(
+    "analyser_uploads_rejected_total", "Uploads turned away, by reason.", ("reason",))
+TOOL_CALLS = registry.counter("analyser_tool_calls_total", "Tool invocations.", ("tool",))
+TOOL_ERRORS = registry.counter("analyser_tool_errors_total", "Tool invocations that failed or returned an error.", ("tool",))
+LLM_CALLS = registry.counter("analyser_llm_calls_total", "LLM calls.", ("resource",))
+LLM_TOKENS = registry.counter("analyser_llm_tokens_total", "Estimated LLM tokens.", ("resource", "kind"))
+CREW_RUNS_IN_FLIGHT = registry.gauge("analyser_crew_runs_in_flight", "Crew pipelines currently running.")
+CREW_RUNS_PARTIAL = registry.counter(
+    "analyser_crew_runs_partial_total", "Crew runs cut short by their deadline or a client disconnect.", ("reason",))
+HTTP_IN_FLIGHT.set(0)
+CREW_RUNS_IN_FLIGHT.set(0)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Times a block as a span.
+
+    The duration goes to analyser_span_duration_seconds{span=name}, the
+    request's Server-Timing list and, if config.SPAN_LOG is set, a JSON line
+    logged to "analyser.spans". The yielded dict can be filled with attributes
+    for that line.
+    """
+    parents = _span_stack.get()
+    token = _span_stack.set(parents + (name,))
+    status = "ok"
+    start = time.perf_counter()
+    try:
+        yield attributes
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        _span_stack.reset(token)
+        SPAN_SECONDS.observe(seconds, span=name, status=status)
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((name, seconds))
+        if config.SPAN_LOG:
+            span_logger.info(json.dumps({
+                "span": name,
+                "request_id": request_id_var.get(),
+                "parent": parents[-1] if parents else None,
+                "duration_ms": round(seconds * 1000, 2),
+                "status": status,
+                **attributes,
+            }, default=str))
+
+
+def format_server_timing(timings: list, total_seconds: float = None) -> str:
+    """Server-Timing header value, e.g. 'upload;dur=12.5, preverify;dur=3.1, total;dur=17.0'."""
+    entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings]
+    if total_seconds is not None:
+        entries.append(f"total;dur={total_seconds * 1000:.1f}")
+    return ", ".join(entries)
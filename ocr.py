@@ -0,0 +1,309 @@
+## OCR fallback for scanned pages
+# Scanned reports have no text layer: their pages extract as empty strings and
+# the agents reasoned over nothing. pdf_extract.iter_pages now sends only the
+# pages without text here; text-bearing pages keep the fast path. Each page is
+# rendered at a bounded resolution and read by Tesseract on a process pool of
+# its own, one page per task, within a time budget per document. Results are
+# cached by a hash of the page's image data, so a page scanned once is not read
+# again, whichever document or request it comes back in.
+#
+# Optional dependencies: pytesseract and Pillow plus the tesseract binary, and
+# pypdfium2 to render pages (without it the page's largest embedded image is used).
+# They are imported when OCR is first considered, not with this module:
+# pytesseract alone pulls in numpy and pandas.
+import hashlib
+import logging
+import io
+import math
+import multiprocessing
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
+import config
+from deadlines import remaining_time
+
+logger = logging.getLogger(__name__)
+
+pytesseract = None
+pypdfium2 = None
+_libraries_loaded = False
+_libraries_lock = threading.Lock()
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+# PDF user space is 72 points per inch
+POINTS_PER_INCH = 72.0
+
+_pool = None
+_pool_lock = threading.Lock()
+_available = None
+
+
+def _load_libraries():
+    """Imports the optional OCR libraries once; the missing ones stay None."""
+    global pytesseract, pypdfium2, _libraries_loaded
+    with _libraries_lock:
+        if _libraries_loaded:
+            return
+        try:
+            import pytesseract as tesseract_module
+            import PIL.Image  # noqa: F401
+            pytesseract = tesseract_module
+        except ImportError:
+            pass
+        try:
+            import pypdfium2 as pdfium_module
+            pypdfium2 = pdfium_module
+        except ImportError:
+            pass
+        _libraries_loaded = True
+
+
+def ocr_available() -> bool:
+    """True if OCR is enabled and pytesseract, Pillow and the tesseract binary are present."""
+    global _available
+    if _available is None:
+        if config.OCR_ENABLED:
+            _load_libraries()
+        binary = config.OCR_TESSERACT_CMD or "tesseract"
+        _available = bool(config.OCR_ENABLED and pytesseract is not None and shutil.which(binary))
+        if config.OCR_ENABLED and not _available:
+            logger.warning("OCR unavailable (needs pytesseract, Pillow and the tesseract binary); "
+                           "scanned pages will be read as empty. pip install pytesseract pillow pypdfium2")
+    return _available
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """Returns the OCR pool, starting it on first use.
+
+    Separate from the PDF text pool: OCR pages take seconds each and must not
+    queue ahead of the cheap text extraction of other reports.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=max(1, config.OCR_WORKERS),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+    return _pool
+
+
+def shutdown_pool():
+    """Stops the OCR pool (it is restarted lazily if needed again)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def _render_scale(width_pt: float, height_pt: float, dpi: int, max_pixels: int) -> float:
+    """Pixels per point for rendering a page at dpi, lowered to stay within max_pixels."""
+    scale = dpi / POINTS_PER_INCH
+    pixels = width_pt * height_pt * scale * scale
+    if max_pixels and pixels > max_pixels:
+        scale *= math.sqrt(max_pixels / pixels)
+    return scale
+
+
+def _page_image(source, index: int, dpi: int, max_pixels: int):
+    """Worker: the page as a greyscale PIL image of at most dpi and max_pixels, or None."""
+    _load_libraries()
+    if pypdfium2 is not None:
+        document = pypdfium2.PdfDocument(source)
+        try:
+            page = document[index]
+            width_pt, height_pt = page.get_size()
+            return page.render(scale=_render_scale(width_pt, height_pt, dpi, max_pixels)).to_pil().convert("L")
+        finally:
+            document.close()
+
+    page = PdfReader(io.BytesIO(source) if isinstance(source, bytes) else source).pages[index]
+    images = [image.image for image in page.images]
+    if not images:
+        return None
+    image = max(images, key=lambda im: im.width * im.height)
+    # Downscale scans stored above the DPI limit; never upscale
+    page_width_in = float(page.mediabox.width) / POINTS_PER_INCH
+    factor = min(1.0, dpi / (image.width / page_width_in)) if page_width_in > 0 else 1.0
+    if max_pixels and image.width * image.height * factor * factor > max_pixels:
+        factor = math.sqrt(max_pixels / (image.width * image.height))
+    if factor < 1.0:
+        image = image.resize((max(1, int(image.width * factor)), max(1, int(image.height * factor))))
+    return image.convert("L")
+
+
+def _ocr_page(source, index: int, dpi: int, max_pixels: int, lang: str, timeout: float) -> str:
+    """Worker: Tesseract text of one page (a path or the PDF bytes)."""
+    _load_libraries()
+    if config.OCR_TESSERACT_CMD:
+        pytesseract.pytesseract.tesseract_cmd = config.OCR_TESSERACT_CMD
+    image = _page_image(source, index, dpi, max_pixels)
+    if image is None:
+        return ""
+    # Tesseract itself is killed once the page's share of the budget is used up
+    return pytesseract.image_to_string(image, lang=lang, timeout=max(1, int(timeout)))
+
+
+def page_image_hash(page) -> str:
+    """SHA-256 of a pypdf page's image streams and content stream, plus the OCR settings.
+
+    Returns None for pages with neither (blank pages), and for pages without
+    images when there is no renderer to turn their drawing into pixels.
+    """
+    _load_libraries()
+    digest = hashlib.sha256()
+    found_images = False
+    resources = page.get("/Resources")
+    xobjects = resources.get_object().get("/XObject") if resources is not None else None
+    for _name, ref in sorted((xobjects.get_object() if xobjects is not None else {}).items()):
+        obj = ref.get_object()
+        if obj.get("/Subtype") == "/Image":
+            digest.update(obj.get_data())
+            found_images = True
+    contents = page.get_contents()
+    content_data = contents.get_data() if contents is not None else b""
+    if not found_images and (pypdfium2 is None or not content_data.strip()):
+        return None
+    digest.update(content_data)
+    digest.update(f"|{config.OCR_DPI}|{config.OCR_MAX_PIXELS}|{config.OCR_LANG}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class OcrCache:
+    """LRU of OCR text by page-image hash, with the OCR counters."""
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max(1, max_entries)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.pages = 0
+        self.blank_pages = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.ocr_seconds = 0.0
+
+    def get(self, key: str):
+        with self._lock:
+            text = self._entries.get(key)
+            if text is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return text
+
+    def put(self, key: str, text: str, seconds: float = None):
+        """Caches the text of a page; seconds, if given, is the OCR time it took."""
+        with self._lock:
+            self._entries[key] = text
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            if seconds is not None:
+                self.pages += 1
+                self.ocr_seconds += seconds
+
+    def count(self, counter: str):
+        """Adds one to a page counter: "blank_pages", "timeouts" or "failures"."""
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "available": ocr_available(),
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "pages_ocred": self.pages,
+                "blank_pages": self.blank_pages,
+                "timeouts": self.timeouts,
+                "failures": self.failures,
+                "ocr_seconds": round(self.ocr_seconds, 3),
+            }
+
+
+ocr_cache = OcrCache(config.OCR_CACHE_ENTRIES)
+
+
+def _done(text: str) -> Future:
+    future = Future()
+    future.set_result(text)
+    return future
+
+
+class OcrDocument:
+    """OCR of the text-less pages of one document, within one time budget.
+
+    Args:
+        reader (PdfReader): The document, for hashing page images in this process.
+        source: What the workers open: the file path, or the PDF bytes.
+        timeout (float, optional): Seconds for all pages of the document together.
+            Defaults to config.OCR_DOCUMENT_TIMEOUT_SECONDS, or the time left
+            before the request's deadline if that is shorter.
+    """
+
+    def __init__(self, reader, source, timeout: float = None):
+        self.reader = reader
+        self.source = source
+        self.timeout = remaining_time(config.OCR_DOCUMENT_TIMEOUT_SECONDS if timeout is None else timeout)
+        self.deadline = time.monotonic() + self.timeout
+        self._keys = {}
+        self._inflight = {}
+        self._started = {}
+
+    def submit(self, index: int) -> Future:
+        """Starts OCR of page index; cached and blank pages complete immediately."""
+        key = page_image_hash(self.reader.pages[index])
+        if key is None:
+            ocr_cache.count("blank_pages")
+            return _done("")
+        text = ocr_cache.get(key)
+        if text is not None:
+            return _done(text)
+        # The same scan repeated inside one document is read once
+        if key in self._inflight:
+            return self._inflight[key]
+        remaining = self.deadline - time.monotonic()
+        future = _get_pool().submit(_ocr_page, self.source, index, config.OCR_DPI,
+                                    config.OCR_MAX_PIXELS, config.OCR_LANG, remaining)
+        self._keys[future] = key
+        self._inflight[key] = future
+        self._started[future] = time.monotonic()
+        return future
+
+    def result(self, future: Future, index: int) -> str:
+        """The text of a submitted page, or "" if it failed or the budget ran out."""
+        key = self._keys.get(future)
+        if key is None:
+            return future.result()
+        try:
+            text = future.result(timeout=max(0.0, self.deadline - time.monotonic()))
+        except FutureTimeoutError:
+            future.cancel()
+            ocr_cache.count("timeouts")
+            logger.warning("OCR of page %d exceeded the document budget of %gs; leaving it empty",
+                           index + 1, self.timeout)
+            return ""
+        except Exception:
+            ocr_cache.count("failures")
+            logger.exception("OCR of page %d failed", index + 1)
+            return ""
+        if self._keys.pop(future, None) is not None:
+            ocr_cache.put(key, text, seconds=time.monotonic() - self._started.pop(future))
+        return text
+
+    def close(self):
+        """Cancels pages still waiting for a worker."""
+        for future in self._inflight.values():
+            future.cancel()
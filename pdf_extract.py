@@ -0,0 +1,222 @@
+## Page-parallel PDF text extraction
+# Large hospital panels used to be parsed page by page in the request thread,
+# re-importing `re` per page and growing the report with `+=`. Pages are now
+# parsed in chunks on a process pool (for reports big enough to benefit) and
+# streamed back in order, so consumers can start on page 1 early. Pages without
+# a text layer (scans) are read by OCR instead (see ocr.py). Parsing for a
+# request stops at its deadline (see deadlines.py); nothing partial is cached.
+import io
+import logging
+import multiprocessing
+import os
+import re
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
+import config
+import ocr
+from deadlines import check_deadline, remaining_time
+from upload_buffers import is_memory_handle, open_source, upload_buffers
+
+logger = logging.getLogger(__name__)
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    print("pypdf not found; PDF extraction falls back to PyPDFLoader. pip install pypdf")
+    PdfReader = None
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def clean_page(text: str) -> str:
+    """Collapses all whitespace runs to single spaces, as the report reader always has."""
+    return _WHITESPACE_RE.sub(" ", text or "").strip()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """Returns the shared extraction pool, starting it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: the API process is multi-threaded, forking it is unsafe
+            _pool = ProcessPoolExecutor(
+                max_workers=max(1, config.PDF_WORKERS),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+    return _pool
+
+
+def _ping() -> int:
+    """Worker: no-op whose only effect is importing this module (and pypdf)."""
+    return os.getpid()
+
+
+def warm_pool():
+    """Starts every extraction worker now instead of on the first large PDF."""
+    pool = _get_pool()
+    for future in [pool.submit(_ping) for _ in range(max(1, config.PDF_WORKERS))]:
+        future.result()
+
+
+def shutdown_pool():
+    """Stops the extraction pool (it is restarted lazily if needed again)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def _extract_page_range(source, start: int, stop: int) -> list:
+    """Worker: cleaned text of pages [start, stop) of the PDF (a path or its bytes)."""
+    reader = PdfReader(io.BytesIO(source) if isinstance(source, bytes) else source)
+    return [clean_page(reader.pages[i].extract_text()) for i in range(start, stop)]
+
+
+def _worker_source(path: str):
+    """What to send to a worker process: the path, or the bytes of an in-memory upload."""
+    return upload_buffers.data(path) if is_memory_handle(path) else path
+
+
+def page_count(path: str) -> int:
+    """Number of pages in the PDF."""
+    return len(PdfReader(open_source(path)).pages)
+
+
+def _page_window(total: int, first_page: int, max_pages: int) -> tuple:
+    start = max(0, first_page)
+    stop = total
+    if max_pages:
+        stop = min(stop, start + max_pages)
+        if stop < total:
+            logger.info("Report has %d pages; extracting pages %d-%d only", total, start + 1, stop)
+    return start, stop
+
+
+def iter_pages(path: str, first_page: int = 0, max_pages: int = None):
+    """Yields the cleaned text of each page, in order, as soon as it is parsed.
+
+    Reports with at least config.PDF_PARALLEL_MIN_PAGES pages are split into
+    chunks of config.PDF_PAGES_PER_TASK pages and parsed on the process pool;
+    smaller ones are parsed in-process. Pages with less than
+    config.OCR_MIN_CHARS characters of text go through OCR when it is available.
+    Every page is a cancellation point for the calling request's deadline
+    (raising DeadlineExceeded).
+
+    Args:
+        path (str): PDF file or in-memory upload handle.
+        first_page (int, optional): Zero-based page to start at.
+        max_pages (int, optional): Page limit. Defaults to config.PDF_MAX_PAGES.
+    """
+    max_pages = config.PDF_MAX_PAGES if max_pages is None else max_pages
+
+    if PdfReader is None:
+        # Fallback: the langchain loader, sequential and all at once
+        from langchain_community.document_loaders import PyPDFLoader
+        docs = PyPDFLoader(file_path=path).load()
+        start, stop = _page_window(len(docs), first_page, max_pages)
+        for doc in docs[start:stop]:
+            yield clean_page(doc.page_content)
+        return
+
+    reader = PdfReader(open_source(path))
+    start, stop = _page_window(len(reader.pages), first_page, max_pages)
+    yield from _with_ocr(path, _text_pages(path, reader, start, stop), reader)
+
+
+def _text_pages(path: str, reader, start: int, stop: int):
+    """Yields (page index, text layer) of pages [start, stop), in order."""
+    if stop - start < max(1, config.PDF_PARALLEL_MIN_PAGES):
+        for i in range(start, stop):
+            check_deadline()
+            yield i, clean_page(reader.pages[i].extract_text())
+        return
+
+    step = max(1, config.PDF_PAGES_PER_TASK)
+    pool = _get_pool()
+    source = _worker_source(path)
+    futures = [pool.submit(_extract_page_range, source, i, min(i + step, stop)) for i in range(start, stop, step)]
+    try:
+        index = start
+        for future in futures:
+            try:
+                chunk = future.result(remaining_time())
+            except FutureTimeoutError:
+                check_deadline()
+                raise
+            for text in chunk:
+                yield index, text
+                index += 1
+    finally:
+        # Consumer stopped early (or a chunk failed): drop the remaining work
+        for future in futures:
+            future.cancel()
+
+
+def _with_ocr(path: str, pages, reader=None):
+    """Yields page texts in order, replacing text-less pages with their OCR text.
+
+    OCR of a page starts as soon as its empty text layer is seen. Later pages
+    are held back only while an earlier page is still being read, so a report
+    with a text layer streams exactly as before.
+
+    Args:
+        path (str): The document (file path or in-memory upload handle).
+        pages: (page index, text layer) pairs in page order.
+        reader (PdfReader, optional): The open document, if the caller has one.
+    """
+    document = None
+    pending = deque()
+    try:
+        for index, text in pages:
+            check_deadline()
+            if len(text) >= config.OCR_MIN_CHARS or not ocr.ocr_available():
+                pending.append((index, text, None))
+            else:
+                if document is None:
+                    document = ocr.OcrDocument(reader or PdfReader(open_source(path)), _worker_source(path))
+                pending.append((index, text, document.submit(index)))
+            while pending and (pending[0][2] is None or pending[0][2].done()):
+                yield _resolve(document, *pending.popleft())
+        while pending:
+            text = _resolve(document, *pending.popleft())
+            # OCR cut short by the deadline must not end up in the report cache
+            check_deadline()
+            yield text
+    finally:
+        if document is not None:
+            document.close()
+
+
+def _resolve(document, index: int, text: str, future) -> str:
+    if future is None:
+        return text
+    # Keep whatever little text the page had if OCR produced nothing
+    return clean_page(document.result(future, index)) or text
+
+
+def extract_text(path: str, first_page: int = 0, max_pages: int = None) -> str:
+    """Full cleaned report text, one line per page."""
+    return "".join([page + "\n" for page in iter_pages(path, first_page, max_pages)])
+
+
+def extract_text_pooled(path: str, max_pages: int = None) -> str:
+    """extract_text that also runs small reports on the process pool.
+
+    For parsing many reports side by side (batches): threads calling this spread
+    the CPU work over the worker processes instead of contending for the GIL.
+    Large reports take the page-parallel path of extract_text as usual.
+    """
+    max_pages = config.PDF_MAX_PAGES if max_pages is None else max_pages
+    if PdfReader is None:
+        return extract_text(path, max_pages=max_pages)
+    start, stop = _page_window(page_count(path), 0, max_pages)
+    if stop - start >= max(1, config.PDF_PARALLEL_MIN_PAGES):
+        return extract_text(path, max_pages=max_pages)
+    pages = _get_pool().submit(_extract_page_range, _worker_source(path), start, stop).result()
+    return "".join([page + "\n" for page in _with_ocr(path, enumerate(pages, start))])
@@ -0,0 +1,258 @@
+## Multi-task analysis pipeline
+# Verification runs first as a gate; the independent analyses (summary,
+# nutrition, exercise) then run concurrently, each in its own single-task crew,
+# so wall-clock time tracks the slowest branch rather than the sum of them.
+# The crews come from a pool of isolated instances (see crew_pool.py). Runs stop
+# at the request's deadline with whatever tasks finished (see deadlines.py).
+# crewai and the agent/task modules are only imported on first use, so
+# importing this module (and main.py) stays fast.
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from result_cache import definitions_fingerprint
+from crew_pool import CrewPool, CrewPoolTimeoutError
+from deadlines import (DeadlineExceeded, current_deadline, deadline_expired, remaining_time,
+                       completed_before_deadline)
+from observability import bind_context
+from history import NO_PATIENT
+from reference_eval import NO_FINDINGS
+
+logger = logging.getLogger(__name__)
+
+# The verification gate: its selectable name and the task.py name of its task
+VERIFICATION = "verification"
+
+# Selectable analysis name -> task.py name of the task running it
+ANALYSIS_TASKS = {
+    "summary": "help_patients",
+    "nutrition": "nutrition_analysis",
+    "exercise": "exercise_planning",
+}
+
+# Section titles used when merging branch outputs into one response
+ANALYSIS_TITLES = {
+    "summary": "Health Summary",
+    "nutrition": "Nutrition Analysis",
+    "exercise": "Exercise Plan",
+}
+
+PIPELINE_TASK_NAMES = (VERIFICATION,) + tuple(ANALYSIS_TASKS)
+
+# Crew instances shared by all requests; each run checks one out exclusively
+crew_pool = CrewPool()
+
+_fingerprint = None
+_fingerprint_lock = threading.Lock()
+
+
+def get_definitions_fingerprint() -> str:
+    """Identifies the current agent/task definitions for the result cache.
+
+    Computed once, on first use, from the module-level agents and tasks. Those
+    are never kicked off (runs use pooled copies), so their task descriptions
+    are still the uninterpolated templates.
+    """
+    global _fingerprint
+    with _fingerprint_lock:
+        if _fingerprint is None:
+            import agents
+            import task as task_definitions
+            _fingerprint = definitions_fingerprint(
+                [agents.doctor, agents.verifier, agents.nutritionist, agents.exercise_specialist],
+                [task_definitions.verification, task_definitions.help_patients,
+                 task_definitions.nutrition_analysis, task_definitions.exercise_planning],
+                [agents.__file__, task_definitions.__file__],
+            )
+    return _fingerprint
+
+
+class ReportRejectedError(Exception):
+    """Raised when the verification gate decides the upload is not a blood report."""
+
+    def __init__(self, verification_output: str):
+        super().__init__("The uploaded file is not a valid blood test report")
+        self.verification_output = verification_output
+
+
+def parse_task_selection(selection: str = None) -> list:
+    """Turns a comma separated task list into validated pipeline task names.
+
+    Args:
+        selection (str, optional): e.g. "verification,nutrition". Empty means
+            config.PIPELINE_DEFAULT_TASKS.
+
+    Raises:
+        ValueError: On unknown names or when no analysis is selected.
+    """
+    if not selection or not selection.strip():
+        selection = config.PIPELINE_DEFAULT_TASKS
+    names = []
+    for name in selection.split(","):
+        name = name.strip().lower()
+        if not name:
+            continue
+        if name not in PIPELINE_TASK_NAMES:
+            raise ValueError(f"Unknown task '{name}'. Choose from: {', '.join(PIPELINE_TASK_NAMES)}")
+        if name not in names:
+            names.append(name)
+    if not any(name in ANALYSIS_TASKS for name in names):
+        raise ValueError(f"Select at least one analysis: {', '.join(ANALYSIS_TASKS)}")
+    # Keep a stable order so results and cache keys do not depend on input order
+    return [name for name in PIPELINE_TASK_NAMES if name in names]
+
+
+def is_verified(verification_output: str) -> bool:
+    """Reads the VALID/INVALID verdict the verification task is asked to lead with."""
+    text = str(verification_output).strip().upper()
+    return not text.startswith("INVALID")
+
+
+def _step_reporter(on_event, name: str):
+    """crewai step_callback forwarding each agent step as a 'step' event."""
+    if on_event is None:
+        return None
+
+    def report(step):
+        text = getattr(step, "text", None) or getattr(step, "output", None) or str(step)
+        on_event("step", {"task": name, "text": str(text)})
+    return report
+
+
+def run_pipeline(query: str, file_path: str, tasks: list = None, on_event=None, history: str = None,
+                 findings: str = None) -> dict:
+    """Runs the selected pipeline tasks for one report.
+
+    Args:
+        query (str): The user's question.
+        file_path (str): Stored report the tools should read.
+        tasks (list, optional): Names from PIPELINE_TASK_NAMES. Defaults to the config default.
+        history (str, optional): Changes since the patient's earlier reports
+            (history.ReportChanges.to_text), handed to the summary task.
+        findings (str, optional): The report's out-of-range markers
+            (reference_eval.Evaluation.findings_text), handed to the summary task.
+        on_event (callable, optional): Progress hook called as on_event(name, data) from
+            worker threads: 'verification', 'step', 'task', 'task_error' and
+            'task_incomplete' events.
+
+    Returns:
+        dict: "verification" (str or None), "analyses" (name -> output),
+            "errors" (name -> message), the merged "analysis" text, and
+            "incomplete" (tasks the deadline cut off) with "partial" set if any were,
+            and "stop_reason" (deadlines.REASON_*, or None if the run completed).
+
+    Raises:
+        ReportRejectedError: If verification runs and rejects the file.
+        RuntimeError: If every selected analysis failed.
+    """
+    if tasks is None:
+        tasks = parse_task_selection()
+    inputs = {'query': query, 'file_path': file_path, 'history': history or NO_PATIENT,
+              'findings': findings or NO_FINDINGS}
+    branches = [name for name in tasks if name in ANALYSIS_TASKS]
+    analyses = {}
+    errors = {}
+
+    try:
+        with crew_pool.checkout(remaining_time(crew_pool.checkout_timeout)) as crew_instance:
+            verification_output = _run_tasks(crew_instance, tasks, inputs, on_event, analyses, errors)
+    except CrewPoolTimeoutError:
+        if not deadline_expired():
+            raise
+        verification_output = None
+    # Merge in the requested order, not completion order
+    analyses = {name: analyses[name] for name in branches if name in analyses}
+    finished = set(analyses) | set(errors) | ({VERIFICATION} if verification_output is not None else set())
+    incomplete = [name for name in tasks if name not in finished]
+    stop_reason = None
+    if incomplete:
+        deadline = current_deadline()
+        stop_reason = deadline.reason if deadline is not None else None
+        reason = deadline.describe() if deadline is not None else "stopped early"
+        logger.warning("Pipeline stopped early (%s); incomplete: %s", reason, ", ".join(incomplete))
+        if on_event:
+            for name in incomplete:
+                on_event("task_incomplete", {"name": name, "reason": reason})
+
+    if not analyses and not incomplete:
+        raise RuntimeError("All analyses failed: " + "; ".join(f"{k}: {v}" for k, v in errors.items()))
+
+    return {
+        "verification": verification_output,
+        "analyses": analyses,
+        "errors": errors,
+        "analysis": merge_outputs(analyses),
+        "incomplete": incomplete,
+        "partial": bool(incomplete),
+        "stop_reason": stop_reason,
+    }
+
+
+def _run_tasks(crew_instance, tasks: list, inputs: dict, on_event, analyses: dict, errors: dict):
+    """Runs verification, then the analysis branches, until they finish or the deadline is up.
+
+    Branch outputs and failures are added to analyses and errors as they come
+    in. Kickoffs still running at the deadline are left to fail at their next
+    cancellation point; they are recorded on the crew instance, which the pool
+    only takes back once they have stopped.
+
+    Returns:
+        str: The verification output, or None if it did not run or finish.
+    """
+    branches = [name for name in tasks if name in ANALYSIS_TASKS]
+    executor = ThreadPoolExecutor(max_workers=max(1, len(branches)), thread_name_prefix="crew-branch")
+    futures = {}
+    try:
+        verification_output = None
+        if VERIFICATION in tasks:
+            future = executor.submit(bind_context(crew_instance.kickoff), VERIFICATION, inputs,
+                                     _step_reporter(on_event, VERIFICATION))
+            futures[future] = VERIFICATION
+            if not list(completed_before_deadline([future])):
+                return None
+            try:
+                verification_output = str(future.result())
+            except Exception:
+                if not deadline_expired():
+                    raise
+                return None
+            verified = is_verified(verification_output)
+            if on_event:
+                on_event("verification", {"verified": verified, "output": verification_output})
+            if not verified:
+                raise ReportRejectedError(verification_output)
+
+        # Each branch has its own agent and task within the instance, so they
+        # can run side by side. bind_context hands every branch the request's
+        # deadline and priority class.
+        for name in branches:
+            futures[executor.submit(bind_context(crew_instance.kickoff), ANALYSIS_TASKS[name], inputs,
+                                    _step_reporter(on_event, name))] = name
+        # Report each branch as soon as it finishes
+        for future in completed_before_deadline([f for f, name in futures.items() if name != VERIFICATION]):
+            name = futures[future]
+            try:
+                analyses[name] = str(future.result())
+                if on_event:
+                    on_event("task", {"name": name, "output": analyses[name]})
+            except Exception as e:
+                if isinstance(e, DeadlineExceeded) or deadline_expired():
+                    # Cut off, not failed: reported as incomplete
+                    continue
+                logger.exception("Pipeline task '%s' failed", name)
+                errors[name] = str(e)
+                if on_event:
+                    on_event("task_error", {"name": name, "error": str(e)})
+        return verification_output
+    finally:
+        stragglers = [future for future in futures if not future.done()]
+        crew_instance.stragglers = stragglers
+        executor.shutdown(wait=not stragglers, cancel_futures=True)
+
+
+def merge_outputs(analyses: dict) -> str:
+    """Joins branch outputs into one document with a heading per analysis."""
+    if len(analyses) == 1:
+        return next(iter(analyses.values()))
+    return "\n\n".join(f"## {ANALYSIS_TITLES[name]}\n{output}" for name, output in analyses.items())
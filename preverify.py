@@ -0,0 +1,150 @@
+## Fast local pre-verification of uploads
+# A cheap classifier that runs before any crew: magic bytes, MIME type, page
+# count and the density of lab keywords and value+unit pairs on the first page.
+# Clear rejects fail in milliseconds, clear blood reports skip the LLM verifier,
+# and only ambiguous files still go through the verification task.
+import re
+
+import config
+from markers import extract_markers, UNIT_ALIASES
+from upload_buffers import open_source, read_head
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    print("pypdf not found; pre-verification will only check file signatures. pip install pypdf")
+    PdfReader = None
+
+VERDICT_ACCEPT = "accept"
+VERDICT_REJECT = "reject"
+VERDICT_AMBIGUOUS = "ambiguous"
+
+PDF_MAGIC = b"%PDF-"
+# Some clients (and curl without -F type=) send a generic type for PDFs
+ALLOWED_CONTENT_TYPES = {
+    None, "", "application/pdf", "application/x-pdf", "application/acrobat",
+    "application/octet-stream", "binary/octet-stream",
+}
+
+LAB_KEYWORDS = (
+    "blood", "test", "report", "result", "results", "reference", "range", "interval", "units",
+    "laboratory", "lab", "specimen", "sample", "serum", "plasma", "patient", "collected",
+    "cbc", "haematology", "hematology", "biochemistry", "lipid", "profile", "panel", "count",
+)
+
+_WORD_RE = re.compile(r"[A-Za-z][A-Za-z0-9()/-]*")
+_KEYWORD_RE = re.compile(r"(?<![A-Za-z])(?:" + "|".join(LAB_KEYWORDS) + r")(?![A-Za-z])", re.IGNORECASE)
+_VALUE_UNIT_RE = re.compile(
+    r"\d+(?:[.,]\d+)?\s*(?:" + "|".join(re.escape(u) for u in sorted(UNIT_ALIASES, key=len, reverse=True)) + r")(?![A-Za-z])",
+    re.IGNORECASE,
+)
+
+
+class PreverificationResult:
+    """Outcome of the local classifier."""
+
+    def __init__(self, verdict: str, score: float, reason: str, page_count: int = None, details: dict = None):
+        self.verdict = verdict
+        self.score = score
+        self.reason = reason
+        self.page_count = page_count
+        self.details = details or {}
+
+    @property
+    def rejected(self) -> bool:
+        return self.verdict == VERDICT_REJECT
+
+    @property
+    def accepted(self) -> bool:
+        return self.verdict == VERDICT_ACCEPT
+
+    def to_dict(self) -> dict:
+        return {
+            "verdict": self.verdict,
+            "score": round(self.score, 3),
+            "reason": self.reason,
+            "page_count": self.page_count,
+            **self.details,
+        }
+
+
+def score_text(text: str) -> tuple:
+    """Scores how much a page of text looks like a lab report, between 0 and 1.
+
+    Returns:
+        tuple: (score, details dict with the individual signal counts)
+    """
+    words = len(_WORD_RE.findall(text))
+    keyword_hits = len(_KEYWORD_RE.findall(text))
+    value_units = len(_VALUE_UNIT_RE.findall(text))
+    marker_count = len(extract_markers(text))
+    keyword_density = keyword_hits / words if words else 0.0
+
+    score = (
+        0.5 * min(1.0, marker_count / 4)
+        + 0.3 * min(1.0, value_units / 5)
+        + 0.2 * min(1.0, keyword_density / 0.05)
+    )
+    details = {
+        "words": words,
+        "keyword_hits": keyword_hits,
+        "value_unit_pairs": value_units,
+        "markers": marker_count,
+    }
+    return score, details
+
+
+def classify_report(path: str, content_type: str = None, reject_score: float = None,
+                    accept_score: float = None, max_pages: int = None) -> PreverificationResult:
+    """Classifies a stored upload as a blood report (accept), not one (reject) or unsure.
+
+    Args:
+        path (str): Stored upload (file path or in-memory handle).
+        content_type (str, optional): MIME type the client declared.
+        reject_score, accept_score (float, optional): Thresholds, default from config.
+        max_pages (int, optional): Page limit, default from config.
+    """
+    reject_score = config.PREVERIFY_REJECT_SCORE if reject_score is None else reject_score
+    accept_score = config.PREVERIFY_ACCEPT_SCORE if accept_score is None else accept_score
+    max_pages = config.PREVERIFY_MAX_PAGES if max_pages is None else max_pages
+
+    if content_type is not None:
+        content_type = content_type.split(";")[0].strip().lower()
+    if content_type not in ALLOWED_CONTENT_TYPES:
+        return PreverificationResult(VERDICT_REJECT, 0.0, f"Unsupported content type: {content_type}")
+
+    try:
+        head = read_head(path, 1024)
+    except (OSError, KeyError) as e:
+        return PreverificationResult(VERDICT_REJECT, 0.0, f"Could not read upload: {e}")
+    if PDF_MAGIC not in head:
+        return PreverificationResult(VERDICT_REJECT, 0.0, "File is not a PDF")
+
+    if PdfReader is None:
+        return PreverificationResult(VERDICT_AMBIGUOUS, 0.0, "PDF text inspection unavailable")
+
+    try:
+        reader = PdfReader(open_source(path))
+        page_count = len(reader.pages)
+    except Exception as e:
+        return PreverificationResult(VERDICT_REJECT, 0.0, f"Unreadable PDF: {e}")
+
+    if page_count == 0:
+        return PreverificationResult(VERDICT_REJECT, 0.0, "PDF has no pages", page_count)
+    if max_pages and page_count > max_pages:
+        return PreverificationResult(VERDICT_REJECT, 0.0, f"PDF has {page_count} pages (limit {max_pages})", page_count)
+
+    try:
+        text = reader.pages[0].extract_text() or ""
+    except Exception as e:
+        return PreverificationResult(VERDICT_AMBIGUOUS, 0.0, f"Could not extract first page text: {e}", page_count)
+    if not text.strip():
+        # Probably a scanned report; let the full pipeline decide
+        return PreverificationResult(VERDICT_AMBIGUOUS, 0.0, "First page has no text layer", page_count)
+
+    score, details = score_text(text)
+    if score <= reject_score:
+        return PreverificationResult(VERDICT_REJECT, score, "Does not look like a blood test report", page_count, details)
+    if score >= accept_score:
+        return PreverificationResult(VERDICT_ACCEPT, score, "Looks like a blood test report", page_count, details)
+    return PreverificationResult(VERDICT_AMBIGUOUS, score, "Needs LLM verification", page_count, details)
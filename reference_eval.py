@@ -0,0 +1,470 @@
+## Vectorised reference-range evaluation
+# Checking values against reference ranges was left to the doctor agent
+# ("highlight any abnormalities"), one report at a time and against whatever
+# range the report happened to print. This checks the markers of any number of
+# reports in one NumPy pass: every reading gets the most specific range for the
+# patient's sex and age (reference/reference_ranges.json, with
+# markers.DEFAULT_RANGES as the catch-all), an out-of-range flag, a z-score and
+# a severity tier. The summary task is handed only the flagged findings, batches
+# get a per-marker cohort summary, and the nutritionist's tool is built on it.
+#
+# A range printed on the report wins over the tables unless
+# config.EVAL_PREFER_REPORT_RANGES is off: labs calibrate it to their own assay.
+#
+# Optional dependency: numpy, imported on the first evaluation rather than with
+# this module, so it stays out of the API's import time.
+import json
+import logging
+import re
+import threading
+
+import config
+from markers import MARKER_SYNONYMS, DEFAULT_RANGES, FLAG_LOW, FLAG_HIGH, FLAG_NORMAL, extract_markers
+
+logger = logging.getLogger(__name__)
+
+np = None
+_numpy_checked = False
+_numpy_lock = threading.Lock()
+
+SEX_ANY = 0
+SEX_MALE = 1
+SEX_FEMALE = 2
+_SEX_NAMES = {SEX_ANY: None, SEX_MALE: "male", SEX_FEMALE: "female"}
+_SEX_CODES = {"any": SEX_ANY, "m": SEX_MALE, "male": SEX_MALE, "man": SEX_MALE,
+              "f": SEX_FEMALE, "female": SEX_FEMALE, "woman": SEX_FEMALE}
+
+SEVERITY_NORMAL = 0
+SEVERITY_MILD = 1
+SEVERITY_MODERATE = 2
+SEVERITY_SEVERE = 3
+SEVERITY_NAMES = ("normal", "mild", "moderate", "severe")
+
+# Where a reading's range came from
+SOURCE_NONE = 0
+SOURCE_REPORT = 1
+SOURCE_TABLE = 2
+_SOURCE_NAMES = (None, "report", "table")
+
+_FLAG_NAMES = {-1: FLAG_LOW, 0: FLAG_NORMAL, 1: FLAG_HIGH}
+
+# A reference interval covers the middle 95% of healthy people: mean +/- 1.96 SD
+Z_95 = 1.959964
+
+MARKER_KEYS = tuple(MARKER_SYNONYMS)
+_MARKER_INDEX = {key: index for index, key in enumerate(MARKER_KEYS)}
+
+# Readings matched against the reference table at once; bounds the
+# (readings x table rows) match matrix to a few MB
+_LOOKUP_CHUNK = 65536
+
+NO_FINDINGS = "No reference-range check was run for this report; judge the marker flags yourself."
+
+_AGE_RE = re.compile(
+    r"\bage\b(?:\s*/\s*(?:sex|gender))?\s*[:\-]?\s*(?P<age>\d{1,3})(?:\s*(?:y|yrs?|years?)\b)?",
+    re.IGNORECASE,
+)
+_SEX_RE = re.compile(r"\b(?:sex|gender)\b[^\n]{0,20}?\b(?P<sex>male|female|m|f)\b", re.IGNORECASE)
+
+
+def evaluation_available() -> bool:
+    """True if numpy is installed; imports it on the first call."""
+    global np, _numpy_checked
+    with _numpy_lock:
+        if not _numpy_checked:
+            try:
+                import numpy
+                np = numpy
+            except ImportError:
+                logger.warning("numpy not found; reference-range evaluation is disabled. pip install numpy")
+            _numpy_checked = True
+    return np is not None
+
+
+def _require_numpy():
+    if not evaluation_available():
+        raise RuntimeError("Reference-range evaluation needs numpy (pip install numpy)")
+
+
+def parse_sex(text) -> int:
+    """SEX_MALE, SEX_FEMALE or SEX_ANY (unknown) for a spelling like "F" or "female"."""
+    return _SEX_CODES.get(str(text or "").strip().lower(), SEX_ANY)
+
+
+def find_demographics(text: str) -> tuple:
+    """(sex code, age in years or None) as printed in a report, e.g. "Age/Sex: 45 Y / F"."""
+    sex = SEX_ANY
+    age = None
+    match = _SEX_RE.search(text or "")
+    if match:
+        sex = parse_sex(match.group("sex"))
+    match = _AGE_RE.search(text or "")
+    if match and 0 < int(match.group("age")) <= 120:
+        age = float(match.group("age"))
+    return sex, age
+
+
+def format_demographics(sex: int, age: float = None) -> str:
+    """A line find_demographics() reads back, e.g. "Sex: female, Age: 45"; "" if both are unknown."""
+    parts = []
+    if _SEX_NAMES.get(sex):
+        parts.append(f"Sex: {_SEX_NAMES[sex]}")
+    if age is not None:
+        parts.append(f"Age: {age:g}")
+    return ", ".join(parts)
+
+
+def _number(value, missing: float) -> float:
+    return missing if value is None else float(value)
+
+
+class ReferenceTable:
+    """Reference ranges by marker, sex and age band, held as arrays for the vectorised lookup.
+
+    Args:
+        entries (list): {"marker", "sex", "age_min", "age_max", "low", "high"}
+            dicts; ages in years with age_max exclusive, None for an open end.
+            markers.DEFAULT_RANGES is added as the catch-all for every marker.
+
+    Raises:
+        RuntimeError: If numpy is not installed.
+    """
+
+    def __init__(self, entries: list):
+        _require_numpy()
+        rows = []
+        for entry in entries:
+            key = entry.get("marker")
+            if key not in _MARKER_INDEX:
+                logger.warning("Skipping reference range for unknown marker %r", key)
+                continue
+            sex = parse_sex(entry.get("sex"))
+            age_min = _number(entry.get("age_min"), -np.inf)
+            age_max = _number(entry.get("age_max"), np.inf)
+            # The most specific band wins: sex-specific over any sex, age band over all ages
+            priority = 1 + 2 * (sex != SEX_ANY) + (age_min > -np.inf or age_max < np.inf)
+            rows.append((_MARKER_INDEX[key], sex, age_min, age_max,
+                         _number(entry.get("low"), np.nan), _number(entry.get("high"), np.nan), priority))
+        for key, (low, high) in DEFAULT_RANGES.items():
+            rows.append((_MARKER_INDEX[key], SEX_ANY, -np.inf, np.inf,
+                         _number(low, np.nan), _number(high, np.nan), 0))
+
+        columns = list(zip(*rows))
+        self.size = len(rows)
+        self.marker = np.array(columns[0], dtype=np.int32)
+        self.sex = np.array(columns[1], dtype=np.int8)
+        self.age_min = np.array(columns[2], dtype=np.float64)
+        self.age_max = np.array(columns[3], dtype=np.float64)
+        self.low = np.array(columns[4], dtype=np.float64)
+        self.high = np.array(columns[5], dtype=np.float64)
+        self.priority = np.array(columns[6], dtype=np.int8)
+
+    def lookup(self, marker, sex, age) -> tuple:
+        """The best matching (low, high) for every reading; NaN where no range applies.
+
+        Args:
+            marker (np.ndarray): Marker index (into MARKER_KEYS) of each reading.
+            sex (np.ndarray): Sex code of each reading's patient.
+            age (np.ndarray): Age in years of each reading's patient.
+        """
+        low = np.full(len(marker), np.nan)
+        high = np.full(len(marker), np.nan)
+        for start in range(0, len(marker), _LOOKUP_CHUNK):
+            stop = start + _LOOKUP_CHUNK
+            m = marker[start:stop, None]
+            s = sex[start:stop, None]
+            a = age[start:stop, None]
+            match = ((self.marker == m) & ((self.sex == SEX_ANY) | (self.sex == s))
+                     & (self.age_min <= a) & (a < self.age_max))
+            score = np.where(match, self.priority, -1)
+            best = score.argmax(axis=1)
+            found = score[np.arange(len(best)), best] >= 0
+            low[start:stop] = np.where(found, self.low[best], np.nan)
+            high[start:stop] = np.where(found, self.high[best], np.nan)
+        return low, high
+
+
+def load_reference_table(path: str = None) -> ReferenceTable:
+    """Reads the stratified ranges from a JSON list (see ReferenceTable); defaults only if unreadable."""
+    path = path or config.REFERENCE_RANGES_PATH
+    entries = []
+    if path:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Could not load reference ranges from %s: %s; using the adult defaults only", path, e)
+    return ReferenceTable(entries)
+
+
+_reference_table = None
+_reference_lock = threading.Lock()
+
+
+def get_reference_table() -> ReferenceTable:
+    """The process-wide reference table, loaded on first use."""
+    global _reference_table
+    with _reference_lock:
+        if _reference_table is None:
+            _reference_table = load_reference_table()
+        return _reference_table
+
+
+def warm_reference_table():
+    """Imports numpy and loads the reference table now, for the startup warm-up; a no-op without numpy."""
+    if evaluation_available():
+        get_reference_table()
+
+
+class MarkerTable:
+    """The marker readings of many reports, collected for one evaluate() pass.
+
+    Readings in a unit other than the marker's canonical one are only checked
+    against the range printed next to them, since the tables use canonical units.
+    """
+
+    def __init__(self):
+        self.report_ids = []
+        self.sexes = []
+        self.ages = []
+        self.markers = []
+        self.report_index = []
+
+    def __len__(self) -> int:
+        return len(self.markers)
+
+    def add_report(self, report_id, markers: list, sex: int = SEX_ANY, age: float = None) -> int:
+        """Adds one report's markers.Marker list; returns the report's index in the table."""
+        index = len(self.report_ids)
+        self.report_ids.append(report_id)
+        self.sexes.append(sex)
+        self.ages.append(float("nan") if age is None else float(age))
+        for marker in markers:
+            self.markers.append(marker)
+            self.report_index.append(index)
+        return index
+
+    @classmethod
+    def from_texts(cls, reports) -> "MarkerTable":
+        """A table of (report_id, report text) pairs; sex and age are read from each text."""
+        table = cls()
+        for report_id, text in reports:
+            sex, age = find_demographics(text)
+            table.add_report(report_id, extract_markers(text), sex, age)
+        return table
+
+
+class Evaluation:
+    """Per-reading arrays of one evaluate() pass over a MarkerTable."""
+
+    def __init__(self, table: MarkerTable, **arrays):
+        self.table = table
+        self.report = arrays["report"]
+        self.marker = arrays["marker"]
+        self.value = arrays["value"]
+        self.low = arrays["low"]
+        self.high = arrays["high"]
+        self.source = arrays["source"]
+        self.flag = arrays["flag"]
+        self.z = arrays["z"]
+        self.excess = arrays["excess"]
+        self.severity = arrays["severity"]
+
+    def __len__(self) -> int:
+        return len(self.value)
+
+    def flagged(self, report: int = None):
+        """Indices of the out-of-range readings, most severe first."""
+        selected = self.flag != 0
+        if report is not None:
+            selected &= self.report == report
+        indices = np.flatnonzero(selected)
+        order = np.lexsort((-self.excess[indices], -np.abs(np.nan_to_num(self.z[indices])),
+                            -self.severity[indices]))
+        return indices[order]
+
+    def row(self, i: int) -> dict:
+        marker = self.table.markers[i]
+        return {
+            "report": self.table.report_ids[self.report[i]],
+            "marker": marker.key,
+            "name": marker.name,
+            "value": marker.value,
+            "unit": marker.unit,
+            "ref_low": _optional(self.low[i]),
+            "ref_high": _optional(self.high[i]),
+            "range_source": _SOURCE_NAMES[self.source[i]],
+            "flag": _FLAG_NAMES[int(self.flag[i])] if self.source[i] != SOURCE_NONE else None,
+            "z": _optional(self.z[i], 2),
+            "severity": SEVERITY_NAMES[self.severity[i]],
+        }
+
+    def rows(self, report: int = None, flagged_only: bool = False) -> list:
+        if flagged_only:
+            return [self.row(i) for i in self.flagged(report)]
+        indices = np.arange(len(self)) if report is None else np.flatnonzero(self.report == report)
+        return [self.row(i) for i in indices]
+
+    def findings_text(self, report: int = 0) -> str:
+        """The flagged findings of one report as prompt text, most severe first."""
+        in_report = self.report == report
+        checked = int(np.count_nonzero(in_report & (self.source != SOURCE_NONE)))
+        unchecked = int(np.count_nonzero(in_report)) - checked
+        if checked == 0:
+            return "No recognised lab markers with a reference range were found to check."
+
+        lines = [f"Checked {checked} markers against reference ranges for "
+                 + _describe_patient(self.table.sexes[report], _optional(self.table.ages[report]))
+                 + "; ranges printed on the report are used where present."]
+        flagged = self.flagged(report)
+        if len(flagged) == 0:
+            lines.append("All of them are within range.")
+        else:
+            lines.append("Out of range, most severe first:")
+            lines.extend(f"- {self._finding(i)}" for i in flagged)
+            if checked > len(flagged):
+                others = checked - len(flagged)
+                lines.append(f"The other {others} marker{'s are' if others != 1 else ' is'} within range.")
+        if unchecked:
+            lines.append(f"{unchecked} marker{'s have' if unchecked != 1 else ' has'} no reference range "
+                         "and could not be checked.")
+        return "\n".join(lines)
+
+    def _finding(self, i: int) -> str:
+        marker = self.table.markers[i]
+        row = f"{marker.name}: {marker.value:g}"
+        if marker.unit:
+            row += f" {marker.unit}"
+        row += f", {_FLAG_NAMES[int(self.flag[i])]}, {SEVERITY_NAMES[self.severity[i]]}"
+        low, high = _optional(self.low[i]), _optional(self.high[i])
+        if low is not None and high is not None and low > 0:
+            reference = f"ref {low:g}-{high:g}"
+        elif high is not None:
+            reference = f"ref <{high:g}"
+        else:
+            reference = f"ref >{low:g}"
+        if not np.isnan(self.z[i]):
+            return row + f" ({reference}, z {self.z[i]:+.1f})"
+        side = "above the upper" if self.flag[i] > 0 else "below the lower"
+        return row + f" ({reference}, {self.excess[i] * 100:.0f}% {side} limit)"
+
+    def cohort_summary(self) -> dict:
+        """Per-marker counts over every report: readings, low, high, severity tiers and mean z."""
+        size = len(MARKER_KEYS)
+        checked = self.source != SOURCE_NONE
+        readings = np.bincount(self.marker, weights=checked, minlength=size)
+        low = np.bincount(self.marker, weights=self.flag < 0, minlength=size)
+        high = np.bincount(self.marker, weights=self.flag > 0, minlength=size)
+        has_z = ~np.isnan(self.z)
+        z_count = np.bincount(self.marker, weights=has_z, minlength=size)
+        z_sum = np.bincount(self.marker, weights=np.where(has_z, self.z, 0.0), minlength=size)
+        tiers = {name: np.bincount(self.marker, weights=self.severity == tier, minlength=size)
+                 for tier, name in enumerate(SEVERITY_NAMES) if tier != SEVERITY_NORMAL}
+
+        summary = {}
+        for index in np.flatnonzero(readings):
+            summary[MARKER_KEYS[index]] = {
+                "name": MARKER_SYNONYMS[MARKER_KEYS[index]][0],
+                "readings": int(readings[index]),
+                "low": int(low[index]),
+                "high": int(high[index]),
+                "out_of_range_rate": round(float((low[index] + high[index]) / readings[index]), 3),
+                "mean_z": round(float(z_sum[index] / z_count[index]), 2) if z_count[index] else None,
+                **{name: int(counts[index]) for name, counts in tiers.items()},
+            }
+        return {
+            "reports": len(self.table.report_ids),
+            "readings": int(np.count_nonzero(checked)),
+            "out_of_range": int(np.count_nonzero(self.flag)),
+            "markers": summary,
+        }
+
+
+def _describe_patient(sex: int, age: float = None) -> str:
+    if _SEX_NAMES.get(sex) is None and age is None:
+        return "an adult (sex and age not found in the report)"
+    who = f"a {_SEX_NAMES[sex]} patient" if _SEX_NAMES.get(sex) else "a patient of unknown sex"
+    return who + (f" aged {age:g}" if age is not None else "")
+
+
+def _optional(value, digits: int = None):
+    """A float for JSON, or None for NaN."""
+    if value is None or np.isnan(value):
+        return None
+    return round(float(value), digits) if digits is not None else float(value)
+
+
+def evaluate(table: MarkerTable, reference: ReferenceTable = None) -> Evaluation:
+    """Flags, z-scores and severity tiers for every reading of the table in one pass.
+
+    z is the distance from the middle of a two-sided range in SDs, taking the
+    range as mean +/- 1.96 SD; one-sided ranges (e.g. LDL <100) get no z. The
+    severity of an out-of-range reading is the higher of its z tier
+    (config.EVAL_Z_MODERATE / EVAL_Z_SEVERE) and of how far past the limit it
+    is, relative to the limit (config.EVAL_EXCESS_MODERATE / EVAL_EXCESS_SEVERE).
+
+    Raises:
+        RuntimeError: If numpy is not installed.
+    """
+    _require_numpy()
+    reference = reference or get_reference_table()
+
+    markers = table.markers
+    report = np.array(table.report_index, dtype=np.int32)
+    marker = np.array([_MARKER_INDEX[m.key] for m in markers], dtype=np.int32)
+    value = np.array([m.value for m in markers], dtype=np.float64)
+    from_report = np.array([m.ref_source == "report" for m in markers], dtype=bool)
+    report_low = np.array([_number(m.ref_low, np.nan) for m in markers], dtype=np.float64)
+    report_high = np.array([_number(m.ref_high, np.nan) for m in markers], dtype=np.float64)
+    canonical = np.array([m.unit == MARKER_SYNONYMS[m.key][1] for m in markers], dtype=bool)
+    sex = np.array(table.sexes, dtype=np.int8)[report]
+    age = np.array(table.ages, dtype=np.float64)[report]
+    age = np.where(np.isnan(age), config.EVAL_ASSUMED_AGE, age)
+
+    table_low, table_high = reference.lookup(marker, sex, age)
+    table_low[~canonical] = np.nan
+    table_high[~canonical] = np.nan
+    has_table = ~np.isnan(table_low) | ~np.isnan(table_high)
+    use_report = from_report & (config.EVAL_PREFER_REPORT_RANGES | ~has_table)
+    low = np.where(use_report, report_low, table_low)
+    high = np.where(use_report, report_high, table_high)
+    source = np.select([use_report, has_table], [SOURCE_REPORT, SOURCE_TABLE], SOURCE_NONE).astype(np.int8)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # Comparisons with NaN are False, so readings without a bound are never flagged by it
+        below = value < low
+        above = value > high
+        flag = np.where(below, -1, np.where(above, 1, 0)).astype(np.int8)
+        two_sided = (low > 0) & (high > low)
+        z = np.where(two_sided, (value - (low + high) / 2) / ((high - low) / (2 * Z_95)), np.nan)
+        excess = np.where(above & (high > 0), (value - high) / high,
+                          np.where(below & (low > 0), (low - value) / low, 0.0))
+
+    abs_z = np.abs(np.nan_to_num(z))
+    out = flag != 0
+    severity = np.where(out, SEVERITY_MILD, SEVERITY_NORMAL)
+    severity = np.where(out & ((abs_z >= config.EVAL_Z_MODERATE) | (excess >= config.EVAL_EXCESS_MODERATE)),
+                        SEVERITY_MODERATE, severity)
+    severity = np.where(out & ((abs_z >= config.EVAL_Z_SEVERE) | (excess >= config.EVAL_EXCESS_SEVERE)),
+                        SEVERITY_SEVERE, severity).astype(np.int8)
+
+    return Evaluation(table, report=report, marker=marker, value=value, low=low, high=high, source=source,
+                      flag=flag, z=z, excess=excess, severity=severity)
+
+
+def evaluate_report(text: str, sex: int = None, age: float = None):
+    """Evaluates the markers of one report text (report index 0).
+
+    Sex and age default to what the report prints (see find_demographics).
+
+    Returns:
+        Evaluation or None: None if numpy is not installed.
+    """
+    if not evaluation_available():
+        return None
+    found_sex, found_age = find_demographics(text)
+    table = MarkerTable()
+    table.add_report(0, extract_markers(text),
+                     found_sex if sex in (None, SEX_ANY) else sex,
+                     found_age if age is None else age)
+    return evaluate(table)
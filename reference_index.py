@@ -0,0 +1,383 @@
+## Local medical reference index
+# The doctor agent backed its claims up with live web searches: a network
+# round-trip per question and answers that change from run to run. This is a
+# retrieval index over the reference corpus bundled with the repo (marker
+# definitions and guideline snippets in reference/corpus/*.md, plus the
+# pre-computed answers of reference/search_seed.json). Passages are embedded by
+# feature hashing (word unigrams and bigrams, marker synonyms folded into one
+# term, sublinear term frequency), so embedding needs no model and no network
+# and is identical on every machine. The vectors are stored as a .npy matrix
+# and memory-mapped; a lookup is one matrix-vector product over it.
+#
+# Builds are incremental: passages whose text is unchanged keep their vectors
+# and only new or edited ones are embedded. Each build writes a new generation
+# of files and switches the manifest atomically, so a running server picks it up
+# on its next lookup.
+#
+#   python reference_index.py build             # after editing the corpus
+#   python reference_index.py build --full      # re-embed everything
+#   python reference_index.py query "low ferritin meaning" -k 3
+#
+# Optional dependency: numpy, imported on first use rather than with this
+# module, so it stays out of the API's import time.
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+import zlib
+
+import config
+from markers import MARKER_SYNONYMS
+
+logger = logging.getLogger(__name__)
+
+np = None
+_numpy_checked = False
+_numpy_lock = threading.Lock()
+
+# Bump when the embedding changes; vectors of another version are never reused
+EMBEDDING_VERSION = 1
+MANIFEST = "manifest.json"
+# Longer sections are split at paragraph boundaries into passages of about this size
+MAX_PASSAGE_CHARS = 900
+
+NO_MATCHES = "No matching passages in the local medical reference."
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+_STOPWORDS = {
+    "a", "about", "above", "after", "all", "also", "an", "and", "any", "are", "as", "at", "be", "below",
+    "by", "can", "do", "does", "for", "from", "has", "have", "how", "i", "if", "in", "is", "it", "its",
+    "me", "mean", "means", "meaning", "my", "of", "on", "or", "should", "so", "such", "than", "that",
+    "the", "their", "them", "there", "these", "this", "to", "usually", "was", "what", "whats", "when",
+    "which", "while", "who", "why", "will", "with", "without", "you", "your",
+}
+# Marker spellings ("hgb", "25-oh vitamin d", "sgpt") become one term per marker
+_SYNONYM_RE = re.compile(
+    r"(?<![a-z0-9])(?:" + "|".join(
+        re.escape(synonym)
+        for synonym in sorted({s for _d, _u, synonyms in MARKER_SYNONYMS.values() for s in synonyms},
+                              key=len, reverse=True)
+    ) + r")(?![a-z0-9])"
+)
+_SYNONYM_TO_TERM = {
+    synonym: "marker" + key.replace("_", "")
+    for key, (_display, _unit, synonyms) in MARKER_SYNONYMS.items()
+    for synonym in synonyms
+}
+
+
+def _terms(text: str) -> list:
+    text = _SYNONYM_RE.sub(lambda m: f" {_SYNONYM_TO_TERM[m.group(0)]} ", (text or "").lower())
+    words = []
+    for word in _TOKEN_RE.findall(text):
+        if word in _STOPWORDS:
+            continue
+        # Crude plural folding: "triglycerides" and "triglyceride" are one term
+        if len(word) > 4 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.append(word)
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def _require_numpy():
+    """Imports numpy on first use.
+
+    Raises:
+        RuntimeError: If numpy is not installed.
+    """
+    global np, _numpy_checked
+    with _numpy_lock:
+        if not _numpy_checked:
+            try:
+                import numpy
+                np = numpy
+            except ImportError:
+                pass
+            _numpy_checked = True
+    if np is None:
+        raise RuntimeError("The reference index needs numpy (pip install numpy)")
+
+
+def embed(texts: list, dim: int) -> "np.ndarray":
+    """Unit-length float32 vectors (len(texts) x dim) of hashed terms."""
+    _require_numpy()
+    vectors = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        counts = {}
+        for term in _terms(text):
+            counts[term] = counts.get(term, 0) + 1
+        for term, count in counts.items():
+            h = zlib.crc32(term.encode("utf-8"))
+            # Signed hashing keeps colliding terms from only ever adding up
+            vectors[row, h % dim] += (1.0 + math.log(count)) * (1.0 if h & 0x80000000 else -1.0)
+        norm = np.linalg.norm(vectors[row])
+        if norm > 0:
+            vectors[row] /= norm
+    return vectors
+
+
+def _split(text: str) -> list:
+    """Paragraph-aligned pieces of at most about MAX_PASSAGE_CHARS."""
+    pieces = []
+    current = ""
+    for paragraph in [p.strip() for p in re.split(r"\n\s*\n", text) if p.strip()]:
+        if current and len(current) + len(paragraph) > MAX_PASSAGE_CHARS:
+            pieces.append(current)
+            current = paragraph
+        else:
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def load_corpus(corpus_dir: str, seed_file: str = None) -> list:
+    """The passages of the corpus: one per "## " section of every .md file, plus the search seed answers.
+
+    Returns:
+        list[dict]: {"id", "source", "title", "text"} in a stable order.
+    """
+    passages = []
+    for path in sorted(glob.glob(os.path.join(corpus_dir, "**", "*.md"), recursive=True)):
+        source = os.path.relpath(path, os.path.dirname(corpus_dir.rstrip(os.sep)) or ".")
+        with open(path, "r", encoding="utf-8") as f:
+            sections = re.split(r"^##\s+", f.read(), flags=re.MULTILINE)
+        for section in sections[1:]:
+            title, _, body = section.partition("\n")
+            for part, text in enumerate(_split(body)):
+                passages.append({"id": f"{source}#{title.strip()}#{part}", "source": source,
+                                 "title": title.strip(), "text": text})
+    if seed_file and os.path.exists(seed_file):
+        with open(seed_file, "r", encoding="utf-8") as f:
+            for entry in json.load(f):
+                queries = entry.get("queries") or [""]
+                passages.append({"id": f"search_seed#{queries[0]}", "source": os.path.basename(seed_file),
+                                 "title": queries[0], "text": entry["result"]})
+    return passages
+
+
+def _passage_hash(passage: dict, dim: int) -> str:
+    payload = f"{EMBEDDING_VERSION}|{dim}|{passage['title']}\n{passage['text']}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _read_manifest(index_dir: str):
+    try:
+        with open(os.path.join(index_dir, MANIFEST), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def build_index(corpus_dir: str = None, index_dir: str = None, seed_file: str = None, dim: int = None,
+                full: bool = False) -> dict:
+    """Embeds the corpus into index_dir, reusing the vectors of unchanged passages.
+
+    Args:
+        full (bool): Re-embed every passage instead.
+
+    Returns:
+        dict: Passages in the index, how many were embedded and reused, and the build time.
+
+    Raises:
+        RuntimeError: If numpy is not installed.
+    """
+    _require_numpy()
+    corpus_dir = corpus_dir or config.REFERENCE_CORPUS_DIR
+    index_dir = index_dir or config.REFERENCE_INDEX_DIR
+    seed_file = config.SEARCH_SEED_FILE if seed_file is None else seed_file
+    dim = dim or config.REFERENCE_INDEX_DIM
+    start = time.perf_counter()
+    os.makedirs(index_dir, exist_ok=True)
+
+    passages = load_corpus(corpus_dir, seed_file)
+    for passage in passages:
+        passage["hash"] = _passage_hash(passage, dim)
+
+    previous = None if full else _read_manifest(index_dir)
+    reusable = {}
+    if previous is not None and previous.get("dim") == dim:
+        old_vectors = np.load(os.path.join(index_dir, previous["vectors"]), mmap_mode="r")
+        with open(os.path.join(index_dir, previous["passages"]), "r", encoding="utf-8") as f:
+            reusable = {p["hash"]: old_vectors[row] for row, p in enumerate(json.load(f))}
+
+    # The pid keeps server workers that build at the same time from writing the same files
+    generation = (_read_manifest(index_dir) or {}).get("generation", 0) + 1
+    vectors_file = f"vectors.{generation}.{os.getpid()}.npy"
+    passages_file = f"passages.{generation}.{os.getpid()}.json"
+    vectors = np.lib.format.open_memmap(os.path.join(index_dir, vectors_file), mode="w+",
+                                        dtype=np.float32, shape=(len(passages), dim))
+    missing = [row for row, passage in enumerate(passages) if passage["hash"] not in reusable]
+    for row, passage in enumerate(passages):
+        if passage["hash"] in reusable:
+            vectors[row] = reusable[passage["hash"]]
+    if missing:
+        vectors[missing] = embed([f"{passages[row]['title']}\n{passages[row]['text']}" for row in missing], dim)
+    vectors.flush()
+    del vectors
+    with open(os.path.join(index_dir, passages_file), "w", encoding="utf-8") as f:
+        json.dump(passages, f)
+
+    manifest = {"generation": generation, "dim": dim, "embedding_version": EMBEDDING_VERSION,
+                "vectors": vectors_file, "passages": passages_file, "count": len(passages),
+                "built_at": time.time()}
+    tmp = os.path.join(index_dir, MANIFEST + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, os.path.join(index_dir, MANIFEST))
+
+    # Older generations can go; readers that still map them keep the open file.
+    # Recent ones may belong to a concurrent build whose manifest is being read.
+    cutoff = time.time() - 60
+    for path in glob.glob(os.path.join(index_dir, "vectors.*.npy")) + glob.glob(os.path.join(index_dir, "passages.*.json")):
+        if os.path.basename(path) not in (vectors_file, passages_file) and os.path.getmtime(path) < cutoff:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    return {"passages": len(passages), "embedded": len(missing), "reused": len(passages) - len(missing),
+            "generation": generation, "seconds": round(time.perf_counter() - start, 3)}
+
+
+class ReferenceIndex:
+    """Top-k lookup over the memory-mapped index in index_dir.
+
+    The index is opened on first use, and built first if it does not exist
+    yet. A newer generation written by `python reference_index.py build` is
+    picked up on the next lookup.
+    """
+
+    def __init__(self, index_dir: str, top_k: int = 3, min_score: float = 0.1):
+        self.index_dir = index_dir
+        self.top_k = top_k
+        self.min_score = min_score
+        self._lock = threading.Lock()
+        self._generation = None
+        self._manifest_mtime = None
+        # (vectors, passages) of the open generation, swapped as one
+        self._current = (None, [])
+        self.lookups = 0
+        self.lookup_seconds = 0.0
+        # Why the warm-up could not open the index, if it could not
+        self.error = None
+
+    def open(self) -> int:
+        """Maps the current generation (building the index if there is none); returns its size."""
+        _require_numpy()
+        manifest_path = os.path.join(self.index_dir, MANIFEST)
+        with self._lock:
+            try:
+                mtime = os.stat(manifest_path).st_mtime_ns
+            except OSError:
+                logger.info("Building the reference index in %s: %s", self.index_dir, build_index(index_dir=self.index_dir))
+                mtime = os.stat(manifest_path).st_mtime_ns
+            if mtime == self._manifest_mtime:
+                return len(self._current[1])
+            manifest = _read_manifest(self.index_dir)
+            if manifest.get("dim") != config.REFERENCE_INDEX_DIM or manifest.get("embedding_version") != EMBEDDING_VERSION:
+                logger.info("Reference index was built with other settings; rebuilding it")
+                build_index(index_dir=self.index_dir, full=True)
+                manifest = _read_manifest(self.index_dir)
+                mtime = os.stat(manifest_path).st_mtime_ns
+            vectors = np.load(os.path.join(self.index_dir, manifest["vectors"]), mmap_mode="r")
+            with open(os.path.join(self.index_dir, manifest["passages"]), "r", encoding="utf-8") as f:
+                passages = json.load(f)
+            self._current = (vectors, passages)
+            self._generation = manifest["generation"]
+            self._manifest_mtime = mtime
+            return len(passages)
+
+    def warm(self) -> int:
+        """open() for the startup warm-up, which an optional index must never fail.
+
+        Without numpy, or when the index cannot be built or read (e.g. an
+        unwritable index_dir), the problem is logged and the index is marked
+        unavailable; lookups then answer with an error the agents can read.
+        """
+        try:
+            size = self.open()
+        except Exception as e:
+            self.error = str(e)
+            logger.warning("Reference index unavailable, lookups are disabled: %s", e)
+            return 0
+        self.error = None
+        return size
+
+    def lookup(self, query: str, k: int = None) -> list:
+        """The k passages closest to the query, best first, as dicts with a "score".
+
+        Passages scoring below min_score are left out.
+        """
+        self.open()
+        start = time.perf_counter()
+        vectors, passages = self._current
+        k = min(k or self.top_k, len(passages))
+        if k == 0:
+            return []
+        scores = vectors @ embed([query], vectors.shape[1])[0]
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        results = [{**passages[row], "score": round(float(scores[row]), 4)}
+                   for row in top if scores[row] >= self.min_score]
+        self.lookups += 1
+        self.lookup_seconds += time.perf_counter() - start
+        return results
+
+    def lookup_text(self, query: str, k: int = None) -> str:
+        """lookup() rendered like a search result, for agents."""
+        try:
+            results = self.lookup(query, k)
+        except Exception as e:
+            return f"Error: reference lookup failed: {e}"
+        if not results:
+            return NO_MATCHES
+        return "\n---\n".join(f"Source: {r['source']} - {r['title']}\n{r['text']}" for r in results)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "available": self.error is None,
+                "error": self.error,
+                "generation": self._generation,
+                "passages": len(self._current[1]),
+                "lookups": self.lookups,
+                "mean_lookup_ms": round(self.lookup_seconds / self.lookups * 1000, 3) if self.lookups else None,
+            }
+
+
+reference_index = ReferenceIndex(
+    config.REFERENCE_INDEX_DIR,
+    top_k=config.REFERENCE_TOP_K,
+    min_score=config.REFERENCE_MIN_SCORE,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the local medical reference index.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="embed new and changed passages of the corpus")
+    build.add_argument("--corpus", default=config.REFERENCE_CORPUS_DIR)
+    build.add_argument("--index", default=config.REFERENCE_INDEX_DIR)
+    build.add_argument("--full", action="store_true", help="re-embed every passage")
+    query = commands.add_parser("query", help="print the closest passages to a query")
+    query.add_argument("text")
+    query.add_argument("-k", type=int, default=config.REFERENCE_TOP_K)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        print(json.dumps(build_index(args.corpus, args.index, full=args.full)))
+    else:
+        for result in reference_index.lookup(args.text, args.k):
+            print(f"{result['score']:.3f}  {result['source']} - {result['title']}")
+        print(f"{reference_index.stats()['mean_lookup_ms']} ms")
+
+
+if __name__ == "__main__":
+    main()
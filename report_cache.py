@@ -0,0 +1,249 @@
+## Content-addressed cache of extracted report text
+# The same lab PDF is re-uploaded constantly and every task/tool reads it again.
+# Text is cached under the SHA-256 of the file bytes so each unique document is
+# parsed at most once per process, whatever path or request it arrives under.
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import config
+from upload_buffers import upload_buffers, is_memory_handle
+
+logger = logging.getLogger(__name__)
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+# Seconds between full sweeps of the disk tier for expired entries; in between,
+# only a write that takes it over disk_max_bytes walks the directory
+_DISK_SWEEP_SECONDS = 3600.0
+
+
+def file_sha256(path: str) -> str:
+    """Returns the hex SHA-256 of a file, reading it in chunks.
+
+    In-memory uploads were hashed while they were received.
+    """
+    if is_memory_handle(path):
+        return upload_buffers.sha256(path)
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _path_key(path: str) -> str:
+    return path if is_memory_handle(path) else os.path.abspath(path)
+
+
+class ReportTextCache:
+    """Two-tier cache: an in-memory LRU backed by an optional directory on disk.
+
+    Args:
+        max_entries (int): Capacity of the in-memory LRU tier.
+        disk_dir (str, optional): Directory of the on-disk tier. Disabled if empty.
+        disk_max_bytes (int): Size cap of the on-disk tier; oldest entries go first.
+        disk_ttl (float): Seconds an on-disk entry stays valid after its last use.
+    """
+
+    def __init__(self, max_entries: int = 128, disk_dir: str = None,
+                 disk_max_bytes: int = 256 * 1024 * 1024, disk_ttl: float = 7 * 24 * 3600.0):
+        self.max_entries = max(1, max_entries)
+        self.disk_dir = disk_dir or None
+        self.disk_max_bytes = disk_max_bytes
+        self.disk_ttl = disk_ttl
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        # One lock per digest being parsed so concurrent readers of the same
+        # document wait for a single parse instead of racing
+        self._parse_locks = {}
+        # Digests computed while uploads streamed in, so they are not re-hashed
+        self._path_digests = {}
+        self.hits = 0
+        self.misses = 0
+        # Running size of the disk tier; unknown (None) until the first sweep
+        self._disk_bytes = None
+        self._last_sweep = 0.0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def get(self, digest: str):
+        """Returns the cached text for digest, or None."""
+        with self._lock:
+            text = self._memory.get(digest)
+            if text is not None:
+                self._memory.move_to_end(digest)
+                return text
+        text = self._disk_get(digest)
+        if text is not None:
+            self._memory_put(digest, text)
+        return text
+
+    def put(self, digest: str, text: str):
+        """Stores text under digest in both tiers."""
+        self._memory_put(digest, text)
+        self._disk_put(digest, text)
+
+    def register_path(self, path: str, digest: str):
+        """Records the known SHA-256 of a stored file so reads can skip hashing it."""
+        with self._lock:
+            self._path_digests[_path_key(path)] = digest
+
+    def forget_path(self, path: str):
+        """Drops a digest hint, e.g. once the file has been deleted."""
+        with self._lock:
+            self._path_digests.pop(_path_key(path), None)
+
+    def get_or_parse(self, path: str, parse_fn, digest: str = None) -> str:
+        """Returns the text of the file at path, calling parse_fn(path) only on a miss.
+
+        Args:
+            path (str): File to read, or an in-memory upload handle.
+            parse_fn (callable): Extracts the text; exceptions propagate and nothing is cached.
+            digest (str, optional): SHA-256 of the file if the caller already has it.
+        """
+        if digest is None:
+            with self._lock:
+                digest = self._path_digests.get(_path_key(path))
+        if digest is None:
+            digest = file_sha256(path)
+
+        text = self.get(digest)
+        if text is not None:
+            with self._lock:
+                self.hits += 1
+            return text
+
+        with self._lock:
+            parse_lock = self._parse_locks.setdefault(digest, threading.Lock())
+        with parse_lock:
+            # Another thread may have finished the parse while we waited
+            text = self.get(digest)
+            if text is not None:
+                with self._lock:
+                    self.hits += 1
+                return text
+            with self._lock:
+                self.misses += 1
+            try:
+                text = parse_fn(path)
+                self.put(digest, text)
+            finally:
+                with self._lock:
+                    self._parse_locks.pop(digest, None)
+        return text
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "memory_entries": len(self._memory),
+                    "disk_enabled": bool(self.disk_dir)}
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+
+    def _memory_put(self, digest: str, text: str):
+        with self._lock:
+            self._memory[digest] = text
+            self._memory.move_to_end(digest)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _disk_path(self, digest: str) -> str:
+        return os.path.join(self.disk_dir, digest[:2], f"{digest}.txt")
+
+    def _disk_get(self, digest: str):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(digest)
+        try:
+            st = os.stat(path)
+            if time.time() - st.st_mtime > self.disk_ttl:
+                os.remove(path)
+                self._disk_grew(-st.st_size)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+            # Refresh mtime so TTL and size eviction are based on last use
+            os.utime(path, None)
+            return text
+        except OSError:
+            return None
+
+    def _disk_put(self, digest: str, text: str):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(digest)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            added = os.path.getsize(tmp_path)
+            try:
+                added -= os.path.getsize(path)
+            except OSError:
+                pass
+            os.replace(tmp_path, path)
+        except OSError:
+            logger.exception("Could not write report cache entry %s", path)
+            return
+        if self._disk_grew(added):
+            self._disk_evict()
+
+    def _disk_grew(self, added: int) -> bool:
+        """Adds to the running disk size; True if the disk tier is due a sweep."""
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes += added
+            return (self._disk_bytes is None or self._disk_bytes > self.disk_max_bytes
+                    or time.time() - self._last_sweep > _DISK_SWEEP_SECONDS)
+
+    def _disk_evict(self):
+        """Drops expired entries, then the least recently used until under the size cap.
+
+        Also resets the running disk size to what the walk found.
+        """
+        entries = []
+        now = time.time()
+        for root, _dirs, files in os.walk(self.disk_dir):
+            for name in files:
+                if not name.endswith(".txt"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if now - st.st_mtime > self.disk_ttl:
+                    self._remove_quietly(path)
+                else:
+                    entries.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for _mtime, size, _path in entries)
+        for _mtime, size, path in sorted(entries):
+            if total <= self.disk_max_bytes:
+                break
+            self._remove_quietly(path)
+            total -= size
+        with self._lock:
+            self._disk_bytes = total
+            self._last_sweep = now
+
+    @staticmethod
+    def _remove_quietly(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+# Process-wide cache shared by every tool and request
+report_cache = ReportTextCache(
+    max_entries=config.REPORT_CACHE_MAX_ENTRIES,
+    disk_dir=config.REPORT_CACHE_DIR,
+    disk_max_bytes=config.REPORT_CACHE_DISK_MAX_BYTES,
+    disk_ttl=config.REPORT_CACHE_DISK_TTL_SECONDS,
+)
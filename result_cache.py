@@ -0,0 +1,210 @@
+## Cache of crew results
+# Repeated questions about the same report ("Summarise my Blood Test Report"
+# on the same file) used to re-run every LLM task. Results are cached under a
+# key built from the report hash, the normalized query, the selected tasks and
+# a fingerprint of the agent/task definitions, so editing agents.py or task.py
+# invalidates old entries automatically.
+import hashlib
+import logging
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import config
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """Lowercases, collapses whitespace and drops trailing punctuation."""
+    return _WHITESPACE_RE.sub(" ", (query or "").strip().lower()).rstrip(" .!?")
+
+
+def make_key(report_hash: str, query: str, tasks: list, fingerprint: str, context: str = None) -> str:
+    """Cache key of one crew run.
+
+    context is any further input of the run, e.g. the patient history summary
+    and the reference-range findings.
+    """
+    parts = [report_hash, normalize_query(query), list(tasks or []), fingerprint]
+    if context:
+        parts.append(context)
+    payload = json.dumps(parts)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def definitions_fingerprint(agents: list, tasks: list, source_files: list = ()) -> str:
+    """Hash of everything that shapes an LLM answer: agent and task definitions.
+
+    Uses the objects' own settings plus the source of the modules defining
+    them, so any edit to agents.py or task.py yields a new fingerprint.
+    """
+    digest = hashlib.sha256()
+    for agent in agents:
+        for attr in ("role", "goal", "backstory", "max_iter", "allow_delegation"):
+            digest.update(repr(getattr(agent, attr, None)).encode("utf-8"))
+        digest.update(repr([getattr(t, "name", str(t)) for t in getattr(agent, "tools", None) or []]).encode("utf-8"))
+    for task in tasks:
+        # crewai interpolates inputs into the description in place; prefer the template
+        description = getattr(task, "_original_description", None) or getattr(task, "description", None)
+        expected = getattr(task, "_original_expected_output", None) or getattr(task, "expected_output", None)
+        role = getattr(getattr(task, "agent", None), "role", None)
+        digest.update(repr((description, expected, role)).encode("utf-8"))
+    for path in source_files:
+        try:
+            with open(path, "rb") as f:
+                digest.update(f.read())
+        except OSError:
+            digest.update(path.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class MemoryBackend:
+    """In-process LRU with TTL."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            created_at, value = entry
+            if self.ttl and time.time() - created_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: dict):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteBackend:
+    """Local SQLite file, shared by every worker process on the host."""
+
+    def __init__(self, path: str, max_entries: int, ttl: float):
+        self.path = path
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access)")
+
+    @contextmanager
+    def _connect(self):
+        """One transaction on a fresh connection, which is closed afterwards."""
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT value, created_at FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if self.ttl and now - created_at > self.ttl:
+                conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE results SET last_access = ? WHERE key = ?", (now, key))
+        return json.loads(value)
+
+    def put(self, key: str, value: dict):
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now),
+            )
+            if self.ttl:
+                conn.execute("DELETE FROM results WHERE created_at < ?", (now - self.ttl,))
+            conn.execute(
+                "DELETE FROM results WHERE key IN ("
+                "SELECT key FROM results ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def __len__(self):
+        with self._lock, self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+
+class ResultCache:
+    """Front of run_crew: lookup/store of crew results with hit/miss counters."""
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    def get(self, key: str):
+        if not self.enabled:
+            return None
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key: str, value: dict):
+        if self.enabled:
+            self.backend.put(key, value)
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self.backend).__name__ if self.enabled else None,
+            "entries": len(self.backend) if self.enabled else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+        }
+
+
+def create_result_cache() -> ResultCache:
+    """Builds the cache selected by config.RESULT_CACHE_BACKEND."""
+    backend = config.RESULT_CACHE_BACKEND
+    if backend == "sqlite":
+        return ResultCache(SQLiteBackend(config.RESULT_CACHE_PATH, config.RESULT_CACHE_MAX_ENTRIES,
+                                         config.RESULT_CACHE_TTL_SECONDS))
+    if backend == "memory":
+        return ResultCache(MemoryBackend(config.RESULT_CACHE_MAX_ENTRIES, config.RESULT_CACHE_TTL_SECONDS))
+    if backend not in ("off", "none", ""):
+        logger.warning("Unknown RESULT_CACHE_BACKEND=%r; result cache disabled", backend)
+    return ResultCache(None)
+
+
+result_cache = create_result_cache()
@@ -0,0 +1,253 @@
+## Cached, deduplicated and batched web search
+# Agents keep asking near-identical questions ("normal vitamin D range",
+# "vitamin D normal range?"), each a paid Serper round-trip. Queries are
+# normalized, answered from a TTL cache (pre-seeded for common marker terms
+# from reference/search_seed.json), identical in-flight lookups share one
+# request, and search_many() sends all misses in a single batch call.
+# In offline mode (config.SEARCH_OFFLINE) misses are answered from the local
+# reference index instead and nothing goes over the network.
+#
+# Tests can point config.SERPER_BASE_URL at a local stub server that accepts
+# POST /search with a JSON object (or list of objects) of {"q": ...}.
+import json
+import logging
+import re
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import config
+from deadlines import DeadlineExceeded, current_deadline, remaining_time
+from governor import rate_governor
+from reference_index import reference_index
+
+logger = logging.getLogger(__name__)
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]")
+_STOPWORDS = {
+    "a", "an", "and", "are", "be", "for", "how", "i", "in", "is", "it", "me", "my",
+    "of", "on", "or", "the", "to", "what", "whats", "which", "with",
+}
+
+
+def normalize_query(query: str) -> str:
+    """Canonical form of a query: lowercase, no punctuation or stopwords, sorted terms."""
+    words = _PUNCTUATION_RE.sub(" ", (query or "").lower()).split()
+    terms = sorted({word for word in words if word not in _STOPWORDS})
+    return " ".join(terms) or (query or "").strip().lower()
+
+
+def format_results(response: dict, limit: int) -> str:
+    """Renders a Serper response as compact text for the agent."""
+    rows = []
+    answer = response.get("answerBox") or {}
+    if answer.get("answer") or answer.get("snippet"):
+        rows.append(f"Answer: {answer.get('answer') or answer.get('snippet')}")
+    for item in (response.get("organic") or [])[:limit]:
+        rows.append(
+            f"Title: {item.get('title', '')}\n"
+            f"Link: {item.get('link', '')}\n"
+            f"Snippet: {item.get('snippet', '')}"
+        )
+    return "\n---\n".join(rows) if rows else "No results found."
+
+
+class SearchService:
+    """Search front end with normalization, TTL cache, single-flight and batching.
+
+    Args:
+        base_url (str): Serper-compatible endpoint root.
+        api_key (str): Sent as X-API-KEY.
+        ttl (float): Lifetime of fetched results. Seeded results never expire.
+        max_entries (int): Cache capacity (seeded entries do not count).
+        offline (bool): Answer misses with local_lookup instead of calling Serper.
+        local_lookup (callable): query -> result text, used in offline mode.
+    """
+
+    def __init__(self, base_url: str, api_key: str = "", ttl: float = 24 * 3600.0, max_entries: int = 1000,
+                 timeout: float = 10.0, results: int = 5, offline: bool = False, local_lookup=None):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.timeout = timeout
+        self.results = results
+        self.offline = offline
+        self.local_lookup = local_lookup
+        self._cache = OrderedDict()
+        self._seeded = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.remote_calls = 0
+        self.local_answers = 0
+
+    def seed(self, path: str) -> int:
+        """Loads pre-computed results: a JSON list of {"queries": [...], "result": "..."}."""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Could not load search seed file %s: %s", path, e)
+            return 0
+        count = 0
+        with self._lock:
+            for entry in entries:
+                for query in entry.get("queries", []):
+                    self._seeded[normalize_query(query)] = entry["result"]
+                    count += 1
+        return count
+
+    def search(self, query: str) -> str:
+        """Result text for one query."""
+        return self.search_many([query])[0]
+
+    def search_many(self, queries: list) -> list:
+        """Results for several queries, fetching all cache misses in one batch request."""
+        keys = [normalize_query(q) for q in queries]
+        results = {}
+        waiting = {}
+        to_fetch = {}
+
+        with self._lock:
+            for query, key in zip(queries, keys):
+                if key in results or key in waiting or key in to_fetch:
+                    continue
+                cached = self._cache_get(key)
+                if cached is not None:
+                    self.hits += 1
+                    results[key] = cached
+                elif key in self._inflight:
+                    # Someone is already fetching it; wait for their answer
+                    self.coalesced += 1
+                    waiting[key] = self._inflight[key]
+                else:
+                    self.misses += 1
+                    future = Future()
+                    self._inflight[key] = future
+                    to_fetch[key] = (query, future)
+
+        if to_fetch:
+            self._fetch(to_fetch)
+
+        for key, (_query, future) in to_fetch.items():
+            results[key] = future.result()
+        for key, future in waiting.items():
+            results[key] = self._wait(future)
+        return [results[key] for key in keys]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "remote_calls": self.remote_calls,
+                "local_answers": self.local_answers,
+                "offline": self.offline,
+                "cached": len(self._cache),
+                "seeded": len(self._seeded),
+            }
+
+    def _cache_get(self, key: str):
+        # Caller holds self._lock
+        if key in self._seeded:
+            return self._seeded[key]
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if self.ttl and time.time() - stored_at > self.ttl:
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return value
+
+    def _wait(self, future: Future) -> str:
+        """Result of a lookup another caller is fetching, or an error text once the request's deadline is up.
+
+        The other caller may still be queued in the rate governor, so there is
+        no fixed timeout; without a deadline this waits for its answer.
+        """
+        try:
+            return future.result(timeout=remaining_time())
+        except FutureTimeoutError:
+            return "Error: search timed out waiting for an identical in-flight search"
+
+    def _fetch(self, to_fetch: dict):
+        """Fetches all pending keys in one request and resolves their futures."""
+        keys = list(to_fetch)
+        if self.offline:
+            # The local index answers in well under a millisecond; nothing to cache
+            texts = []
+            for key in keys:
+                try:
+                    texts.append(self.local_lookup(to_fetch[key][0]))
+                except Exception as e:
+                    logger.exception("Local search lookup failed")
+                    texts.append(f"Error: local lookup failed: {e}")
+            with self._lock:
+                self.local_answers += len(keys)
+                for key in keys:
+                    self._inflight.pop(key, None)
+            for key, text in zip(keys, texts):
+                to_fetch[key][1].set_result(text)
+            return
+        try:
+            responses = self._request([to_fetch[key][0] for key in keys])
+            texts = [format_results(response, self.results) for response in responses]
+            # Only successful lookups are cached; failures are returned but retried next time
+            with self._lock:
+                for key, text in zip(keys, texts):
+                    self._cache[key] = (time.time(), text)
+                    self._cache.move_to_end(key)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+        except DeadlineExceeded as e:
+            texts = [f"Error: search timed out: {e}"] * len(keys)
+        except Exception as e:
+            logger.exception("Search request failed")
+            texts = [f"Error: search failed: {e}"] * len(keys)
+        finally:
+            with self._lock:
+                for key in keys:
+                    self._inflight.pop(key, None)
+        for key, text in zip(keys, texts):
+            to_fetch[key][1].set_result(text)
+
+    def _request(self, queries: list) -> list:
+        """POSTs the queries to /search; a single query is sent as an object, several as a batch list."""
+        rate_governor.acquire("search", deadline=current_deadline())
+        payload = [{"q": q} for q in queries]
+        body = json.dumps(payload[0] if len(payload) == 1 else payload).encode("utf-8")
+        request = urllib.request.Request(
+            f"{self.base_url}/search",
+            data=body,
+            headers={"X-API-KEY": self.api_key, "Content-Type": "application/json"},
+            method="POST",
+        )
+        self.remote_calls += 1
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            data = json.loads(response.read().decode("utf-8"))
+        if isinstance(data, dict):
+            data = [data]
+        if len(data) != len(queries):
+            raise ValueError(f"Expected {len(queries)} search results, got {len(data)}")
+        return data
+
+
+search_service = SearchService(
+    base_url=config.SERPER_BASE_URL,
+    api_key=config.SERPER_API_KEY,
+    ttl=config.SEARCH_CACHE_TTL_SECONDS,
+    max_entries=config.SEARCH_CACHE_MAX_ENTRIES,
+    timeout=config.SEARCH_TIMEOUT_SECONDS,
+    results=config.SEARCH_RESULTS,
+    offline=config.SEARCH_OFFLINE,
+    local_lookup=reference_index.lookup_text,
+)
+search_service.seed(config.SEARCH_SEED_FILE)
@@ -0,0 +1,92 @@
+## Startup timing, warm-up and readiness
+# Importing crewai, the agents and their tools takes seconds, and building the
+# crew pool takes longer. main.py no longer does either at import time: the
+# lifespan runs the warm-up (in the background by default) so the process
+# answers "/" at once, and /ready reports 200 only when the warm-up is done.
+# Every phase, including main.py's own import, is timed and exposed on /ready
+# and /metrics.
+import logging
+import threading
+import time
+
+from observability import registry
+
+logger = logging.getLogger(__name__)
+
+STARTUP_SECONDS = registry.gauge(
+    "analyser_startup_phase_seconds", "Duration of each startup phase.", ("phase",))
+
+# Warm-up states
+WARMUP_PENDING = "pending"
+WARMUP_RUNNING = "running"
+WARMUP_READY = "ready"
+WARMUP_FAILED = "failed"
+
+
+class Startup:
+    """Records startup phases and whether the warm-up has finished."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.phases = {}
+        self.state = WARMUP_PENDING
+        self.error = None
+        self.started_at = time.time()
+        self.ready_at = None
+
+    def record(self, phase: str, seconds: float):
+        with self._lock:
+            self.phases[phase] = round(seconds, 4)
+        STARTUP_SECONDS.set(seconds, phase=phase)
+        logger.info("Startup: %s took %.0f ms", phase, seconds * 1000)
+
+    def run_warmup(self, steps: list):
+        """Runs the warm-up steps in order, timing each one.
+
+        A failing step marks the warm-up failed (/ready keeps answering 503)
+        and skips the rest; requests still work, they just pay for the lazy
+        imports themselves.
+
+        Args:
+            steps (list): (phase name, callable) pairs.
+        """
+        with self._lock:
+            self.state = WARMUP_RUNNING
+        total_start = time.perf_counter()
+        for phase, step in steps:
+            start = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                logger.exception("Startup: warm-up step %s failed", phase)
+                with self._lock:
+                    self.state = WARMUP_FAILED
+                    self.error = f"{phase}: {e}"
+                return
+            self.record(phase, time.perf_counter() - start)
+        self.record("warmup_total", time.perf_counter() - total_start)
+        with self._lock:
+            self.state = WARMUP_READY
+            self.ready_at = time.time()
+
+    def mark_ready(self):
+        """Ready without a warm-up (STARTUP_WARMUP=off)."""
+        with self._lock:
+            self.state = WARMUP_READY
+            self.ready_at = time.time()
+
+    @property
+    def ready(self) -> bool:
+        return self.state == WARMUP_READY
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "error": self.error,
+                "phases": dict(self.phases),
+                "seconds_to_ready": round(self.ready_at - self.started_at, 3) if self.ready_at else None,
+            }
+
+
+startup = Startup()
@@ -0,0 +1,42 @@
+## Server-sent events for incremental analysis output
+# Crew runs happen on worker threads; EventChannel hands their progress events
+# to the request's event loop, which writes them out as SSE frames (or NDJSON
+# lines for batch results).
+import asyncio
+import json
+
+
+def format_sse(event: str, data=None) -> str:
+    """Encodes one server-sent event frame."""
+    payload = json.dumps(data, default=str)
+    # A data field may not contain raw newlines; json.dumps never emits them
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+def format_ndjson(data) -> str:
+    """Encodes one newline-delimited JSON record."""
+    return json.dumps(data, default=str) + "\n"
+
+
+class EventChannel:
+    """Thread-safe producer side, asyncio consumer side.
+
+    Args:
+        loop (asyncio.AbstractEventLoop): Loop of the request that streams the events.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._queue = asyncio.Queue()
+
+    def emit(self, event: str, data=None):
+        """Queues an event; callable from any thread."""
+        try:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, (event, data))
+        except RuntimeError:
+            # The request's loop is gone (server shutting down); nobody is listening
+            pass
+
+    async def get(self) -> tuple:
+        """Waits for the next (event, data) pair."""
+        return await self._queue.get()
@@ -0,0 +1,105 @@
+## Shared test setup
+# config.py reads the environment at import, so the settings the tests rely on
+# are fixed here, before any application module is imported: nothing is written
+# to the working tree, there is no background warm-up and no span log noise.
+import io
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+_scratch = tempfile.mkdtemp(prefix="analyser-tests-")
+os.environ.update({
+    "UPLOAD_DIR": os.path.join(_scratch, "uploads"),
+    "REFERENCE_INDEX_DIR": os.path.join(_scratch, "reference_index"),
+    "RESULT_CACHE_BACKEND": "memory",
+    "REPORT_CACHE_DIR": "",
+    "HISTORY_DB_PATH": "",
+    "STARTUP_WARMUP": "off",
+    "SPAN_LOG": "0",
+    "SEARCH_OFFLINE": "1",
+    "OCR_ENABLED": "0",
+})
+
+# The lab panel most tests read: four markers out of range, one in range
+LAB_LINES = [
+    "City Lab - Blood Test Report",
+    "Patient: Jane Doe  Sex: Female  Age: 45  Sample: Serum",
+    "Test Result Units Reference Range",
+    "Hemoglobin 11.2 g/dL 12.0 - 15.5",
+    "Glucose 110 mg/dL 70 - 99",
+    "LDL Cholesterol 160 mg/dL 0 - 100",
+    "Vitamin D 18 ng/mL 30 - 100",
+    "TSH 2.1 uIU/mL 0.4 - 4.0",
+]
+
+
+@pytest.fixture
+def scratch_dir(tmp_path):
+    return str(tmp_path)
+
+
+@pytest.fixture
+def lab_pdf() -> bytes:
+    from benchmarks.synthetic import build_pdf
+    return build_pdf([LAB_LINES])
+
+
+@pytest.fixture
+def lab_pdf_path(tmp_path, lab_pdf) -> str:
+    path = tmp_path / "report.pdf"
+    path.write_bytes(lab_pdf)
+    return str(path)
+
+
+@pytest.fixture(scope="session")
+def mock_llm():
+    """Deterministic LLM answering every crew task (benchmarks/mock_crew.py), for the whole session."""
+    from benchmarks import mock_crew
+    return mock_crew.install(latency_ms=5)
+
+
+@pytest.fixture(scope="session")
+def app_client(mock_llm):
+    """TestClient of the API, started once: its shutdown stops the module-level job queue."""
+    from fastapi.testclient import TestClient
+    import main
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def client(app_client, monkeypatch):
+    """TestClient of the API with the mock crew and an empty result cache."""
+    import main
+    from result_cache import MemoryBackend
+    monkeypatch.setattr(main.result_cache, "backend", MemoryBackend(64, 0))
+    yield app_client
+
+
+class FakeUpload:
+    """The part of fastapi's UploadFile that uploads.store_upload uses."""
+
+    def __init__(self, data: bytes, filename: str = "report.pdf"):
+        self.filename = filename
+        self._stream = io.BytesIO(data)
+
+    async def read(self, size: int) -> bytes:
+        return self._stream.read(size)
+
+
+def wait_for_job(client, job_id: str, timeout: float = 20.0) -> dict:
+    """Polls /jobs/{id} until it is done or failed; returns the status body."""
+    import time
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = client.get(f"/jobs/{job_id}").json()
+        if status["status"] in ("done", "failed"):
+            return status
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} did not finish within {timeout}s")
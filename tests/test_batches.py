@@ -0,0 +1,123 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from batches import ITEM_DONE, ITEM_DUPLICATE, ITEM_FAILED, Batch, BatchRunner
+from jobs import JobQueue
+
+
+def _upload(name: str, digest: str = None):
+    return SimpleNamespace(filename=name, path=f"/uploads/{name}", sha256=digest or name, size=1)
+
+
+class Runner:
+    """BatchRunner over a real JobQueue whose crew runs wait for `release`."""
+
+    def __init__(self, workers: int = 2, max_queued: int = 4, **kwargs):
+        self.release = threading.Event()
+        self.removed = []
+        self.job_queue = JobQueue(workers=workers, max_queued=max_queued)
+        self.runner = BatchRunner(self.job_queue, self.process, self.removed.append, None, parse_workers=2,
+                                  **kwargs)
+        # Parsing is covered elsewhere; every report is ready at once
+        self.runner._prepare = lambda batch, item: setattr(item, "tasks", batch.tasks) or True
+
+    def process(self, query, path, filename, **kwargs):
+        self.release.wait(5)
+        return {"status": "success", "analysis": f"analysis of {filename}"}
+
+    def close(self):
+        self.release.set()
+        self.runner.shutdown()
+        self.job_queue.shutdown()
+
+
+@pytest.fixture
+def runners():
+    created = []
+
+    def make(**kwargs):
+        created.append(Runner(**kwargs))
+        return created[-1]
+    yield make
+    for runner in created:
+        runner.close()
+
+
+def _batch(*names) -> Batch:
+    batch = Batch("b", "q", ["summary"])
+    for name in names:
+        batch.add(_upload(name))
+    return batch
+
+
+def _wait_done(batch: Batch, timeout: float = 5.0):
+    until = time.monotonic() + timeout
+    while batch.finished_at is None and time.monotonic() < until:
+        time.sleep(0.01)
+    assert batch.finished_at is not None
+
+
+def test_identical_files_are_analysed_once():
+    batch = Batch("b", "q", ["summary"])
+    first = batch.add(_upload("a.pdf", "same"))
+    copy = batch.add(_upload("b.pdf", "same"))
+    assert copy.status == ITEM_DUPLICATE and copy.duplicate_of == first.index
+    assert batch.unique == [first]
+    batch.finish_item(first, ITEM_DONE, result={"status": "success"})
+    assert copy.status == ITEM_DONE and copy.result == {"status": "success"}
+    assert batch.to_dict()["counts"] == {ITEM_DONE: 2}
+
+
+def test_every_report_runs_when_slots_free_up(runners):
+    runner = runners(max_in_flight=1)
+    batch = _batch("a.pdf", "b.pdf", "c.pdf")
+    runner.runner.start(batch)
+    runner.release.set()
+    _wait_done(batch)
+    assert [item.status for item in batch.items] == [ITEM_DONE] * 3
+
+
+def test_report_waiting_too_long_for_a_batch_slot_fails(runners):
+    runner = runners(max_in_flight=1, queue_timeout=0.2)
+    batch = _batch("a.pdf", "b.pdf")
+    runner.runner.start(batch)
+    until = time.monotonic() + 5
+    while ITEM_FAILED not in [item.status for item in batch.items] and time.monotonic() < until:
+        time.sleep(0.01)
+    failed = [item for item in batch.items if item.status == ITEM_FAILED]
+    assert len(failed) == 1 and "No batch slot free within 0.2s" in failed[0].error
+    assert runner.removed == [failed[0].path]
+    runner.release.set()
+    _wait_done(batch)
+
+
+def test_report_waiting_too_long_for_a_job_queue_slot_fails(runners):
+    # One job queue slot, taken by an interactive job
+    runner = runners(workers=1, max_queued=0, max_in_flight=2, queue_timeout=0.2)
+    runner.job_queue.submit(runner.release.wait, 5)
+    batch = _batch("a.pdf")
+    runner.runner.start(batch)
+    _wait_done(batch)
+    assert batch.items[0].status == ITEM_FAILED
+    assert "No job queue slot free" in batch.items[0].error
+    # The batch slot was given back
+    assert runner.runner._slots.acquire(blocking=False)
+
+
+def test_shutdown_joins_batch_threads_and_fails_waiting_reports(runners):
+    runner = runners(max_in_flight=1, queue_timeout=0)
+    batch = _batch("a.pdf", "b.pdf", "c.pdf")
+    runner.runner.start(batch)
+    until = time.monotonic() + 5
+    while not any(item.job_id for item in batch.items) and time.monotonic() < until:
+        time.sleep(0.01)
+    started = time.monotonic()
+    runner.runner.shutdown(timeout=5)
+    assert time.monotonic() - started < 2
+    assert not runner.runner._threads
+    waiting = [item for item in batch.items if item.job_id is None]
+    assert len(waiting) == 2
+    assert all(item.status == ITEM_FAILED and item.error == "Server shutting down" for item in waiting)
@@ -0,0 +1,22 @@
+from benchmarks import bench
+
+
+def test_missing_baseline_fails_before_running(tmp_path, capsys, monkeypatch):
+    monkeypatch.setattr(bench, "run", None)  # must not be reached
+    assert bench.cli(["--baseline", str(tmp_path / "missing.json")]) == 2
+    assert "--no-baseline" in capsys.readouterr().out
+
+
+def _results(throughput: float, p50_ms: float) -> dict:
+    stats = {"count": 5, "p50_ms": p50_ms, "p95_ms": 200.0, "p99_ms": 300.0, "peak_rss_mb": 100.0}
+    return {"params": {"requests": 5}, "scenarios": {"1_pages": {
+        "errors": 0, "throughput_per_s": throughput, "stages": {"parse": stats}}}}
+
+
+def test_compare_flags_slower_stages_only():
+    baseline = _results(10.0, 100.0)
+    assert bench.compare(_results(9.0, 110.0), baseline, 0.25) == []
+    problems = bench.compare(_results(5.0, 400.0), baseline, 0.25)
+    assert len(problems) == 2
+    assert problems[0].startswith("1_pages: throughput")
+    assert problems[1].startswith("1_pages/parse: p50_ms")
@@ -0,0 +1,115 @@
+import threading
+
+from coalescing import Coalescer, InflightRun
+from conftest import wait_for_job
+
+
+def test_make_key_normalizes_the_query_and_keeps_context_apart():
+    key = Coalescer.make_key("hash", "Summarise my report!", ["summary"], "p1", True, 180.0)
+    assert key == Coalescer.make_key("hash", "  summarise MY report ", ["summary"], "p1", True, 180.0)
+    assert key != Coalescer.make_key("hash", "Summarise my report", ["summary"], "p1", False, 180.0)
+    assert key != Coalescer.make_key("hash", "Summarise my report", ["summary"], "p1", True, 600.0)
+    assert key != Coalescer.make_key("other", "Summarise my report", ["summary"], "p1", True, 180.0)
+
+
+def test_join_attaches_followers_until_the_run_finishes():
+    coalescer = Coalescer()
+    run, leader = coalescer.join("k")
+    assert leader
+    follower_run, follower_leads = coalescer.join("k")
+    assert follower_run is run and not follower_leads
+    assert run.followers == 1 and run.attached == 2
+
+    run.publish("result", {"status": "success"})
+    coalescer.finish(run, {"status": "success", "cached": False})
+    stats = coalescer.stats()
+    assert stats["in_flight"] == 0
+    assert stats["coalesced_requests"] == 1
+    assert stats["llm_runs_saved"] == 1
+    # Later requests start afresh
+    assert coalescer.join("k")[1]
+
+
+def test_cached_result_saves_no_run():
+    coalescer = Coalescer()
+    run, _ = coalescer.join("k")
+    coalescer.join("k")
+    coalescer.finish(run, {"cached": True})
+    assert coalescer.stats()["llm_runs_saved"] == 0
+
+
+def test_abandon_forgets_a_run_that_never_started():
+    coalescer = Coalescer()
+    run, _ = coalescer.join("k")
+    coalescer.abandon(run)
+    assert coalescer.stats() == {**coalescer.stats(), "in_flight": 0, "runs": 0}
+    assert coalescer.join("k")[0] is not run
+
+
+def test_disabled_coalescer_always_leads():
+    coalescer = Coalescer(enabled=False)
+    assert coalescer.join("k")[1] and coalescer.join("k")[1]
+
+
+class _Channel:
+    def __init__(self):
+        self.events = []
+
+    def emit(self, event, data=None):
+        self.events.append(event)
+
+
+def test_late_listener_gets_earlier_events_then_live_ones():
+    run = InflightRun("k")
+    run.publish("parsed", {})
+    channel = _Channel()
+    run.listen(channel)
+    run.publish("task", {})
+    run.publish("result", {})
+    run.publish("ignored", {})
+    assert channel.events == ["parsed", "task", "result"]
+
+
+def test_last_detaching_stream_cancels_but_not_while_others_wait():
+    coalescer = Coalescer()
+    run, _ = coalescer.join("k")
+    coalescer.join("k")
+    assert not run.detach("client_disconnected")
+    assert run.cancel_reason is None
+    assert run.detach("client_disconnected")
+    assert run.cancel_reason == "client_disconnected"
+    # A cancelled run takes no new followers
+    assert coalescer.join("k")[0] is not run
+
+
+def _post(client, pdf, results, **data):
+    results.append(client.post("/analyze", files={"file": ("r.pdf", pdf, "application/pdf")},
+                               data={"tasks": "summary", **data}).json())
+
+
+def test_identical_concurrent_requests_share_one_job(client, lab_pdf, mock_llm, monkeypatch):
+    results = []
+    threads = [threading.Thread(target=_post, args=(client, lab_pdf, results), kwargs={"query": query})
+               for query in ("Coalesce me", "coalesce me!", "  COALESCE me ")]
+    # Slow the run down so the requests overlap
+    monkeypatch.setattr(mock_llm, "latency_ms", 300)
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({result["job_id"] for result in results}) == 1
+    assert sorted(result["coalesced"] for result in results) == [False, True, True]
+    assert wait_for_job(client, results[0]["job_id"])["status"] == "done"
+
+
+def test_no_cache_and_deadline_requests_do_not_follow(client, lab_pdf, mock_llm, monkeypatch):
+    monkeypatch.setattr(mock_llm, "latency_ms", 300)
+    results = []
+    _post(client, lab_pdf, results, query="keyed")
+    _post(client, lab_pdf, results, query="keyed", no_cache="true")
+    _post(client, lab_pdf, results, query="keyed", deadline_seconds="600")
+    _post(client, lab_pdf, results, query="keyed")
+    assert [result["coalesced"] for result in results] == [False, False, False, True]
+    assert len({result["job_id"] for result in results}) == 3
+    for result in results:
+        wait_for_job(client, result["job_id"])
@@ -0,0 +1,51 @@
+from benchmarks.synthetic import HEADER, lab_report_pages
+from compaction import compact_report
+from governor import estimate_tokens
+
+
+def _report(pages: int, seed: int = 0) -> str:
+    return "\n".join(" ".join(lines) for lines in lab_report_pages(pages, seed))
+
+
+def test_repeated_page_text_is_kept_once():
+    result = compact_report(_report(4), 0)
+    assert result.text.startswith("Lab markers:\n")
+    assert result.text.count(HEADER[0]) == 1
+    assert "Page 1 of 4" not in result.text
+    assert result.repeated_words > 0
+    assert result.compacted_tokens < result.original_tokens / 2
+    assert result.to_dict()["markers"] == result.marker_count > 0
+
+
+def test_unpunctuated_page_is_not_dropped_with_its_footer():
+    result = compact_report(_report(1), 0)
+    assert "Synthetic Patient 0" in result.text
+
+
+def test_disclaimer_sentences_are_dropped():
+    text = ("Patient: Jane Doe. Glucose 110 mg/dL 70 - 99. Electronically signed by the duty pathologist. "
+            "This report is computer generated and not valid for medico-legal purposes. Fasting sample.")
+    result = compact_report(text, 0)
+    assert "signed" not in result.text and "computer generated" not in result.text
+    assert "Jane Doe" in result.text and "Fasting sample" in result.text
+
+
+def test_text_beyond_the_budget_is_truncated():
+    result = compact_report(_report(2) + "\n" + "Clinical note: " + "see physician " * 400, 300)
+    assert result.truncated
+    assert "[... truncated to a budget of 300 tokens]" in result.text
+    # The marker rows come first and survive the cut
+    assert result.text.startswith("Lab markers:\n")
+    assert estimate_tokens(result.text) <= 300 + 20
+
+
+def test_short_clean_report_is_left_alone():
+    text = "Glucose 110 mg/dL 70 - 99"
+    result = compact_report(text, 1500)
+    assert result.text == text and not result.truncated
+
+
+def test_results_are_memoized_per_text_and_budget():
+    text = _report(3, seed=7)
+    assert compact_report(text, 0) is compact_report(text, 0)
+    assert compact_report(text, 100) is not compact_report(text, 0)
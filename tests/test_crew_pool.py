@@ -0,0 +1,108 @@
+import threading
+import time
+
+import pytest
+
+from crew_pool import CrewPool, CrewPoolTimeoutError
+
+
+class FakeInstance:
+    """Stands in for a CrewInstance; its reset can be made to fail."""
+
+    def __init__(self):
+        self.stragglers = []
+        self.resets = 0
+        self.broken = False
+
+    def reset(self):
+        if self.broken:
+            raise RuntimeError("task state stuck")
+        self.resets += 1
+
+
+class Factory:
+    def __init__(self):
+        self.built = []
+
+    def __call__(self):
+        instance = FakeInstance()
+        self.built.append(instance)
+        return instance
+
+
+def test_instances_are_built_lazily_up_to_the_pool_size():
+    factory = Factory()
+    pool = CrewPool(factory=factory, size=2, checkout_timeout=0.05)
+    assert factory.built == []
+    with pool.checkout() as first, pool.checkout() as second:
+        assert first is not second
+        with pytest.raises(CrewPoolTimeoutError):
+            with pool.checkout():
+                pass
+    assert len(factory.built) == 2
+    assert pool.stats()["idle"] == 2 and pool.stats()["checkouts"] == 2
+
+
+def test_warm_builds_every_instance_once():
+    factory = Factory()
+    pool = CrewPool(factory=factory, size=3)
+    pool.warm()
+    pool.warm()
+    assert len(factory.built) == 3 and pool.stats()["idle"] == 3
+
+
+def test_instances_are_reset_and_reused():
+    factory = Factory()
+    pool = CrewPool(factory=factory, size=1)
+    with pool.checkout() as instance:
+        pass
+    with pool.checkout() as again:
+        assert again is instance
+    assert instance.resets == 2 and len(factory.built) == 1
+
+
+def test_an_instance_that_fails_to_reset_is_replaced():
+    factory = Factory()
+    pool = CrewPool(factory=factory, size=1)
+    with pool.checkout() as instance:
+        instance.broken = True
+    with pool.checkout() as replacement:
+        assert replacement is not instance
+    assert pool.stats()["replaced"] == 1 and len(factory.built) == 2
+
+
+def test_a_failed_build_frees_its_slot():
+    calls = []
+
+    def factory():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("no LLM configured")
+        return FakeInstance()
+
+    pool = CrewPool(factory=factory, size=1)
+    with pytest.raises(RuntimeError):
+        with pool.checkout():
+            pass
+    with pool.checkout() as instance:
+        assert isinstance(instance, FakeInstance)
+    assert pool.stats()["created"] == 1
+
+
+def test_checkout_waits_for_a_returned_instance():
+    pool = CrewPool(factory=Factory(), size=1)
+    pool.warm()
+    taken = threading.Event()
+
+    def hold():
+        with pool.checkout():
+            taken.set()
+            time.sleep(0.2)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    taken.wait(1)
+    started = time.monotonic()
+    with pool.checkout(timeout=2.0):
+        assert time.monotonic() - started >= 0.1
+    holder.join()
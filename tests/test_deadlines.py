@@ -0,0 +1,137 @@
+import threading
+import time
+
+import pytest
+
+import pipeline
+from crew_pool import CrewPool, CrewPoolTimeoutError
+from deadlines import (REASON_DEADLINE, REASON_DISCONNECTED, Deadline, DeadlineExceeded, check_deadline,
+                       deadline_scope, remaining_time)
+
+
+class FakeCrew:
+    """Crew instance whose kickoffs take `steps` agent steps, checking the deadline at each."""
+
+    def __init__(self, steps: dict = None, verdict: str = "VALID"):
+        self.steps = steps or {}
+        self.verdict = verdict
+        self.step_seconds = 0.02
+        self.stragglers = []
+        self.running = 0
+        self.stopped = []
+        self._lock = threading.Lock()
+
+    def kickoff(self, task_name: str, inputs: dict, step_callback=None):
+        with self._lock:
+            self.running += 1
+        try:
+            for _ in range(self.steps.get(task_name, 1)):
+                check_deadline()
+                time.sleep(self.step_seconds)
+            return f"{self.verdict}: {task_name}"
+        except DeadlineExceeded:
+            self.stopped.append(task_name)
+            raise
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    def reset(self):
+        pass
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    instances = []
+
+    def factory():
+        instances.append(FakeCrew({"help_patients": 1, "nutrition_analysis": 500}))
+        return instances[-1]
+    pool = CrewPool(factory=factory, size=1, checkout_timeout=0.2)
+    pool.instances = instances
+    monkeypatch.setattr(pipeline, "crew_pool", pool)
+    return pool
+
+
+def test_deadline_expires_and_keeps_first_reason():
+    deadline = Deadline(0.05)
+    assert not deadline.expired and deadline.remaining() > 0
+    time.sleep(0.06)
+    assert deadline.expired and deadline.reason == REASON_DEADLINE
+    deadline.cancel(REASON_DISCONNECTED)
+    assert deadline.reason == REASON_DEADLINE
+    with pytest.raises(DeadlineExceeded, match="exceeded"):
+        deadline.check()
+
+
+def test_no_limit_until_cancelled():
+    deadline = Deadline(0)
+    with deadline_scope(deadline):
+        assert remaining_time(5) == 5
+        check_deadline()
+        deadline.cancel()
+        assert remaining_time(5) == 0.0
+        with pytest.raises(DeadlineExceeded, match="disconnected"):
+            check_deadline()
+
+
+def test_deadline_returns_finished_tasks_as_partial(pool):
+    with deadline_scope(Deadline(0.4)):
+        result = pipeline.run_pipeline("q", "report.pdf", ["verification", "summary", "nutrition"])
+    assert result["partial"]
+    assert result["incomplete"] == ["nutrition"]
+    assert set(result["analyses"]) == {"summary"}
+    assert result["verification"].startswith("VALID")
+
+
+def test_cut_off_kickoffs_stop_at_their_next_check_and_keep_the_instance(pool):
+    with deadline_scope(Deadline(0.3)):
+        pipeline.run_pipeline("q", "report.pdf", ["summary", "nutrition"])
+    instance = pool.instances[0]
+    # No replacement is built while the cut-off kickoff still runs
+    assert pool.stats()["created"] == 1
+    until = time.monotonic() + 2
+    while instance.running and time.monotonic() < until:
+        time.sleep(0.01)
+    assert instance.stopped == ["nutrition_analysis"]
+    until = time.monotonic() + 1
+    while pool.stats()["idle"] != 1 and time.monotonic() < until:
+        time.sleep(0.01)
+    stats = pool.stats()
+    assert stats["idle"] == 1 and stats["held"] == 0 and stats["abandoned"] == 1
+    assert stats["replaced"] == 0 and len(pool.instances) == 1
+
+
+def test_held_instance_is_not_lent_out(pool):
+    pool.warm()
+    pool.instances[0].step_seconds = 0.5
+    with deadline_scope(Deadline(0.1)):
+        pipeline.run_pipeline("q", "report.pdf", ["nutrition"])
+    # The kickoff only notices the deadline at its next step; until then
+    # requests wait for the instance instead of getting another one
+    assert pool.stats()["held"] == 1
+    with pytest.raises(CrewPoolTimeoutError):
+        with pool.checkout(0.05):
+            pass
+    with pool.checkout(2.0) as instance:
+        assert instance is pool.instances[0]
+        assert instance.running == 0
+    assert len(pool.instances) == 1
+
+
+def test_partial_run_is_counted_by_its_stop_reason(pool, monkeypatch):
+    import main
+    from observability import CREW_RUNS_PARTIAL
+    from result_cache import MemoryBackend
+    monkeypatch.setattr(main.result_cache, "backend", MemoryBackend(8, 0))
+    with deadline_scope(Deadline(0.3)):
+        result = pipeline.run_pipeline("q", "report.pdf", ["summary", "nutrition"])
+    assert result["stop_reason"] == REASON_DEADLINE
+    # run_crew reads the reason from the result, not from a deadline that is
+    # no longer current by then
+    monkeypatch.setattr(main, "run_pipeline", lambda **kwargs: result)
+    before = CREW_RUNS_PARTIAL._values.get((REASON_DEADLINE,), 0)
+    assert main.run_crew("q", "report.pdf", ["summary", "nutrition"], report_hash="h")["partial"]
+    assert CREW_RUNS_PARTIAL._values[(REASON_DEADLINE,)] == before + 1
+    # Partial results are not cached
+    assert main.result_cache.stats()["entries"] == 0
@@ -0,0 +1,111 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from deadlines import Deadline, DeadlineExceeded, deadline_scope
+from governor import (PRIORITY_BATCH, PRIORITY_INTERACTIVE, GovernedLLM, RateGovernor, TokenBucket,
+                      current_priority, estimate_tokens, priority_scope)
+from observability import bind_context
+
+
+def test_priority_scope_nests_and_rejects_unknown_classes():
+    assert current_priority() == PRIORITY_INTERACTIVE
+    with priority_scope(PRIORITY_BATCH):
+        assert current_priority() == PRIORITY_BATCH
+        with priority_scope(PRIORITY_INTERACTIVE):
+            assert current_priority() == PRIORITY_INTERACTIVE
+        assert current_priority() == PRIORITY_BATCH
+    assert current_priority() == PRIORITY_INTERACTIVE
+    with pytest.raises(ValueError, match="Unknown priority"):
+        with priority_scope("urgent"):
+            pass
+
+
+def test_bind_context_carries_the_priority_to_worker_threads():
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        with priority_scope(PRIORITY_BATCH):
+            bound = pool.submit(bind_context(current_priority)).result()
+            unbound = pool.submit(current_priority).result()
+    assert bound == PRIORITY_BATCH
+    assert unbound == PRIORITY_INTERACTIVE
+
+
+def test_token_bucket_refills_at_its_rate():
+    bucket = TokenBucket(60)
+    bucket.take(60)
+    assert bucket.wait_time(1) == pytest.approx(1.0, abs=0.05)
+    # Requests bigger than the bucket only wait for a full bucket
+    assert bucket.wait_time(600) == pytest.approx(60.0, abs=0.1)
+
+
+def test_requests_per_minute_are_enforced():
+    governor = RateGovernor({"llm": (120, 0)})
+    for _ in range(120):
+        assert governor.acquire("llm") < 0.01
+    assert governor.acquire("llm") == pytest.approx(0.5, abs=0.15)
+    assert governor.stats()["llm"]["granted"] == 121
+    assert governor.acquire("unknown") == 0.0
+
+
+def test_batch_callers_wait_while_interactive_ones_do():
+    governor = RateGovernor({"llm": (60, 0)})
+    for _ in range(60):
+        governor.acquire("llm")
+    order = []
+
+    def call(priority):
+        governor.acquire("llm", priority=priority)
+        order.append(priority)
+    batch = threading.Thread(target=call, args=(PRIORITY_BATCH,))
+    batch.start()
+    time.sleep(0.1)
+    interactive = threading.Thread(target=call, args=(PRIORITY_INTERACTIVE,))
+    interactive.start()
+    interactive.join(5)
+    batch.join(5)
+    assert order == [PRIORITY_INTERACTIVE, PRIORITY_BATCH]
+
+
+def test_waiting_stops_at_the_deadline():
+    governor = RateGovernor({"llm": (1, 0)})
+    governor.acquire("llm")
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        governor.acquire("llm", deadline=Deadline(0.2))
+    assert time.monotonic() - started < 1
+
+
+def test_waiting_stops_at_the_calling_request_deadline():
+    governor = RateGovernor({"search": (1, 0)})
+    governor.acquire("search")
+    started = time.monotonic()
+    with deadline_scope(Deadline(0.2)), pytest.raises(DeadlineExceeded):
+        governor.acquire("search")
+    assert time.monotonic() - started < 1
+
+
+class EchoLLM:
+    def __init__(self):
+        self.temperature = 0.1
+
+    def invoke(self, prompt):
+        return f"echo {prompt}"
+
+
+def test_governed_llm_charges_prompt_and_completion_tokens():
+    governor = RateGovernor({"llm": (0, 10000)})
+    llm = GovernedLLM(EchoLLM(), governor)
+    prompt = "x" * 400
+    assert llm.invoke(prompt) == f"echo {prompt}"
+    assert governor.stats()["llm"]["tokens_used"] == estimate_tokens(prompt) + estimate_tokens(f"echo {prompt}")
+    assert llm.temperature == 0.1
+
+
+def test_governed_llm_refuses_calls_after_the_deadline():
+    llm = GovernedLLM(EchoLLM(), RateGovernor({"llm": (0, 0)}))
+    deadline = Deadline(0)
+    deadline.cancel()
+    with deadline_scope(deadline), pytest.raises(DeadlineExceeded):
+        llm.invoke("hello")
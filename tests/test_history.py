@@ -0,0 +1,170 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+import config
+import history
+from markers import extract_markers
+from conftest import ROOT, LAB_LINES
+
+
+def test_history_is_off_unless_configured(monkeypatch):
+    monkeypatch.setattr(config, "HISTORY_DB_PATH", "")
+    monkeypatch.setattr(history, "_marker_history", None)
+    assert history.get_marker_history() is None
+
+
+def test_store_is_opened_lazily_at_the_configured_path(monkeypatch, tmp_path):
+    path = tmp_path / "history" / "markers.sqlite3"
+    monkeypatch.setattr(config, "HISTORY_DB_PATH", str(path))
+    monkeypatch.setattr(history, "_marker_history", None)
+    assert not path.exists()
+    store = history.get_marker_history()
+    assert store is history.get_marker_history()
+    assert path.exists()
+
+
+def test_importing_main_writes_no_history_file(tmp_path):
+    env = {key: value for key, value in os.environ.items() if key != "HISTORY_DB_PATH"}
+    env["PYTHONPATH"] = os.pathsep.join([ROOT, env.get("PYTHONPATH", "")])
+    subprocess.run([sys.executable, "-c", "import history, main"], cwd=tmp_path, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    assert not (tmp_path / "cache" / "history.sqlite3").exists()
+
+
+def test_every_operation_closes_its_connection(monkeypatch, tmp_path):
+    opened = []
+    connect = sqlite3.connect
+
+    def tracking_connect(*args, **kwargs):
+        conn = connect(*args, **kwargs)
+        opened.append(conn)
+        return conn
+    monkeypatch.setattr(sqlite3, "connect", tracking_connect)
+
+    store = history.MarkerHistory(str(tmp_path / "h.sqlite3"))
+    store.record("p1", "hash1", extract_markers("\n".join(LAB_LINES)), "2024-01-10")
+    store.changes("p1")
+    store.trend("p1")
+    store.reports("p1")
+    store.stats()
+    store.forget("p1")
+    assert len(opened) == 7
+    for conn in opened:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+
+
+@pytest.fixture
+def store(tmp_path):
+    return history.MarkerHistory(str(tmp_path / "h.sqlite3"))
+
+
+def test_forget_report_with_rowid_only_removes_that_recording(store):
+    text = "\n".join(LAB_LINES)
+    first = store.record_report("p1", "hash1", text, report_date="2024-01-10")
+    assert first.recorded_rowid is not None
+    # The same report submitted again is already on file
+    again = store.record_report("p1", "hash1", text, report_date="2024-01-10")
+    assert again.recorded_rowid is None
+    assert not store.forget_report("p1", "hash1", rowid=12345)
+    assert [r["report_hash"] for r in store.reports("p1")] == ["hash1"]
+    assert store.forget_report("p1", "hash1", rowid=first.recorded_rowid)
+    assert store.reports("p1") == []
+    assert store.trend("p1") == {}
+
+
+def test_rejected_resubmission_keeps_the_earlier_record(monkeypatch, tmp_path, lab_pdf):
+    import main
+    from pipeline import ReportRejectedError
+    from report_cache import file_sha256
+
+    monkeypatch.setattr(config, "HISTORY_DB_PATH", str(tmp_path / "h.sqlite3"))
+    monkeypatch.setattr(history, "_marker_history", None)
+
+    def upload():
+        path = tmp_path / "upload.pdf"
+        path.write_bytes(lab_pdf)
+        return str(path)
+    report_hash = file_sha256(upload())
+
+    monkeypatch.setattr(main, "run_crew", lambda **kwargs: {
+        "analysis": "ok", "analyses": {"summary": "ok"}, "verification": None, "errors": {},
+        "incomplete": [], "partial": False, "cached": False})
+    assert main.process_report("q", upload(), "a.pdf", tasks=["summary"], patient_id="p1")["status"] == "success"
+
+    def reject(**kwargs):
+        raise ReportRejectedError("INVALID: not a report")
+    monkeypatch.setattr(main, "run_crew", reject)
+    assert main.process_report("q", upload(), "a.pdf", tasks=["summary"], patient_id="p1")["status"] == "rejected"
+    assert [r["report_hash"] for r in history.get_marker_history().reports("p1")] == [report_hash]
+
+    # A report rejected on its first submission is not kept
+    assert main.process_report("q", upload(), "a.pdf", tasks=["summary"], patient_id="p2")["status"] == "rejected"
+    assert history.get_marker_history().reports("p2") == []
+
+
+def _text(*lines):
+    return "\n".join(["Test Result Units Reference Range", *lines])
+
+
+def test_dates_are_read_day_first_and_found_in_the_text(monkeypatch):
+    assert history.parse_date("03/04/2024") == "2024-04-03"
+    assert history.parse_date("12 Mar 2024") == "2024-03-12"
+    assert history.parse_date("not a date") is None
+    monkeypatch.setattr(config, "HISTORY_DAY_FIRST", False)
+    assert history.parse_date("03/04/2024") == "2024-03-04"
+    assert history.find_report_date("Lab ref 1234 Collected: 2024-02-01 Reported: 2024-02-02") == "2024-02-01"
+
+
+def test_changes_compare_with_the_last_earlier_reading(store):
+    first = store.record_report("p1", "jan", _text("Glucose 100 mg/dL 70 - 99", "Hemoglobin 13.0 g/dL 12.0 - 15.5",
+                                                  "Vitamin D 18 ng/mL 30 - 100"), report_date="2024-01-10")
+    assert first.earlier_reports == 0 and first.to_text() == history.NO_EARLIER_REPORTS
+
+    changes = store.record_report("p1", "mar", _text("Glucose 130 mg/dL 70 - 99", "Hemoglobin 13.2 g/dL 12.0 - 15.5",
+                                                    "TSH 2.1 uIU/mL 0.4 - 4.0"), report_date="2024-03-10")
+    assert changes.earlier_reports == 1
+    by_marker = {change.marker: change for change in changes.changes}
+    glucose = by_marker["glucose"]
+    assert (glucose.previous_value, glucose.delta, glucose.percent) == (100, 30, 30.0)
+    assert glucose.previous_date == "2024-01-10" and not glucose.stable
+    assert by_marker["hemoglobin"].stable
+    assert by_marker["tsh"].previous_value is None
+    assert changes.dropped == ["vitamin_d"]
+
+    text = changes.to_text()
+    assert "compared with 1 earlier report(s)" in text
+    assert "(was 100 on 2024-01-10; +30, +30%) high" in text
+    assert "Stable (within 5%): Hemoglobin" in text
+    assert "First measured in this report: TSH" in text
+    assert "Measured before but not in this report: Vitamin D" in text
+
+
+def test_an_older_report_recorded_later_compares_with_what_came_before_it(store):
+    store.record("p1", "mar", extract_markers(_text("Glucose 130 mg/dL 70 - 99")), "2024-03-10")
+    store.record("p1", "jan", extract_markers(_text("Glucose 100 mg/dL 70 - 99")), "2024-01-10")
+    assert store.changes("p1", "jan").earlier_reports == 0
+    # The latest report by date, not by recording order
+    latest = store.changes("p1")
+    assert latest.report_hash == "mar" and latest.changes[0].delta == 30
+    assert store.changes("p1", "unknown") is None and store.changes("nobody") is None
+
+
+def test_readings_in_another_unit_are_not_compared():
+    # Extraction converts the units it knows; a stored reading may still differ
+    change = history.MarkerChange(("glucose", 110.0, "mg/dL", "high"), (5.5, "mmol/L", "normal", "2024-01-10"))
+    assert not change.comparable and change.delta is None
+    assert "different unit" in change.to_row()
+
+
+def test_trend_lists_readings_oldest_first(store):
+    for month, value in (("01", 100), ("02", 110), ("03", 120)):
+        store.record("p1", month, extract_markers(_text(f"Glucose {value} mg/dL 70 - 99")), f"2024-{month}-01")
+    trend = store.trend("p1", "glucose")
+    assert [point["value"] for point in trend["glucose"]] == [100, 110, 120]
+    assert [point["date"] for point in store.trend("p1", limit=2)["glucose"]] == ["2024-02-01", "2024-03-01"]
+    assert store.stats() == {"patients": 1, "reports": 3, "readings": 3, "recorded": 3}
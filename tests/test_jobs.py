@@ -0,0 +1,80 @@
+import threading
+import time
+
+import pytest
+
+from jobs import JobQueue, QueueFullError, JOB_DONE, JOB_FAILED, JOB_QUEUED, JOB_RUNNING
+from conftest import wait_for_job
+
+
+def _wait(job, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not job.finished and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert job.finished
+
+
+def test_submit_runs_job_and_keeps_result():
+    queue = JobQueue(workers=1, max_queued=1)
+    job = queue.submit(lambda a, b: a + b, 2, 3, metadata={"query": "q"})
+    _wait(job)
+    assert job.status == JOB_DONE
+    assert job.result == 5
+    assert queue.get(job.id) is job
+    assert job.to_dict()["query"] == "q"
+    queue.shutdown()
+
+
+def test_failed_job_records_error():
+    queue = JobQueue(workers=1, max_queued=0)
+
+    def boom():
+        raise ValueError("bad report")
+    job = queue.submit(boom)
+    _wait(job)
+    assert job.status == JOB_FAILED
+    assert job.error == "bad report"
+    queue.shutdown()
+
+
+def test_full_queue_raises_and_frees_slots_afterwards():
+    queue = JobQueue(workers=1, max_queued=1)
+    release = threading.Event()
+    running = queue.submit(release.wait)
+    waiting = queue.submit(lambda: None)
+    with pytest.raises(QueueFullError):
+        queue.submit(lambda: None)
+    assert queue.stats()[JOB_RUNNING] + queue.stats()[JOB_QUEUED] == 2
+    release.set()
+    _wait(running)
+    _wait(waiting)
+    # Both slots are free again
+    _wait(queue.submit(lambda: None))
+    queue.shutdown()
+
+
+def test_finished_jobs_expire_after_ttl():
+    queue = JobQueue(workers=1, max_queued=0, result_ttl=0.05)
+    job = queue.submit(lambda: 1)
+    _wait(job)
+    time.sleep(0.1)
+    assert queue.get(job.id) is None
+    queue.shutdown()
+
+
+def test_analyze_returns_202_and_job_result(client, lab_pdf):
+    response = client.post("/analyze", files={"file": ("report.pdf", lab_pdf, "application/pdf")},
+                           data={"tasks": "summary", "query": "jobs endpoint test"})
+    assert response.status_code == 202
+    body = response.json()
+    assert body["status_url"] == f"/jobs/{body['job_id']}"
+    assert wait_for_job(client, body["job_id"])["status"] == "done"
+    result = client.get(body["result_url"]).json()
+    assert result["status"] == "success"
+    assert result["file_processed"] == "report.pdf"
+    assert list(result["analyses"]) == ["summary"]
+
+
+def test_unknown_job_is_404(client):
+    assert client.get("/jobs/nope").status_code == 404
+    assert client.get("/jobs/nope/result").status_code == 404
@@ -0,0 +1,76 @@
+import pytest
+
+from conftest import LAB_LINES
+from markers import (FLAG_HIGH, FLAG_LOW, FLAG_NORMAL, abnormal_markers, extract_markers, format_markers,
+                     marker_spans)
+
+
+def _one(text: str):
+    markers = extract_markers(text)
+    assert len(markers) == 1, markers
+    return markers[0]
+
+
+def test_lab_panel_is_extracted_in_report_order():
+    markers = extract_markers("\n".join(LAB_LINES))
+    assert [m.key for m in markers] == ["hemoglobin", "glucose", "ldl", "vitamin_d", "tsh"]
+    glucose = markers[1]
+    assert (glucose.value, glucose.unit, glucose.ref_low, glucose.ref_high) == (110.0, "mg/dL", 70.0, 99.0)
+    assert glucose.flag == FLAG_HIGH and glucose.ref_source == "report"
+    assert [m.key for m in abnormal_markers(markers)] == ["hemoglobin", "glucose", "ldl", "vitamin_d"]
+
+
+@pytest.mark.parametrize("line, key", [
+    ("Haemoglobin (HB): 13.1 g/dL", "hemoglobin"),
+    ("HbA1c 6.1 %", "hba1c"),
+    ("LDL Cholesterol Direct 120 mg/dL", "ldl"),
+    ("25-OH Vitamin D 22 ng/mL", "vitamin_d"),
+    ("SGPT 30 U/L", "alt"),
+])
+def test_synonyms_map_to_one_marker(line, key):
+    assert _one(line).key == key
+
+
+def test_units_are_converted_with_their_ranges():
+    glucose = _one("Glucose 5.5 mmol/L 3.9 - 5.5")
+    assert (glucose.value, glucose.unit) == (99.09, "mg/dL")
+    assert (glucose.ref_low, glucose.ref_high) == (70.26, 99.09)
+    vitamin_d = _one("Vitamin D 50 nmol/L")
+    assert vitamin_d.value == 20.03 and vitamin_d.flag == FLAG_LOW and vitamin_d.ref_source == "default"
+
+
+def test_one_sided_ranges_printed_flags_and_defaults():
+    ldl = _one("LDL 90 mg/dL <100")
+    assert (ldl.ref_low, ldl.ref_high, ldl.flag) == (None, 100.0, FLAG_NORMAL)
+    assert _one("HDL 35 mg/dL >40").flag == FLAG_LOW
+    # A printed flag wins over the range
+    assert _one("TSH 3.0 uIU/mL 0.4-4.0 H").flag == FLAG_HIGH
+    assert _one("Ferritin 150").flag == FLAG_NORMAL
+    # No default range for a value in a unit the marker cannot be converted from
+    unknown_unit = _one("Ferritin 150 pmol/L")
+    assert unknown_unit.ref_source is None and unknown_unit.flag is None
+
+
+def test_first_occurrence_wins_and_spans_cover_repeats():
+    text = "Glucose 110 mg/dL\nSummary: glucose 95 mg/dL"
+    assert _one(text).value == 110.0
+    assert len(marker_spans(text)) == 2
+
+
+def test_a_marker_without_a_value_does_not_take_the_next_ones():
+    # Pages reach the extractor as one line each
+    glucose = _one("Hemoglobin: not done Glucose 95 mg/dL 70-99")
+    assert (glucose.key, glucose.value) == ("glucose", 95.0)
+    keys = [m.key for m in extract_markers("Hemoglobin pending, see note TSH 2.1 uIU/mL Ferritin 80 ng/mL")]
+    assert keys == ["tsh", "ferritin"]
+
+
+def test_words_containing_marker_names_are_ignored():
+    assert extract_markers("Hbsag negative, Alternative medicine 12") == []
+    assert extract_markers("") == []
+
+
+def test_format_markers_renders_compact_rows():
+    markers = extract_markers("Glucose 110 mg/dL 70 - 99\nHDL 55 mg/dL >40")
+    assert format_markers(markers) == "Glucose: 110 mg/dL (ref 70-99) high\nHDL Cholesterol: 55 mg/dL (ref >40) normal"
+    assert format_markers([]) == "No recognised lab markers found in the report."
@@ -0,0 +1,84 @@
+import json
+import logging
+
+import pytest
+
+import config
+from jobs import JobQueue
+from observability import MetricsRegistry, RequestIdFilter, format_server_timing, request_scope, span
+
+
+def test_spans_feed_the_request_timings_and_nest():
+    with request_scope("req-1") as timings:
+        with span("outer"):
+            with span("inner"):
+                pass
+    assert [name for name, _seconds in timings] == ["inner", "outer"]
+    header = format_server_timing([("parse", 0.0125)], 0.02)
+    assert header == "parse;dur=12.5, total;dur=20.0"
+
+
+def test_span_lines_are_off_by_default(caplog):
+    caplog.set_level(logging.INFO, logger="analyser.spans")
+    with span("quiet"):
+        pass
+    assert not caplog.records
+
+
+def test_span_lines_go_through_logging_when_enabled(monkeypatch, caplog):
+    monkeypatch.setattr(config, "SPAN_LOG", True)
+    caplog.set_level(logging.INFO, logger="analyser.spans")
+    with request_scope("req-2"):
+        with span("outer"):
+            with pytest.raises(ValueError):
+                with span("inner", tool="reader") as attributes:
+                    attributes["pages"] = 3
+                    raise ValueError("boom")
+    lines = [json.loads(record.getMessage()) for record in caplog.records if record.name == "analyser.spans"]
+    assert lines[0]["span"] == "inner" and lines[0]["parent"] == "outer"
+    assert lines[0]["status"] == "error" and lines[0]["pages"] == 3 and lines[0]["tool"] == "reader"
+    assert lines[0]["request_id"] == "req-2"
+    assert lines[1]["span"] == "outer" and lines[1]["status"] == "ok"
+
+
+def test_a_failed_job_is_logged_with_the_submitting_request_id(caplog):
+    caplog.handler.addFilter(RequestIdFilter())
+    queue = JobQueue(workers=1, max_queued=0)
+
+    def boom():
+        raise ValueError("bad report")
+    with request_scope("req-3"):
+        job = queue.submit(boom)
+    queue.shutdown()
+    records = [record for record in caplog.records if record.name == "jobs"]
+    assert records[0].request_id == "req-3"
+    assert records[0].exc_info[0] is ValueError and job.id in records[0].getMessage()
+
+
+def test_registry_renders_prometheus_text_and_survives_broken_collectors(caplog):
+    registry = MetricsRegistry()
+    counter = registry.counter("demo_total", "Demo counter.", ("kind",))
+    counter.inc(kind='a"b')
+    histogram = registry.histogram("demo_seconds", "Demo histogram.", buckets=(0.1, 1.0))
+    histogram.observe(0.5)
+
+    def broken():
+        raise RuntimeError("collector down")
+    registry.add_collector(broken)
+    registry.add_collector(lambda: [("demo_gauge", "gauge", "Demo gauge.", [({"pool": "crew"}, 2)])])
+    with caplog.at_level(logging.ERROR, logger="analyser.observability"):
+        text = registry.render()
+    assert 'demo_total{kind="a\\"b"} 1' in text
+    assert 'demo_seconds_bucket{le="0.1"} 0' in text and 'demo_seconds_bucket{le="+Inf"} 1' in text
+    assert 'demo_gauge{pool="crew"} 2' in text
+    assert "Metrics collector" in caplog.text and "collector down" in caplog.text
+
+
+def test_request_id_is_echoed_and_metrics_are_served(client):
+    response = client.get("/", headers={"X-Request-ID": "abc123"})
+    assert response.headers["X-Request-ID"] == "abc123"
+    assert "total;dur=" in response.headers["Server-Timing"]
+    assert client.get("/").headers["X-Request-ID"] != "abc123"
+    metrics = client.get("/metrics").text
+    assert 'analyser_http_requests_total{method="GET",route="/",status="200"}' in metrics
+    assert "analyser_crew_pool_size" in metrics
@@ -0,0 +1,142 @@
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+import config
+import ocr
+import pdf_extract
+from ocr import OcrCache, OcrDocument, _render_scale
+
+
+class FakePool:
+    """Executor handing back futures the test completes itself."""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, source, index, *args):
+        future = Future()
+        self.submitted.append((index, future))
+        return future
+
+
+class Page(dict):
+    pass
+
+
+class Reader:
+    def __init__(self, pages: int):
+        self.pages = [Page() for _ in range(pages)]
+
+
+@pytest.fixture
+def fresh(monkeypatch):
+    """Empty OCR cache, a fake pool and page hashes keyed by page number."""
+    cache = OcrCache(max_entries=8)
+    pool = FakePool()
+    monkeypatch.setattr(ocr, "ocr_cache", cache)
+    monkeypatch.setattr(ocr, "_get_pool", lambda: pool)
+    monkeypatch.setattr(ocr, "page_image_hash", lambda page: page.get("key"))
+    return cache, pool
+
+
+def test_render_scale_respects_dpi_and_pixel_limit():
+    assert _render_scale(72, 72, 300, 0) == pytest.approx(300 / 72)
+    # A4 at 300 dpi is ~8.7 MP; a 4 MP cap lowers the scale
+    scale = _render_scale(595, 842, 300, 4_000_000)
+    assert scale < 300 / 72
+    assert 595 * 842 * scale * scale == pytest.approx(4_000_000)
+
+
+def test_cache_is_an_lru_with_counters():
+    cache = OcrCache(max_entries=2)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a") == "A"
+    cache.put("c", "C")
+    assert cache.get("b") is None
+    assert cache.get("a") == "A" and cache.get("c") == "C"
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (3, 1, 2)
+
+
+def test_counters_add_up_across_threads():
+    cache = OcrCache(max_entries=8)
+
+    def work():
+        for _ in range(2000):
+            cache.count("failures")
+            cache.put("page", "text", seconds=0.001)
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = cache.stats()
+    assert (stats["failures"], stats["pages_ocred"]) == (8000, 8000)
+    assert stats["ocr_seconds"] == pytest.approx(8.0)
+
+
+def test_pages_are_read_once_and_cached(fresh):
+    cache, pool = fresh
+    reader = Reader(3)
+    for page in reader.pages:
+        page["key"] = "same scan"
+    document = OcrDocument(reader, "report.pdf", timeout=5)
+    first, repeat = document.submit(0), document.submit(1)
+    assert first is repeat and len(pool.submitted) == 1
+    first.set_result("Glucose 110")
+    assert document.result(first, 0) == "Glucose 110"
+    # Later documents get the page from the cache
+    cached = OcrDocument(reader, "report.pdf", timeout=5).submit(2)
+    assert cached.result() == "Glucose 110"
+    assert len(pool.submitted) == 1
+    assert cache.stats()["pages_ocred"] == 1 and cache.stats()["hits"] == 1
+
+
+def test_blank_pages_skip_ocr(fresh):
+    cache, pool = fresh
+    document = OcrDocument(Reader(1), "report.pdf", timeout=5)
+    assert document.submit(0).result() == ""
+    assert pool.submitted == [] and cache.stats()["blank_pages"] == 1
+
+
+def test_pages_past_the_budget_and_failed_pages_come_back_empty(fresh):
+    cache, pool = fresh
+    reader = Reader(2)
+    reader.pages[0]["key"], reader.pages[1]["key"] = "slow", "broken"
+    document = OcrDocument(reader, "report.pdf", timeout=0.05)
+    slow, broken = document.submit(0), document.submit(1)
+    broken.set_exception(RuntimeError("tesseract crashed"))
+    assert document.result(slow, 0) == ""
+    assert document.result(broken, 1) == ""
+    stats = cache.stats()
+    assert (stats["timeouts"], stats["failures"], stats["entries"]) == (1, 1, 0)
+
+
+def test_text_less_pages_are_replaced_in_order(fresh, monkeypatch):
+    cache, pool = fresh
+    monkeypatch.setattr(ocr, "ocr_available", lambda: True)
+    monkeypatch.setattr(config, "OCR_MIN_CHARS", 5)
+    reader = Reader(3)
+    reader.pages[1]["key"] = "scan"
+    pages = pdf_extract._with_ocr("report.pdf", [(0, "Page one text"), (1, ""), (2, "Page three text")], reader)
+    assert next(pages) == "Page one text"
+
+    def finish_scan():
+        (index, future), = pool.submitted
+        assert index == 1
+        future.set_result("  Scanned\n page  ")
+
+    # Page three waits for the scan before it
+    timer = threading.Timer(0.1, finish_scan)
+    timer.start()
+    assert list(pages) == ["Scanned page", "Page three text"]
+    timer.join()
+
+
+def test_ocr_is_unavailable_when_disabled(monkeypatch):
+    monkeypatch.setattr(config, "OCR_ENABLED", False)
+    monkeypatch.setattr(ocr, "_available", None)
+    assert not ocr.ocr_available()
@@ -0,0 +1,77 @@
+import pytest
+
+import config
+import pdf_extract
+from benchmarks.synthetic import build_pdf, make_lab_pdf
+from deadlines import Deadline, DeadlineExceeded, deadline_scope
+from pdf_extract import clean_page, extract_text, extract_text_pooled, iter_pages, page_count
+from upload_buffers import discard_upload, upload_buffers
+
+PAGES = [[f"Page {number} Haemoglobin 13.{number} g/dL 13 - 17"] for number in range(1, 11)]
+
+
+@pytest.fixture
+def pool_settings(monkeypatch):
+    """Small pool and chunks, so a ten-page report takes the page-parallel path."""
+    monkeypatch.setattr(config, "PDF_WORKERS", 2)
+    monkeypatch.setattr(config, "PDF_PARALLEL_MIN_PAGES", 4)
+    monkeypatch.setattr(config, "PDF_PAGES_PER_TASK", 3)
+    yield
+    pdf_extract.shutdown_pool()
+
+
+@pytest.fixture
+def report_path(tmp_path):
+    path = tmp_path / "report.pdf"
+    path.write_bytes(build_pdf(PAGES))
+    return str(path)
+
+
+def test_clean_page_collapses_whitespace():
+    assert clean_page("  Glucose\n 5.4\t mmol/L \n") == "Glucose 5.4 mmol/L"
+    assert clean_page(None) == ""
+
+
+def test_pages_come_back_in_order(report_path):
+    assert page_count(report_path) == 10
+    pages = list(iter_pages(report_path))
+    assert pages == [clean_page(lines[0]) for lines in PAGES]
+
+
+def test_page_window(report_path):
+    assert list(iter_pages(report_path, first_page=2, max_pages=3)) == [
+        clean_page(PAGES[i][0]) for i in (2, 3, 4)]
+    assert extract_text(report_path, max_pages=2) == f"{clean_page(PAGES[0][0])}\n{clean_page(PAGES[1][0])}\n"
+
+
+def test_parallel_and_serial_extraction_agree(tmp_path, monkeypatch, pool_settings):
+    path = tmp_path / "panel.pdf"
+    path.write_bytes(make_lab_pdf(10))
+    parallel = extract_text(str(path))
+    assert pdf_extract._pool is not None
+    monkeypatch.setattr(config, "PDF_PARALLEL_MIN_PAGES", 1000)
+    serial = extract_text(str(path))
+    assert parallel == serial
+    assert parallel.count("\n") == 10 and "Page 10 of 10" in parallel
+
+
+def test_pooled_extraction_of_a_small_report(report_path, monkeypatch, pool_settings):
+    monkeypatch.setattr(config, "PDF_PARALLEL_MIN_PAGES", 1000)
+    assert extract_text_pooled(report_path) == extract_text(report_path)
+
+
+def test_in_memory_upload_is_extracted_on_the_pool(report_path, pool_settings):
+    with open(report_path, "rb") as f:
+        handle = upload_buffers.put(f.read(), "digest", "report.pdf")
+    try:
+        assert page_count(handle) == 10
+        assert extract_text(handle) == extract_text(report_path)
+    finally:
+        discard_upload(handle)
+
+
+def test_extraction_stops_at_the_deadline(report_path):
+    deadline = Deadline(60)
+    deadline.cancel()
+    with deadline_scope(deadline), pytest.raises(DeadlineExceeded):
+        extract_text(report_path)
@@ -0,0 +1,93 @@
+import threading
+import time
+
+import pytest
+
+import pipeline
+from crew_pool import CrewPool
+from pipeline import ReportRejectedError, parse_task_selection, run_pipeline
+
+
+class SlowCrew:
+    """Crew instance answering every task after `seconds`; `fail` tasks raise instead."""
+
+    def __init__(self, seconds: float = 0.2, verdict: str = "VALID", fail=()):
+        self.seconds = seconds
+        self.verdict = verdict
+        self.fail = set(fail)
+        self.calls = []
+        self.stragglers = []
+        self._lock = threading.Lock()
+
+    def kickoff(self, task_name: str, inputs: dict, step_callback=None):
+        with self._lock:
+            self.calls.append(task_name)
+        time.sleep(self.seconds)
+        if task_name in self.fail:
+            raise RuntimeError(f"{task_name} broke")
+        if task_name == pipeline.VERIFICATION:
+            return f"{self.verdict}: looks like a blood report"
+        return f"{task_name} for {inputs['query']}"
+
+    def reset(self):
+        pass
+
+
+@pytest.fixture
+def use_crew(monkeypatch):
+    def install(crew):
+        monkeypatch.setattr(pipeline, "crew_pool", CrewPool(factory=lambda: crew, size=1))
+        return crew
+    return install
+
+
+def test_task_selection_is_validated_and_ordered():
+    assert parse_task_selection("Exercise, verification,summary,summary") == ["verification", "summary", "exercise"]
+    with pytest.raises(ValueError, match="Unknown task"):
+        parse_task_selection("summary,astrology")
+    with pytest.raises(ValueError, match="at least one analysis"):
+        parse_task_selection("verification")
+
+
+def test_analyses_run_concurrently_after_the_gate(use_crew):
+    crew = use_crew(SlowCrew(0.2))
+    events = []
+    started = time.monotonic()
+    result = run_pipeline("q", "r.pdf", ["verification", "summary", "nutrition", "exercise"],
+                          on_event=lambda name, data: events.append(name))
+    elapsed = time.monotonic() - started
+    # Gate plus one branch time, not gate plus three
+    assert elapsed < 0.6
+    assert crew.calls[0] == "verification"
+    assert events[0] == "verification" and events.count("task") == 3
+    assert list(result["analyses"]) == ["summary", "nutrition", "exercise"]
+    assert result["analysis"].index("## Health Summary") < result["analysis"].index("## Exercise Plan")
+    assert not result["partial"] and result["errors"] == {}
+
+
+def test_rejected_report_runs_no_analysis(use_crew):
+    crew = use_crew(SlowCrew(0.01, verdict="INVALID"))
+    with pytest.raises(ReportRejectedError) as rejected:
+        run_pipeline("q", "r.pdf", ["verification", "summary", "nutrition"])
+    assert rejected.value.verification_output.startswith("INVALID")
+    assert crew.calls == ["verification"]
+
+
+def test_single_analysis_is_not_given_a_heading(use_crew):
+    use_crew(SlowCrew(0.01))
+    result = run_pipeline("q", "r.pdf", ["summary"])
+    assert result["analysis"] == "help_patients for q"
+    assert result["verification"] is None
+
+
+def test_failed_branch_is_reported_while_others_succeed(use_crew):
+    use_crew(SlowCrew(0.01, fail={"nutrition_analysis"}))
+    result = run_pipeline("q", "r.pdf", ["summary", "nutrition"])
+    assert list(result["analyses"]) == ["summary"]
+    assert result["errors"] == {"nutrition": "nutrition_analysis broke"}
+
+
+def test_all_branches_failing_raises(use_crew):
+    use_crew(SlowCrew(0.01, fail={"help_patients", "exercise_planning"}))
+    with pytest.raises(RuntimeError, match="All analyses failed"):
+        run_pipeline("q", "r.pdf", ["summary", "exercise"])
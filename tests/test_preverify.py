@@ -0,0 +1,72 @@
+import pytest
+
+from benchmarks.synthetic import build_pdf
+from preverify import VERDICT_ACCEPT, VERDICT_AMBIGUOUS, VERDICT_REJECT, classify_report, score_text
+
+
+def _pdf(tmp_path, pages: list, name: str = "doc.pdf") -> str:
+    path = tmp_path / name
+    path.write_bytes(build_pdf(pages))
+    return str(path)
+
+
+def test_lab_report_is_accepted(lab_pdf_path):
+    result = classify_report(lab_pdf_path, "application/pdf")
+    assert result.verdict == VERDICT_ACCEPT
+    assert result.page_count == 1 and result.details["markers"] == 5
+
+
+def test_prose_pdf_is_rejected(tmp_path):
+    path = _pdf(tmp_path, [["Dear customer, thank you for your order.", "Your invoice is attached below."]])
+    result = classify_report(path)
+    assert result.verdict == VERDICT_REJECT
+    assert result.reason == "Does not look like a blood test report"
+
+
+def test_some_lab_signals_need_llm_verification(tmp_path):
+    path = _pdf(tmp_path, [["Patient notes", "Glucose 110 mg/dL was discussed at the visit today."]])
+    assert classify_report(path).verdict == VERDICT_AMBIGUOUS
+
+
+@pytest.mark.parametrize("content, content_type, reason", [
+    (b"%PDF-1.4", "image/png", "Unsupported content type: image/png"),
+    (b"PK\x03\x04 zip", "application/pdf", "File is not a PDF"),
+    (b"%PDF-1.4 truncated", "application/pdf", "Unreadable PDF"),
+])
+def test_cheap_rejects(tmp_path, content, content_type, reason):
+    path = tmp_path / "upload.pdf"
+    path.write_bytes(content)
+    result = classify_report(str(path), content_type)
+    assert result.verdict == VERDICT_REJECT and result.reason.startswith(reason)
+
+
+def test_missing_upload_is_rejected(tmp_path):
+    assert classify_report(str(tmp_path / "gone.pdf")).reason.startswith("Could not read upload")
+
+
+def test_page_limit(tmp_path, lab_pdf_path):
+    assert classify_report(lab_pdf_path, max_pages=1).verdict == VERDICT_ACCEPT
+    long_path = _pdf(tmp_path, [["page"]] * 3)
+    result = classify_report(long_path, max_pages=2)
+    assert result.verdict == VERDICT_REJECT and result.reason == "PDF has 3 pages (limit 2)"
+
+
+def test_content_type_parameters_are_ignored(lab_pdf_path):
+    assert classify_report(lab_pdf_path, "application/pdf; charset=binary").verdict == VERDICT_ACCEPT
+
+
+def test_score_grows_with_lab_signals():
+    prose, _ = score_text("A letter about the weather and nothing else.")
+    report, details = score_text("Blood test report\nHemoglobin 13 g/dL\nGlucose 90 mg/dL\nTSH 2 uIU/mL\n"
+                                 "LDL 90 mg/dL\nSerum sample, reference range")
+    assert prose < 0.1 < report
+    assert details["markers"] == 4 and details["value_unit_pairs"] == 4
+
+
+def test_rejected_upload_never_reaches_the_crew(client, tmp_path, mock_llm):
+    pdf = build_pdf([["Dear customer, thank you for your order."]])
+    calls = mock_llm.calls
+    response = client.post("/analyze", files={"file": ("invoice.pdf", pdf, "application/pdf")})
+    assert response.status_code == 422
+    assert response.json()["detail"]["verdict"] == VERDICT_REJECT
+    assert mock_llm.calls == calls
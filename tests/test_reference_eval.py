@@ -0,0 +1,109 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import reference_eval
+from markers import Marker
+from reference_eval import (SEX_ANY, SEX_FEMALE, SEX_MALE, Z_95, MarkerTable, ReferenceTable, evaluate,
+                            evaluate_report, find_demographics, format_demographics)
+from conftest import LAB_LINES
+
+
+def _reading(key: str, value: float, unit: str, low: float = None, high: float = None) -> Marker:
+    source = "report" if low is not None or high is not None else None
+    return Marker(key, value, unit, low, high, ref_source=source)
+
+
+def _evaluate(*markers, sex=SEX_ANY, age=None, reference=None):
+    table = MarkerTable()
+    table.add_report("r", list(markers), sex, age)
+    return evaluate(table, reference or ReferenceTable([]))
+
+
+def _at_z(z: float) -> float:
+    """Glucose value z SDs from the middle of a printed 80-120 range."""
+    return 100 + z * 20 / Z_95
+
+
+@pytest.mark.parametrize("z, severity", [(1.5, "normal"), (2.5, "mild"), (2.99, "mild"), (3.01, "moderate"),
+                                         (3.99, "moderate"), (4.01, "severe"), (-4.01, "severe")])
+def test_z_score_tiers(z, severity):
+    row = _evaluate(_reading("glucose", _at_z(z), "mg/dL", 80, 120)).row(0)
+    assert row["z"] == pytest.approx(z, abs=0.01)
+    assert row["severity"] == severity
+    assert row["flag"] == ("normal" if severity == "normal" else "high" if z > 0 else "low")
+
+
+@pytest.mark.parametrize("value, severity", [(100, "normal"), (124, "mild"), (125, "moderate"),
+                                             (149, "moderate"), (150, "severe")])
+def test_excess_tiers_of_one_sided_ranges(value, severity):
+    row = _evaluate(_reading("ldl", value, "mg/dL", 0, 100)).row(0)
+    # "<100" has no middle, so there is no z-score
+    assert row["z"] is None
+    assert row["severity"] == severity
+
+
+def test_most_specific_table_range_wins():
+    reference = ReferenceTable([
+        {"marker": "hemoglobin", "sex": "male", "low": 13.5, "high": 17.5},
+        {"marker": "hemoglobin", "sex": "female", "low": 12.0, "high": 15.5},
+        {"marker": "hemoglobin", "sex": "female", "age_max": 18, "low": 11.5, "high": 15.0},
+        {"marker": "unknown marker", "low": 1, "high": 2},
+    ])
+    readings = [_reading("hemoglobin", 13.0, "g/dL")]
+    assert _evaluate(*readings, sex=SEX_MALE, reference=reference).row(0)["flag"] == "low"
+    female = _evaluate(*readings, sex=SEX_FEMALE, age=45, reference=reference).row(0)
+    assert (female["ref_low"], female["ref_high"], female["range_source"]) == (12.0, 15.5, "table")
+    assert _evaluate(*readings, sex=SEX_FEMALE, age=12, reference=reference).row(0)["ref_high"] == 15.0
+    # Unknown sex falls back to the catch-all default
+    assert _evaluate(*readings, reference=reference).row(0)["ref_low"] == 12.0
+
+
+def test_printed_range_wins_unless_disabled(monkeypatch):
+    reading = _reading("glucose", 105, "mg/dL", 70, 110)
+    assert _evaluate(reading).row(0)["flag"] == "normal"
+    monkeypatch.setattr(reference_eval.config, "EVAL_PREFER_REPORT_RANGES", False)
+    row = _evaluate(reading).row(0)
+    assert (row["flag"], row["range_source"]) == ("high", "table")
+
+
+def test_readings_in_other_units_need_a_printed_range():
+    row = _evaluate(_reading("glucose", 5.0, "mmol/L")).row(0)
+    assert (row["range_source"], row["flag"], row["severity"]) == (None, None, "normal")
+
+
+def test_flagged_findings_are_ordered_most_severe_first():
+    evaluation = _evaluate(_reading("glucose", _at_z(2.5), "mg/dL", 80, 120),
+                           _reading("ldl", 160, "mg/dL", 0, 100),
+                           _reading("tsh", 2.0, "uIU/mL", 0.4, 4.0))
+    assert [evaluation.row(i)["marker"] for i in evaluation.flagged()] == ["ldl", "glucose"]
+    text = evaluation.findings_text()
+    assert text.index("LDL Cholesterol: 160") < text.index("Glucose:")
+    assert "60% above the upper limit" in text
+    assert "The other 1 marker is within range." in text
+
+
+def test_demographics_round_trip():
+    assert find_demographics("Age/Sex: 45 Y / F") == (SEX_FEMALE, 45.0)
+    assert find_demographics("Patient: John  Gender: Male") == (SEX_MALE, None)
+    assert find_demographics(format_demographics(SEX_MALE, 61)) == (SEX_MALE, 61.0)
+    assert format_demographics(SEX_ANY) == ""
+
+
+def test_evaluate_report_reads_the_patient_from_the_text():
+    evaluation = evaluate_report("\n".join(LAB_LINES))
+    assert (evaluation.table.sexes[0], evaluation.table.ages[0]) == (SEX_FEMALE, 45.0)
+    flagged = {evaluation.row(i)["marker"] for i in evaluation.flagged(0)}
+    assert flagged == {"hemoglobin", "glucose", "ldl", "vitamin_d"}
+
+
+def test_cohort_summary_counts_per_marker():
+    table = MarkerTable()
+    table.add_report("a", [_reading("glucose", 130, "mg/dL", 70, 99)])
+    table.add_report("b", [_reading("glucose", 60, "mg/dL", 70, 99)])
+    table.add_report("c", [_reading("glucose", 90, "mg/dL", 70, 99)])
+    summary = evaluate(table, ReferenceTable([])).cohort_summary()
+    glucose = summary["markers"]["glucose"]
+    assert (summary["reports"], summary["out_of_range"]) == (3, 2)
+    assert (glucose["readings"], glucose["low"], glucose["high"]) == (3, 1, 1)
+    assert glucose["out_of_range_rate"] == pytest.approx(0.667)
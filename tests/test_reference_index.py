@@ -0,0 +1,96 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import config
+import reference_index
+from reference_index import NO_MATCHES, ReferenceIndex, build_index, embed, load_corpus
+
+CORPUS = {
+    "markers.md": "# Markers\n\n## Hemoglobin\nHemoglobin carries oxygen; low values point to anaemia.\n\n"
+                  "## Ferritin\nFerritin reflects iron stores; low ferritin means depleted iron.\n",
+    "lipids.md": "# Lipids\n\n## LDL\nLDL cholesterol above 160 mg/dL raises cardiovascular risk.\n",
+}
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    directory = tmp_path / "corpus"
+    directory.mkdir()
+    for name, text in CORPUS.items():
+        (directory / name).write_text(text)
+    return str(directory)
+
+
+def _build(corpus: str, index_dir: str, **kwargs) -> dict:
+    return build_index(corpus, index_dir, seed_file="", **kwargs)
+
+
+def test_corpus_is_split_into_sections(corpus):
+    passages = load_corpus(corpus)
+    assert [(p["source"], p["title"]) for p in passages] == [
+        ("corpus/lipids.md", "LDL"), ("corpus/markers.md", "Hemoglobin"), ("corpus/markers.md", "Ferritin")]
+
+
+def test_embeddings_are_unit_length_and_fold_marker_synonyms():
+    vectors = embed(["Hgb is low", "haemoglobin is low", "LDL is high", ""], 256)
+    assert np.linalg.norm(vectors[0]) == pytest.approx(1.0)
+    assert float(vectors[0] @ vectors[1]) == pytest.approx(1.0)
+    assert float(vectors[0] @ vectors[2]) < 0.5
+    assert not vectors[3].any()
+
+
+def test_rebuild_embeds_only_changed_passages(corpus, tmp_path):
+    index_dir = str(tmp_path / "index")
+    first = _build(corpus, index_dir)
+    assert (first["passages"], first["embedded"], first["reused"]) == (3, 3, 0)
+    with open(f"{corpus}/lipids.md", "a") as f:
+        f.write("Fasting is not required for LDL testing.\n")
+    second = _build(corpus, index_dir)
+    assert (second["embedded"], second["reused"], second["generation"]) == (1, 2, 2)
+    assert _build(corpus, index_dir, full=True)["embedded"] == 3
+
+
+def test_lookup_ranks_the_matching_passage_first(corpus, tmp_path):
+    index_dir = str(tmp_path / "index")
+    _build(corpus, index_dir)
+    index = ReferenceIndex(index_dir, top_k=2, min_score=0.1)
+    results = index.lookup("what does a low HGB mean")
+    assert results[0]["title"] == "Hemoglobin"
+    assert results == sorted(results, key=lambda r: -r["score"])
+    assert "Ferritin reflects iron stores" in index.lookup_text("low ferritin", k=1)
+    assert index.lookup_text("zebra crossing") == NO_MATCHES
+    assert index.stats()["lookups"] == 3
+
+
+def test_a_new_generation_is_picked_up_on_the_next_lookup(corpus, tmp_path):
+    index_dir = str(tmp_path / "index")
+    _build(corpus, index_dir)
+    index = ReferenceIndex(index_dir)
+    assert index.open() == 3
+    (tmp_path / "corpus" / "thyroid.md").write_text("# Thyroid\n\n## TSH\nA high TSH suggests hypothyroidism.\n")
+    _build(corpus, index_dir)
+    assert index.lookup("high TSH")[0]["title"] == "TSH"
+    assert index.stats()["generation"] == 2
+
+
+def test_index_with_other_settings_is_rebuilt(corpus, tmp_path):
+    index_dir = str(tmp_path / "index")
+    _build(corpus, index_dir, dim=64)
+    index = ReferenceIndex(index_dir)
+    # Rebuilt from the bundled corpus at the configured dimension
+    index.open()
+    assert index._current[0].shape[1] == config.REFERENCE_INDEX_DIM
+
+
+def test_bundled_corpus_answers_marker_questions(tmp_path):
+    index = ReferenceIndex(str(tmp_path / "index"))
+    assert index.warm() > 0 and index.error is None
+    top = index.lookup("low ferritin meaning", k=1)[0]
+    assert "ferritin" in (top["title"] + top["text"]).lower()
+
+
+def test_lookup_failures_are_reported_to_the_agent(tmp_path, monkeypatch):
+    index = ReferenceIndex(str(tmp_path / "index"))
+    monkeypatch.setattr(reference_index, "build_index", lambda **kwargs: 1 / 0)
+    assert index.lookup_text("ferritin").startswith("Error: reference lookup failed")
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import threading
+import time
+
+import pytest
+
+from report_cache import ReportTextCache, file_sha256
+
+
+class Parser:
+    """parse_fn counting its calls; slow enough for concurrent readers to overlap."""
+
+    def __init__(self, seconds: float = 0.0):
+        self.seconds = seconds
+        self.calls = 0
+
+    def __call__(self, path: str) -> str:
+        self.calls += 1
+        time.sleep(self.seconds)
+        with open(path, "rb") as f:
+            return f"text of {f.read().decode()}"
+
+
+def _write(tmp_path, name: str, content: str) -> str:
+    path = tmp_path / name
+    path.write_text(content)
+    return str(path)
+
+
+def test_file_sha256_hashes_the_content(tmp_path):
+    path = _write(tmp_path, "a.pdf", "report")
+    assert file_sha256(path) == hashlib.sha256(b"report").hexdigest()
+
+
+def test_same_content_under_another_path_is_a_hit(tmp_path):
+    cache = ReportTextCache()
+    parse = Parser()
+    first = cache.get_or_parse(_write(tmp_path, "a.pdf", "report"), parse)
+    again = cache.get_or_parse(_write(tmp_path, "renamed.pdf", "report"), parse)
+    assert first == again == "text of report"
+    assert parse.calls == 1
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_different_content_is_a_miss(tmp_path):
+    cache = ReportTextCache()
+    parse = Parser()
+    cache.get_or_parse(_write(tmp_path, "a.pdf", "report"), parse)
+    assert cache.get_or_parse(_write(tmp_path, "b.pdf", "other report"), parse) == "text of other report"
+    assert parse.calls == 2
+
+
+def test_registered_digest_skips_hashing(tmp_path):
+    cache = ReportTextCache()
+    path = _write(tmp_path, "a.pdf", "report")
+    cache.put("known", "cached text")
+    cache.register_path(path, "known")
+    assert cache.get_or_parse(path, Parser()) == "cached text"
+    cache.forget_path(path)
+    assert cache.get_or_parse(path, Parser()) == "text of report"
+
+
+def test_concurrent_readers_share_one_parse(tmp_path):
+    cache = ReportTextCache()
+    parse = Parser(seconds=0.2)
+    path = _write(tmp_path, "a.pdf", "report")
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_parse(path, parse)))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert parse.calls == 1 and results == ["text of report"] * 4
+
+
+def test_failed_parse_is_not_cached(tmp_path):
+    cache = ReportTextCache()
+    path = _write(tmp_path, "a.pdf", "report")
+
+    def broken(path):
+        raise ValueError("corrupt")
+    with pytest.raises(ValueError):
+        cache.get_or_parse(path, broken)
+    assert cache.get_or_parse(path, Parser()) == "text of report"
+
+
+def test_disk_tier_survives_a_new_process_cache(tmp_path):
+    disk = str(tmp_path / "cache")
+    path = _write(tmp_path, "a.pdf", "report")
+    ReportTextCache(disk_dir=disk).get_or_parse(path, Parser())
+    parse = Parser()
+    assert ReportTextCache(disk_dir=disk).get_or_parse(path, parse) == "text of report"
+    assert parse.calls == 0
+
+
+def test_memory_tier_keeps_the_most_recently_used(tmp_path):
+    cache = ReportTextCache(max_entries=2)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    cache.get("a")
+    cache.put("c", "C")
+    assert cache.get("b") is None
+    assert cache.get("a") == "A" and cache.get("c") == "C"
+
+
+def test_disk_tier_is_walked_only_when_over_its_size_cap(tmp_path, monkeypatch):
+    walks = []
+    real_walk = os.walk
+
+    def counting_walk(top):
+        walks.append(top)
+        return real_walk(top)
+    monkeypatch.setattr(os, "walk", counting_walk)
+    cache = ReportTextCache(disk_dir=str(tmp_path / "cache"), disk_max_bytes=250)
+    # The first write sweeps once to learn the size of what is already there
+    for index in range(4):
+        cache.put(f"{index:064x}", "x" * 50)
+    assert len(walks) == 1
+    # The sixth entry takes the tier over 250 bytes; the sweep drops the oldest
+    cache.put(f"{4:064x}", "x" * 50)
+    assert len(walks) == 1
+    cache.put(f"{5:064x}", "x" * 50)
+    assert len(walks) == 2
+    cache.clear()
+    remaining = [index for index in range(6) if cache.get(f"{index:064x}") is not None]
+    assert len(remaining) == 5 and 5 in remaining
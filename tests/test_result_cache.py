@@ -0,0 +1,87 @@
+import sqlite3
+import time
+
+import pytest
+
+from result_cache import MemoryBackend, ResultCache, SQLiteBackend, make_key
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend_factory(request, tmp_path):
+    def make(max_entries: int = 8, ttl: float = 0):
+        if request.param == "memory":
+            return MemoryBackend(max_entries, ttl)
+        return SQLiteBackend(str(tmp_path / "results.sqlite3"), max_entries, ttl)
+    return make
+
+
+def test_key_follows_normalized_query_tasks_definitions_and_context():
+    key = make_key("hash", "Summarise my report.", ["summary"], "defs")
+    assert key == make_key("hash", "  summarise my   REPORT ", ["summary"], "defs")
+    assert key != make_key("hash", "Summarise my report.", ["summary", "nutrition"], "defs")
+    assert key != make_key("hash", "Summarise my report.", ["summary"], "other defs")
+    assert key != make_key("hash", "Summarise my report.", ["summary"], "defs", "LDL up since March")
+    assert key != make_key("other hash", "Summarise my report.", ["summary"], "defs")
+
+
+def test_hits_and_misses_are_counted(backend_factory):
+    cache = ResultCache(backend_factory())
+    assert cache.get("k") is None
+    cache.put("k", {"analysis": "fine"})
+    assert cache.get("k") == {"analysis": "fine"}
+    assert cache.stats() == {**cache.stats(), "entries": 1, "hits": 1, "misses": 1}
+
+
+def test_entries_expire_after_the_ttl(backend_factory):
+    backend = backend_factory(ttl=0.05)
+    backend.put("k", {"analysis": "fine"})
+    time.sleep(0.1)
+    assert backend.get("k") is None
+    assert len(backend) == 0
+
+
+def test_least_recently_used_entry_is_evicted(backend_factory):
+    backend = backend_factory(max_entries=2)
+    backend.put("a", {"n": 1})
+    time.sleep(0.01)
+    backend.put("b", {"n": 2})
+    time.sleep(0.01)
+    backend.get("a")
+    time.sleep(0.01)
+    backend.put("c", {"n": 3})
+    assert backend.get("b") is None
+    assert backend.get("a") == {"n": 1} and backend.get("c") == {"n": 3}
+
+
+def test_disabled_cache_stores_nothing():
+    cache = ResultCache(None)
+    cache.put("k", {"analysis": "fine"})
+    assert cache.get("k") is None
+    assert cache.stats()["entries"] == 0 and cache.stats()["misses"] == 0
+
+
+def test_sqlite_backend_closes_every_connection(monkeypatch, tmp_path):
+    opened = []
+    connect = sqlite3.connect
+
+    def tracking_connect(*args, **kwargs):
+        conn = connect(*args, **kwargs)
+        opened.append(conn)
+        return conn
+    monkeypatch.setattr(sqlite3, "connect", tracking_connect)
+
+    backend = SQLiteBackend(str(tmp_path / "results.sqlite3"), 8, 0)
+    backend.put("k", {"analysis": "fine"})
+    backend.get("k")
+    backend.get("missing")
+    len(backend)
+    assert len(opened) == 5
+    for conn in opened:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+
+
+def test_sqlite_backend_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "results.sqlite3")
+    SQLiteBackend(path, 8, 0).put("k", {"analysis": "fine"})
+    assert SQLiteBackend(path, 8, 0).get("k") == {"analysis": "fine"}
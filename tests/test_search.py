@@ -0,0 +1,180 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import search
+from deadlines import Deadline, deadline_scope
+from governor import RateGovernor
+from search import SearchService, normalize_query
+
+
+class StubSerper:
+    """Local Serper stand-in: POST /search with one {"q": ...} object or a list of them."""
+
+    def __init__(self):
+        self.requests = []
+        self.delay = 0.0
+        self.status = 200
+        self.drop_one = False
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                stub.requests.append(payload)
+                time.sleep(stub.delay)
+                queries = payload if isinstance(payload, list) else [payload]
+                answers = [{"organic": [{"title": q["q"], "link": "https://example.org", "snippet": "ok"}]}
+                           for q in queries]
+                if stub.drop_one:
+                    answers = answers[1:]
+                body = json.dumps(answers if isinstance(payload, list) else answers[0]).encode("utf-8")
+                self.send_response(stub.status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    # The stub is free; do not spend the real search budget
+    monkeypatch.setattr(search.rate_governor, "acquire", lambda *args, **kwargs: 0.0)
+    server = StubSerper()
+    yield server
+    server.close()
+
+
+def test_normalize_query_ignores_case_punctuation_stopwords_and_order():
+    assert normalize_query("What is the normal Vitamin D range?") == "d normal range vitamin"
+    assert normalize_query("vitamin D normal range") == "d normal range vitamin"
+    assert normalize_query("the") == "the"
+
+
+def test_repeated_queries_are_served_from_the_cache(stub):
+    service = SearchService(stub.url)
+    first = service.search("normal ferritin range")
+    assert "Title: normal ferritin range" in first
+    assert service.search("Ferritin normal range?") == first
+    assert len(stub.requests) == 1
+    assert service.stats()["hits"] == 1 and service.stats()["misses"] == 1
+
+
+def test_search_many_sends_misses_in_one_batch(stub):
+    service = SearchService(stub.url)
+    service.search("ldl target")
+    results = service.search_many(["ldl target", "hba1c range", "tsh range", "HbA1c range"])
+    assert stub.requests[-1] == [{"q": "hba1c range"}, {"q": "tsh range"}]
+    assert results[1] == results[3]
+    assert len(stub.requests) == 2
+
+
+def test_concurrent_identical_queries_share_one_request(stub):
+    stub.delay = 0.3
+    service = SearchService(stub.url)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(service.search("iron deficiency")))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(stub.requests) == 1
+    assert len(set(results)) == 1
+    assert service.stats()["coalesced"] == 3
+
+
+def test_results_expire_after_the_ttl(stub):
+    service = SearchService(stub.url, ttl=0.1)
+    service.search("b12 range")
+    time.sleep(0.15)
+    service.search("b12 range")
+    assert len(stub.requests) == 2
+
+
+def test_seeded_answers_never_expire_and_skip_the_network(stub, tmp_path):
+    seed = tmp_path / "seed.json"
+    seed.write_text(json.dumps([{"queries": ["normal glucose range"], "result": "Seeded glucose"}]))
+    service = SearchService(stub.url, ttl=0.01)
+    assert service.seed(str(seed)) == 1
+    time.sleep(0.02)
+    assert service.search("Glucose range, normal") == "Seeded glucose"
+    assert stub.requests == []
+
+
+def test_unreadable_seed_file_loads_nothing(tmp_path):
+    (tmp_path / "bad.json").write_text("{not json")
+    service = SearchService("http://127.0.0.1:9")
+    assert service.seed(str(tmp_path / "bad.json")) == 0
+    assert service.seed(str(tmp_path / "missing.json")) == 0
+
+
+def test_offline_answers_seeded_queries_then_the_local_index(stub, tmp_path):
+    seed = tmp_path / "seed.json"
+    seed.write_text(json.dumps([{"queries": ["normal glucose range"], "result": "Seeded glucose"}]))
+    service = SearchService(stub.url, offline=True, local_lookup=lambda query: f"Local: {query}")
+    service.seed(str(seed))
+    assert service.search("normal glucose range") == "Seeded glucose"
+    assert service.search("ferritin") == "Local: ferritin"
+    assert stub.requests == []
+    assert service.stats()["local_answers"] == 1
+
+
+def test_failed_local_lookup_returns_an_error_and_does_not_hang(stub):
+    def lookup(query):
+        raise RuntimeError("index unavailable")
+    service = SearchService(stub.url, offline=True, local_lookup=lookup)
+    assert service.search("ferritin") == "Error: local lookup failed: index unavailable"
+    assert service._inflight == {}
+
+
+@pytest.mark.parametrize("break_stub", [
+    lambda stub: setattr(stub, "status", 500),
+    lambda stub: setattr(stub, "drop_one", True),
+])
+def test_failed_requests_are_reported_and_not_cached(stub, break_stub):
+    service = SearchService(stub.url)
+    break_stub(stub)
+    assert service.search("cortisol").startswith("Error: search failed")
+    assert service._inflight == {}
+    stub.status, stub.drop_one = 200, False
+    assert "Title: cortisol" in service.search("cortisol")
+    assert len(stub.requests) == 2
+
+
+def test_unreachable_server_returns_an_error():
+    service = SearchService("http://127.0.0.1:9", timeout=1.0)
+    assert service.search("ferritin").startswith("Error: search failed")
+
+
+def test_waiting_on_a_stuck_identical_search_stops_at_the_deadline():
+    service = SearchService("http://127.0.0.1:9")
+    # Another caller's fetch of the same query never finishes
+    service._inflight[normalize_query("ferritin")] = search.Future()
+    with deadline_scope(Deadline(0.1)):
+        assert service.search("ferritin").startswith("Error: search timed out")
+
+
+def test_rate_limited_search_stops_at_the_deadline(monkeypatch):
+    monkeypatch.setattr(search, "rate_governor", RateGovernor({"search": (1, 0)}))
+    search.rate_governor.acquire("search")
+    service = SearchService("http://127.0.0.1:9")
+    started = time.monotonic()
+    with deadline_scope(Deadline(0.2)):
+        assert service.search("ferritin").startswith("Error: search timed out: Deadline of 0.2s exceeded")
+    assert time.monotonic() - started < 1
+    assert service._inflight == {}
@@ -0,0 +1,78 @@
+import os
+import subprocess
+import sys
+
+import main
+import reference_eval
+import reference_index
+from conftest import ROOT
+from startup import Startup, WARMUP_READY, WARMUP_FAILED
+
+
+def _python(code: str) -> subprocess.CompletedProcess:
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([ROOT, os.environ.get("PYTHONPATH", "")])}
+    return subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True)
+
+
+def test_importing_main_leaves_the_crew_stack_unloaded():
+    run = _python("import sys, main; print(sorted(m for m in ('crewai', 'crewai_tools', 'langchain_community', "
+                  "'agents', 'task', 'tools') if m in sys.modules))")
+    assert run.returncode == 0, run.stderr
+    assert run.stdout.strip().splitlines()[-1] == "[]"
+
+
+def test_importing_main_leaves_numpy_unloaded():
+    run = _python("import sys, main; print('numpy' in sys.modules)")
+    assert run.returncode == 0, run.stderr
+    assert run.stdout.strip().splitlines()[-1] == "False"
+
+
+def test_tools_without_crewai_tools_fail_with_a_clear_message():
+    run = _python("import sys; sys.modules['crewai_tools'] = None; import tools")
+    assert run.returncode != 0
+    assert "ImportError: tools.py needs crewai_tools" in run.stderr
+
+
+def test_failing_step_marks_warmup_failed():
+    startup = Startup()
+
+    def broken():
+        raise RuntimeError("no crewai")
+    startup.run_warmup([("ok", lambda: None), ("broken", broken), ("never", lambda: None)])
+    assert startup.state == WARMUP_FAILED
+    assert startup.error == "broken: no crewai"
+    assert "never" not in startup.phases
+
+
+def test_warmup_reaches_ready_without_numpy(monkeypatch, tmp_path):
+    for module in (reference_index, reference_eval):
+        monkeypatch.setattr(module, "np", None)
+        monkeypatch.setattr(module, "_numpy_checked", True)
+    monkeypatch.setattr(reference_eval, "_reference_table", None)
+    monkeypatch.setattr(main.reference_index, "index_dir", str(tmp_path / "index"))
+    monkeypatch.setattr(main.reference_index, "error", None)
+    startup = Startup()
+    startup.run_warmup(main.WARMUP_STEPS)
+    assert startup.state == WARMUP_READY, startup.error
+    assert startup.ready
+    stats = main.reference_index.stats()
+    assert stats["available"] is False
+    assert "numpy" in stats["error"]
+
+
+def test_unwritable_index_dir_does_not_fail_warmup(tmp_path):
+    blocker = tmp_path / "not-a-directory"
+    blocker.write_text("x")
+    index = reference_index.ReferenceIndex(str(blocker / "index"))
+    startup = Startup()
+    startup.run_warmup([("reference_index", index.warm)])
+    assert startup.state == WARMUP_READY
+    assert index.stats()["available"] is False
+    assert index.lookup_text("glucose").startswith("Error")
+
+
+def test_ready_endpoint_follows_warmup_state(client, monkeypatch):
+    monkeypatch.setattr(main.startup, "state", WARMUP_FAILED)
+    assert client.get("/ready").status_code == 503
+    monkeypatch.setattr(main.startup, "state", WARMUP_READY)
+    assert client.get("/ready").status_code == 200
@@ -0,0 +1,57 @@
+import asyncio
+import json
+import threading
+
+from streaming import EventChannel, format_ndjson, format_sse
+
+
+def _events(body: str) -> list:
+    """(event, data) pairs of an SSE response body."""
+    events = []
+    for frame in body.strip().split("\n\n"):
+        event, data = frame.split("\n")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def test_format_sse_and_ndjson():
+    frame = format_sse("task", {"text": "line one\nline two"})
+    assert frame.startswith("event: task\ndata: ") and frame.endswith("\n\n")
+    assert frame.count("\n") == 3
+    assert _events(frame) == [("task", {"text": "line one\nline two"})]
+    assert format_ndjson({"n": 1}) == '{"n": 1}\n'
+
+
+def test_channel_carries_events_from_worker_threads():
+    async def consume():
+        channel = EventChannel(asyncio.get_running_loop())
+        threads = [threading.Thread(target=channel.emit, args=("step", n)) for n in range(3)]
+        for thread in threads:
+            thread.start()
+        return sorted([(await channel.get())[1] for _ in threads])
+
+    assert asyncio.run(consume()) == [0, 1, 2]
+
+
+def test_emit_after_the_loop_closed_is_dropped():
+    loop = asyncio.new_event_loop()
+    channel = EventChannel(loop)
+    loop.close()
+    channel.emit("result", {})
+
+
+def test_stream_endpoint_sends_progress_then_the_result(client, lab_pdf):
+    response = client.post("/analyze/stream", files={"file": ("r.pdf", lab_pdf, "application/pdf")},
+                           data={"tasks": "summary", "query": "Stream it"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = _events(response.text)
+    names = [event for event, _ in events]
+    assert names[:4] == ["upload", "preverification", "queued", "parsed"]
+    assert "findings" in names and "task" in names
+    assert names[-1] == "result"
+    assert names.index("task") < names.index("result")
+    data = dict(events)
+    assert data["upload"]["file"] == "r.pdf"
+    assert data["queued"]["coalesced"] is False
+    assert data["result"]["status"] == "success"
@@ -0,0 +1,109 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from deadlines import Deadline, DeadlineExceeded, current_deadline, deadline_scope
+from observability import current_request_id, request_scope
+from tool_bridge import call_sync, run_blocking, timed, tool_metrics
+
+
+async def _answer(value, delay: float = 0.0):
+    await asyncio.sleep(delay)
+    return value
+
+
+def test_call_sync_returns_the_result_not_a_coroutine():
+    assert call_sync(_answer("ok")) == "ok"
+
+
+def test_call_sync_works_from_many_threads_and_inside_a_running_loop():
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda n: call_sync(_answer(n, 0.05)), range(16)))
+    assert results == list(range(16))
+
+    async def caller():
+        # A sync tool called from code that already runs an event loop
+        return call_sync(_answer("nested"))
+    assert asyncio.run(caller()) == "nested"
+
+
+def test_call_sync_refuses_to_block_the_tool_loop():
+    async def reentrant():
+        return call_sync(_answer("never"))
+    with pytest.raises(RuntimeError, match="cannot be used from the tool loop"):
+        call_sync(reentrant())
+
+
+def test_tool_coroutines_see_the_callers_request_and_deadline():
+    async def context():
+        return current_request_id(), current_deadline()
+    deadline = Deadline(30)
+    with request_scope("req-7"), deadline_scope(deadline):
+        assert call_sync(context()) == ("req-7", deadline)
+
+
+def test_call_sync_stops_at_the_deadline():
+    cancelled = threading.Event()
+
+    async def slow():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+    started = time.monotonic()
+    with deadline_scope(Deadline(0.2)), pytest.raises(DeadlineExceeded):
+        call_sync(slow())
+    assert time.monotonic() - started < 1
+    assert cancelled.wait(1)
+
+
+def test_run_blocking_keeps_the_request_context():
+    def blocking():
+        return current_request_id(), threading.current_thread().name
+    with request_scope("req-8"):
+        request_id, thread_name = call_sync(run_blocking(blocking))
+    assert request_id == "req-8" and thread_name.startswith("tool-blocking")
+
+
+def test_timed_records_calls_and_errors():
+    tool_metrics.reset()
+
+    @timed("demo_sync")
+    def sync_tool(fail: bool = False):
+        return "Error: no report" if fail else "fine"
+
+    @timed("demo_async")
+    async def async_tool():
+        raise ValueError("broken")
+
+    sync_tool()
+    sync_tool(fail=True)
+    with pytest.raises(ValueError):
+        call_sync(async_tool())
+    stats = tool_metrics.snapshot()
+    assert (stats["demo_sync"]["calls"], stats["demo_sync"]["errors"]) == (2, 1)
+    assert (stats["demo_async"]["calls"], stats["demo_async"]["errors"]) == (1, 1)
+
+
+def test_timed_tools_do_not_run_after_the_deadline():
+    ran = []
+
+    @timed("demo_late")
+    def late_tool():
+        ran.append(True)
+    deadline = Deadline(0)
+    deadline.cancel()
+    with deadline_scope(deadline), pytest.raises(DeadlineExceeded):
+        late_tool()
+    assert ran == []
+
+
+def test_report_reader_returns_text_through_the_bridge(lab_pdf_path):
+    from tools import BloodTestReportTool
+    markers = call_sync(BloodTestReportTool.read_markers_tool(lab_pdf_path))
+    assert isinstance(markers, str)
+    assert "Glucose: 110 mg/dL (ref 70-99) high" in markers
@@ -0,0 +1,48 @@
+import asyncio
+import hashlib
+import os
+import time
+
+import pytest
+
+from upload_buffers import UploadBufferRegistry, discard_upload, is_memory_handle, read_head, upload_buffers
+from conftest import FakeUpload
+from uploads import store_upload
+
+
+def test_small_upload_stays_in_memory_with_its_hash(tmp_path):
+    dest = str(tmp_path / "report.pdf")
+    upload = asyncio.run(store_upload(FakeUpload(b"%PDF-1.4 small"), dest, memory_threshold=1024))
+    try:
+        assert upload.in_memory and not os.path.exists(dest)
+        assert upload.sha256 == hashlib.sha256(b"%PDF-1.4 small").hexdigest()
+        assert upload.size == 14 and upload.filename == "report.pdf"
+        assert read_head(upload.path, 8) == b"%PDF-1.4"
+    finally:
+        discard_upload(upload.path)
+    assert not upload_buffers.contains(upload.path)
+
+
+def test_buffers_are_reference_counted():
+    registry = UploadBufferRegistry(max_bytes=100)
+    handle = registry.put(b"%PDF data", "digest", "r.pdf")
+    assert is_memory_handle(handle)
+    registry.acquire(handle)
+    view = registry.view(handle)
+    assert not registry.release(handle)
+    assert registry.release(handle)
+    assert not registry.contains(handle)
+    # A reader's view outlives the eviction
+    assert bytes(view) == b"%PDF data"
+    with pytest.raises(KeyError):
+        registry.data(handle)
+
+
+def test_full_registry_spills_and_idle_buffers_expire():
+    registry = UploadBufferRegistry(max_bytes=10, idle_ttl=0.05)
+    first = registry.put(b"12345678", "a")
+    assert registry.put(b"12345", "b") is None
+    assert registry.stats()["spilled_to_disk"] == 1
+    time.sleep(0.1)
+    assert registry.sweep() == 1
+    assert not registry.contains(first) and registry.stats()["bytes"] == 0
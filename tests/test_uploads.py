@@ -0,0 +1,78 @@
+import asyncio
+import hashlib
+import io
+import os
+import zipfile
+
+import pytest
+
+import config
+from conftest import FakeUpload
+from upload_buffers import discard_upload
+from uploads import UploadTooLargeError, extract_zip_reports, is_zip_upload, store_upload
+
+
+def _store(data: bytes, dest: str, **kwargs):
+    return asyncio.run(store_upload(FakeUpload(data), dest, chunk_size=4, **kwargs))
+
+
+def test_large_upload_is_spooled_to_disk(tmp_path):
+    dest = str(tmp_path / "report.pdf")
+    data = b"%PDF" + b"x" * 100
+    upload = _store(data, dest, memory_threshold=10)
+    assert upload.path == dest and not upload.in_memory
+    with open(dest, "rb") as f:
+        assert f.read() == data
+    assert upload.sha256 == hashlib.sha256(data).hexdigest()
+    assert os.listdir(tmp_path) == ["report.pdf"]
+
+
+def test_upload_over_the_limit_leaves_nothing_behind(tmp_path):
+    dest = str(tmp_path / "report.pdf")
+    with pytest.raises(UploadTooLargeError):
+        _store(b"x" * 100, dest, max_bytes=50, memory_threshold=10)
+    assert os.listdir(tmp_path) == []
+
+
+def test_analyze_rejects_a_too_large_upload(client, monkeypatch, lab_pdf):
+    monkeypatch.setattr(config, "UPLOAD_MAX_BYTES", 100)
+    response = client.post("/analyze", files={"file": ("r.pdf", lab_pdf, "application/pdf")})
+    assert response.status_code == 413
+    assert not os.path.isdir(config.UPLOAD_DIR) or os.listdir(config.UPLOAD_DIR) == []
+
+
+def _zip(members: dict) -> bytes:
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w") as archive:
+        for name, content in members.items():
+            archive.writestr(name, content)
+    return data.getvalue()
+
+
+def test_zip_reports_are_unpacked_and_hashed(tmp_path):
+    archive = tmp_path / "batch.zip"
+    archive.write_bytes(_zip({"a.pdf": b"%PDF a", "notes.txt": b"skip", "__MACOSX/a.pdf": b"skip",
+                              "dir/b.PDF": b"%PDF b" * 10}))
+    stored = extract_zip_reports(str(archive), str(tmp_path), memory_threshold=8)
+    try:
+        assert [upload.filename for upload in stored] == ["a.pdf", "dir/b.PDF"]
+        assert stored[0].in_memory and not stored[1].in_memory
+        assert stored[1].sha256 == hashlib.sha256(b"%PDF b" * 10).hexdigest()
+    finally:
+        for upload in stored:
+            discard_upload(upload.path)
+
+
+def test_zip_limits_are_enforced(tmp_path):
+    archive = tmp_path / "batch.zip"
+    archive.write_bytes(_zip({"a.pdf": b"%PDF a", "b.pdf": b"%PDF b" * 100}))
+    with pytest.raises(ValueError, match="more than the limit of 1"):
+        extract_zip_reports(str(archive), str(tmp_path), max_files=1)
+    with pytest.raises(UploadTooLargeError):
+        extract_zip_reports(str(archive), str(tmp_path), max_bytes=100, memory_threshold=0)
+    assert sorted(os.listdir(tmp_path)) == ["batch.zip"]
+    (tmp_path / "broken.zip").write_bytes(b"not a zip")
+    with pytest.raises(ValueError, match="Not a valid zip"):
+        extract_zip_reports(str(tmp_path / "broken.zip"), str(tmp_path))
+    assert is_zip_upload("reports.ZIP") and is_zip_upload("x", "application/zip")
+    assert not is_zip_upload("report.pdf", "application/pdf")
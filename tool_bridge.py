@@ -0,0 +1,149 @@
+## Bridge between async tool implementations and CrewAI's sync tool interface
+# The tool implementations in tools.py are async, but CrewAI calls @tool
+# functions synchronously. Returning the coroutine handed agents an un-awaited
+# object; spinning up asyncio.run() per call is slow. Instead one background
+# event loop runs every tool coroutine, and blocking work (PDF parsing) is
+# pushed to a bounded executor so it never stalls that loop. Tool calls stop
+# at the request's deadline (see deadlines.py).
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import config
+from deadlines import current_deadline, bind_deadline, check_deadline, remaining_time
+from observability import span, bind_context, coroutine_in_context, TOOL_CALLS, TOOL_ERRORS
+
+_executor = ThreadPoolExecutor(max_workers=max(1, config.TOOL_MAX_CONCURRENCY), thread_name_prefix="tool-blocking")
+_loop = None
+_loop_thread = None
+_loop_lock = threading.Lock()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """Starts (once) and returns the background loop that runs tool coroutines."""
+    global _loop, _loop_thread
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(target=_loop.run_forever, name="tool-loop", daemon=True)
+            _loop_thread.start()
+    return _loop
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Runs a blocking callable on the bounded tool executor and awaits its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, bind_context(functools.partial(fn, *args, **kwargs)))
+
+
+def call_sync(coro, timeout: float = None):
+    """Runs a coroutine on the background tool loop and blocks until it finishes.
+
+    Safe to call from CrewAI worker threads and from inside another running
+    loop's thread; must not be called from a coroutine on the tool loop itself.
+    The wait ends at the caller's deadline, which also cancels the coroutine.
+
+    Raises:
+        DeadlineExceeded: If the request's deadline passes first.
+    """
+    loop = _get_loop()
+    if threading.current_thread() is _loop_thread:
+        coro.close()
+        raise RuntimeError("call_sync() cannot be used from the tool loop; await the coroutine instead")
+    # The loop's tasks would otherwise lose the caller's request id, spans and deadline
+    coro = bind_deadline(coro, current_deadline())
+    future = asyncio.run_coroutine_threadsafe(coroutine_in_context(coro), loop)
+    try:
+        return future.result(remaining_time(timeout))
+    except FutureTimeoutError:
+        future.cancel()
+        check_deadline()
+        raise
+
+
+class ToolMetrics:
+    """Per-tool call counts, errors and latency."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, name: str, seconds: float, error: bool = False):
+        with self._lock:
+            stats = self._stats.setdefault(name, {
+                "calls": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0, "last_seconds": 0.0,
+            })
+            stats["calls"] += 1
+            stats["errors"] += int(error)
+            stats["total_seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+            stats["last_seconds"] = seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                name: {**stats, "avg_seconds": stats["total_seconds"] / stats["calls"] if stats["calls"] else 0.0}
+                for name, stats in self._stats.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+tool_metrics = ToolMetrics()
+
+
+def _record_call(name: str, seconds: float, error: bool, attributes: dict):
+    tool_metrics.record(name, seconds, error)
+    TOOL_CALLS.inc(tool=name)
+    if error:
+        TOOL_ERRORS.inc(tool=name)
+        attributes["error"] = True
+
+
+def timed(name: str):
+    """Decorator recording every call under `name` (sync or async).
+
+    Each call is a "tool.<name>" span and counts towards the tool call/error
+    metrics; results starting with "Error" count as errors. Calls made after
+    the request's deadline raise DeadlineExceeded without running.
+    """
+    def decorator(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                check_deadline()
+                with span(f"tool.{name}") as attributes:
+                    start = time.perf_counter()
+                    error = False
+                    try:
+                        result = await fn(*args, **kwargs)
+                        error = isinstance(result, str) and result.startswith("Error")
+                        return result
+                    except Exception:
+                        error = True
+                        raise
+                    finally:
+                        _record_call(name, time.perf_counter() - start, error, attributes)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            check_deadline()
+            with span(f"tool.{name}") as attributes:
+                start = time.perf_counter()
+                error = False
+                try:
+                    result = fn(*args, **kwargs)
+                    error = isinstance(result, str) and result.startswith("Error")
+                    return result
+                except Exception:
+                    error = True
+                    raise
+                finally:
+                    _record_call(name, time.perf_counter() - start, error, attributes)
+        return wrapper
+    return decorator
@@ -8,23 +8,57 @@ load_dotenv()
 # If not, you might need to install and import from a library like langchain.document_loaders
 # For this correction, I'll assume it's a separate import if not directly from crewai_tools.
 try:
-    from crewai_tools import SerperDevTool # Direct import if available
+    from crewai_tools import tool # Direct import if available
     # If PDFLoader is also directly under crewai_tools or crewai_tools.tools
     # from crewai_tools.tools.pdf_loader_tool import PDFLoader as PDFLoaderTool # Example if it exists
+except ImportError as e:
+    # Every tool below is declared with @tool; without it this module is unusable
+    raise ImportError("tools.py needs crewai_tools for its agent tools: pip install crewai-tools") from e
+
+# For PDF loading, a common library is langchain; the report tools fall back
+# to it when pypdf is missing
+try:
+    from langchain_community.document_loaders import PyPDFLoader as PDFLoader
 except ImportError:
-    print("crewai_tools or its specific components not found. Ensure it's installed correctly.")
-    # Fallback or alternative imports if crewai_tools doesn't provide them
-    # For PDF loading, a common library is langchain
-    try:
-        from langchain_community.document_loaders import PyPDFLoader as PDFLoader
-    except ImportError:
-        print("PyPDFLoader from langchain_community not found. Please install it: pip install langchain-community pypdf")
-        PDFLoader = None # Set to None to indicate it's not available
+    print("PyPDFLoader from langchain_community not found. Please install it: pip install langchain-community pypdf")
+    PDFLoader = None # Set to None to indicate it's not available
+
+import config
+from report_cache import report_cache
+from upload_buffers import report_exists
+from markers import extract_markers, format_markers, FLAG_LOW, FLAG_HIGH
+from reference_eval import evaluate_report, find_demographics, format_demographics
+from tool_bridge import run_blocking, call_sync, timed
+import pdf_extract
+from compaction import compact_report
+from search import search_service
+from reference_index import reference_index
+
+# Text extraction needs pypdf, or the langchain loader as a fallback
+PDF_SUPPORT = pdf_extract.PdfReader is not None or PDFLoader is not None
 
 
 ## Creating search tool
-# No change needed here if SerperDevTool is imported correctly
-search_tool = SerperDevTool()
+# Goes through search.py: normalized queries, TTL cache, single-flight and
+# batching; remote calls count against the governor's "search" budget.
+@tool("Search the internet")
+@timed("search_tool")
+def search_tool(search_query: str) -> str:
+    """Searches the internet with Serper and returns the top results for a query."""
+    return search_service.search(search_query)
+
+## Creating medical reference lookup tool
+# Top-k passages of the bundled reference corpus from the memory-mapped index
+# in reference_index.py: no network, same answer every run.
+@tool("Medical Reference Lookup")
+@timed("reference_lookup_tool")
+def lookup_reference(query: str) -> str:
+    """Looks up blood marker definitions, reference ranges and clinical guideline passages in the
+    local medical reference. Instant and offline; use it before searching the internet."""
+    return reference_index.lookup_text(query)
+
+# What agents get for backing up their claims; offline mode never hands out web search
+reference_tools = [lookup_reference] if config.SEARCH_OFFLINE else [lookup_reference, search_tool]
 
 ## Creating custom pdf reader tool
 # CrewAI tools often expect a specific structure, usually inheriting from BaseTool or using tool decorator.
@@ -32,111 +66,224 @@ search_tool = SerperDevTool()
 # To make it a proper CrewAI tool, you'd typically subclass `BaseTool` and define `_run`.
 # For the purpose of correcting the function, I'll make it a regular async method.
 
+def parse_pdf_text(path: str) -> str:
+    """Extracts and cleans the text of every page of a PDF (no caching).
+
+    Large reports are parsed page-parallel on a process pool (see pdf_extract.py).
+
+    Raises:
+        Exception: Whatever the PDF parser raises for unreadable files.
+    """
+    return pdf_extract.extract_text(path)
+
 class BloodTestReportTool:
     # It's better to pass the loader instance or ensure PDFLoader is robustly imported
     # and handle potential file not found errors.
     
     @staticmethod # Use staticmethod if it doesn't need 'self'
-    async def read_data_tool(path: str = 'data/sample.pdf') -> str:
+    @timed("read_data_tool")
+    async def read_data_tool(path: str = 'data/sample.pdf', file_hash: str = None) -> str:
         """Tool to read data from a pdf file from a path
 
+        The extracted text is cached by the SHA-256 of the file bytes, so the same
+        document is only parsed once per process no matter how many tools read it.
+        Parsing is blocking, so it runs on the bounded tool executor.
+
         Args:
-            path (str, optional): Path of the pdf file. Defaults to 'data/sample.pdf'.
+            path (str, optional): Path of the pdf file or an in-memory upload handle
+                (see upload_buffers.py). Defaults to 'data/sample.pdf'.
+            file_hash (str, optional): SHA-256 of the file, if already known.
 
         Returns:
             str: Full Blood Test report file
         """
-        if not PDFLoader:
+        if not PDF_SUPPORT:
             return "Error: PDFLoader is not available. Please install necessary libraries."
 
-        if not os.path.exists(path):
+        if not report_exists(path):
             return f"Error: File not found at path: {path}"
 
         try:
-            docs = PDFLoader(file_path=path).load()
+            text = await run_blocking(report_cache.get_or_parse, path, parse_pdf_text, digest=file_hash)
         except Exception as e:
             return f"Error loading PDF from {path}: {e}"
+        if not text.strip():
+            # A scan that OCR could not read (see ocr.py); don't let agents reason over nothing
+            return f"Error: No readable text in {path} (scanned report without usable OCR)"
+        return text
+
+    @staticmethod
+    @timed("read_compact_tool")
+    async def read_compact_tool(path: str = 'data/sample.pdf', file_hash: str = None, token_budget: int = None) -> str:
+        """Tool returning the report compacted for an agent prompt (see compaction.py).
+
+        Marker tables become compact rows, text repeated across pages is kept
+        once and the rest is truncated to the token budget.
+        """
+        text = await BloodTestReportTool.read_data_tool(path, file_hash)
+        if text.startswith("Error"):
+            return text
+        return compact_report(text, token_budget).text
 
-        full_report = ""
-        for data in docs:
-            # Clean and format the report data
-            content = data.page_content
-            
-            # Remove extra whitespaces and format properly
-            # Using regex for more efficient whitespace handling
-            import re
-            content = re.sub(r'\s+', ' ', content).strip() # Replace multiple whitespaces with single space and strip
-            content = content.replace(" \n", "\n").replace("\n ", "\n") # Handle spaces around newlines
-            
-            full_report += content + "\n"
-            
-        return full_report
-
-## Creating Nutrition Analysis Tool
-class NutritionTool:
-    # Corrected method signature and example of where to add analysis logic.
     @staticmethod
-    async def analyze_nutrition_tool(blood_report_data: str) -> str:
-        """Analyzes the provided blood report data for nutritional insights.
+    @timed("read_markers_tool")
+    async def read_markers_tool(path: str = 'data/sample.pdf', file_hash: str = None) -> str:
+        """Tool returning the report's lab markers as compact rows (see read_report_markers)."""
+        return await run_blocking(read_report_markers, path, file_hash)
+
+def read_report_markers(path: str = 'data/sample.pdf', file_hash: str = None) -> str:
+    """Reads a PDF report and returns its lab markers as compact rows.
+
+    Uses the same cached text as read_data_tool, then the deterministic marker
+    parser, so agents get a few lines instead of the full report. The patient's
+    sex and age, if the report prints them, come first so the Reference Range
+    Evaluator can pick the matching ranges from the rows alone.
+    """
+    if not PDF_SUPPORT:
+        return "Error: PDFLoader is not available. Please install necessary libraries."
+    if not report_exists(path):
+        return f"Error: File not found at path: {path}"
+    try:
+        text = report_cache.get_or_parse(path, parse_pdf_text, digest=file_hash)
+    except Exception as e:
+        return f"Error loading PDF from {path}: {e}"
+    rows = format_markers(extract_markers(text))
+    patient = format_demographics(*find_demographics(text))
+    return f"{patient}\n{rows}" if patient else rows
+
+# (marker, flag) -> dietary note
+NUTRITION_GUIDANCE = {
+    ("hemoglobin", FLAG_LOW): "Low hemoglobin: include iron-rich foods (legumes, leafy greens, lean red meat) with vitamin C to aid absorption.",
+    ("iron", FLAG_LOW): "Low iron: favour iron-rich foods and avoid tea/coffee around meals.",
+    ("ferritin", FLAG_LOW): "Low ferritin: iron stores are depleted; discuss iron supplementation with a clinician.",
+    ("vitamin_d", FLAG_LOW): "Low vitamin D: fatty fish, eggs, fortified dairy and safe sun exposure; ask a clinician about supplementation.",
+    ("vitamin_b12", FLAG_LOW): "Low vitamin B12: eggs, dairy, fish or fortified cereals; vegans may need a supplement.",
+    ("glucose", FLAG_HIGH): "High glucose: limit refined carbohydrates and sugary drinks, prefer whole grains and fibre.",
+    ("hba1c", FLAG_HIGH): "High HbA1c: long-term sugar control needs attention; regular meals with low glycaemic index foods.",
+    ("total_cholesterol", FLAG_HIGH): "High total cholesterol: cut saturated and trans fats, add soluble fibre (oats, beans).",
+    ("ldl", FLAG_HIGH): "High LDL: reduce saturated fat and processed meat, add nuts, oily fish and soluble fibre.",
+    ("hdl", FLAG_LOW): "Low HDL: swap to unsaturated fats (olive oil, nuts, fish) and avoid trans fats.",
+    ("triglycerides", FLAG_HIGH): "High triglycerides: cut sugar, refined carbs and alcohol.",
+    ("uric_acid", FLAG_HIGH): "High uric acid: limit red meat, organ meats, shellfish, alcohol and fructose drinks; stay hydrated.",
+    ("potassium", FLAG_LOW): "Low potassium: bananas, potatoes, beans and leafy greens.",
+    ("calcium", FLAG_LOW): "Low calcium: dairy, fortified plant milks, tofu and leafy greens.",
+}
+
+# (marker, flag) -> exercise note
+EXERCISE_GUIDANCE = {
+    ("hemoglobin", FLAG_LOW): "Low hemoglobin: start with low-intensity activity (walking, yoga) and build up slowly; stop if dizzy or breathless.",
+    ("ferritin", FLAG_LOW): "Low iron stores: avoid prolonged high-intensity endurance work until levels recover.",
+    ("glucose", FLAG_HIGH): "High glucose: 150 min/week moderate aerobic exercise; short walks after meals help blood sugar.",
+    ("hba1c", FLAG_HIGH): "High HbA1c: combine aerobic exercise with 2-3 resistance sessions per week.",
+    ("glucose", FLAG_LOW): "Low glucose: eat before exercising and carry a fast-acting snack.",
+    ("total_cholesterol", FLAG_HIGH): "High cholesterol: regular moderate cardio (brisk walking, cycling) 30 min, 5 days a week.",
+    ("ldl", FLAG_HIGH): "High LDL: regular moderate cardio plus resistance training supports lipid levels.",
+    ("hdl", FLAG_LOW): "Low HDL: sustained aerobic exercise is one of the best ways to raise HDL.",
+    ("triglycerides", FLAG_HIGH): "High triglycerides: consistent aerobic exercise most days of the week.",
+    ("vitamin_d", FLAG_LOW): "Low vitamin D: outdoor activity helps; include balance and strength work for bone health.",
+    ("potassium", FLAG_LOW): "Low potassium: avoid very strenuous sessions and hydrate well; risk of cramps.",
+    ("tsh", FLAG_HIGH): "High TSH: fatigue is common; keep intensity moderate until reviewed by a clinician.",
+    ("tsh", FLAG_LOW): "Low TSH: elevated heart rate is possible; avoid maximal efforts until reviewed by a clinician.",
+}
+
+def _guidance_notes(markers: list, guidance: dict) -> list:
+    return [guidance[(m.key, m.flag)] for m in markers if (m.key, m.flag) in guidance]
+
+## Creating Reference Range Evaluation Tool
+# Replaces the nutrition stub, which trusted whatever flags the report printed:
+# the markers are checked against age/sex-specific ranges (reference_eval.py)
+# and the dietary notes cover only what that check flags, most severe first.
+class ReferenceRangeTool:
+    @staticmethod
+    @timed("evaluate_reference_ranges_tool")
+    async def evaluate_reference_ranges_tool(blood_report_data: str) -> str:
+        """Checks the markers in blood report data against age/sex reference ranges.
 
         Args:
-            blood_report_data (str): The raw text data from the blood test report.
+            blood_report_data (str): Report text, or the compact marker rows from read_report_markers.
 
         Returns:
-            str: A string containing the nutritional analysis.
+            str: The out-of-range findings with severity and z-score, followed by
+                nutrition notes for them.
         """
         if not isinstance(blood_report_data, str):
             return "Error: Input blood_report_data must be a string."
 
-        # Process and analyze the blood report data
-        processed_data = blood_report_data
-        
-        # Clean up the data format - this cleaning might be better done in read_data_tool
-        # but if needed here, a more robust method like regex is better.
-        import re
-        processed_data = re.sub(r' {2,}', ' ', processed_data) # Replace two or more spaces with a single space
-        processed_data = processed_data.strip() # Remove leading/trailing whitespace
-
-        # TODO: Implement actual nutrition analysis logic here.
-        # This would involve parsing the processed_data to extract specific
-        # blood markers (e.g., hemoglobin, cholesterol, glucose levels)
-        # and then mapping them to nutritional deficiencies or recommendations.
-        # Example:
-        # if "Hemoglobin: 10.0" in processed_data:
-        #     analysis_result = "Low Hemoglobin detected, consider iron-rich foods."
-        # else:
-        #     analysis_result = "Basic nutritional analysis based on report: " + processed_data[:100] + "..." # Truncate for example
-        
-        return f"Nutrition analysis functionality to be implemented. Processed data snippet: {processed_data[:200]}..." # Returning a snippet for demonstration
+        evaluation = evaluate_report(blood_report_data)
+        if evaluation is None:
+            return "Error: Reference-range evaluation is not available (numpy is not installed)."
+
+        flagged = evaluation.rows(flagged_only=True)
+        keys = [(row["marker"], row["flag"]) for row in flagged]
+        notes = [NUTRITION_GUIDANCE[key] for key in keys if key in NUTRITION_GUIDANCE]
+        if not notes:
+            notes = ["No nutrition-relevant abnormalities found; keep a balanced diet."]
+
+        return ("Findings:\n" + evaluation.findings_text() + "\n\nNutrition notes:\n"
+                + "\n".join(f"- {n}" for n in notes))
 
 ## Creating Exercise Planning Tool
 class ExerciseTool:
-    # Corrected method signature and example of where to add planning logic.
     @staticmethod
+    @timed("create_exercise_plan_tool")
     async def create_exercise_plan_tool(blood_report_data: str) -> str:
         """Creates an exercise plan based on the blood report data.
 
         Args:
-            blood_report_data (str): The raw text data from the blood test report.
+            blood_report_data (str): Report text, or the compact marker rows from read_report_markers.
 
         Returns:
-            str: A string containing the exercise plan.
+            str: The extracted markers followed by exercise notes for the abnormal ones.
         """
         if not isinstance(blood_report_data, str):
             return "Error: Input blood_report_data must be a string."
 
-        # TODO: Implement exercise planning logic here.
-        # This would involve parsing the blood report for indicators of
-        # physical condition, potential risks (e.g., high cholesterol,
-        # issues with blood pressure, energy levels), and then generating
-        # a suitable exercise routine.
-        # Example:
-        # if "Cholesterol: High" in blood_report_data:
-        #     exercise_plan = "Focus on cardiovascular exercises (e.g., brisk walking, jogging) for 30 mins, 5 times a week."
-        # else:
-        #     exercise_plan = "General exercise recommendation: daily moderate activity."
+        markers = extract_markers(blood_report_data)
+        notes = _guidance_notes(markers, EXERCISE_GUIDANCE)
+        if not notes:
+            notes = ["No exercise-relevant abnormalities found: 150 min/week moderate activity plus 2 strength sessions."]
+
+        return "Markers:\n" + format_markers(markers) + "\n\nExercise notes:\n" + "\n".join(f"- {n}" for n in notes)
+
+## CrewAI tool wrappers
+# The single tool layer used by agents.py and task.py. CrewAI calls tools
+# synchronously, so each wrapper runs the async implementation on the shared
+# tool loop (tool_bridge.call_sync) and returns its actual result.
+@tool("Blood Test Report Reader")
+def read_blood_test_report(path: str = 'data/sample.pdf') -> str:
+    """Reads data from a PDF blood test report file from a specified path.
+    Args:
+        path (str): The file path to the PDF blood test report, or its mem:// upload
+            handle, exactly as given in the task.
+    Returns:
+        str: The report's lab markers as compact rows, followed by its other text
+            without repeated headers/footers, within a token budget.
+    """
+    return call_sync(BloodTestReportTool.read_compact_tool(path))
+
+@tool("Blood Test Marker Extractor")
+def extract_blood_markers(path: str = 'data/sample.pdf') -> str:
+    """Reads a PDF blood test report and returns its lab markers as compact rows
+    (name, value, unit, reference range, flag). Prefer this over the full report text.
+    Args:
+        path (str): The file path to the PDF blood test report, or its mem:// upload
+            handle, exactly as given in the task.
+    Returns:
+        str: One row per marker, e.g. 'Glucose: 110 mg/dL (ref 70-99) high'.
+    """
+    return call_sync(BloodTestReportTool.read_markers_tool(path))
+
+@tool("Reference Range Evaluator")
+def evaluate_reference_ranges(blood_report_data: str) -> str:
+    """Checks blood test markers against age/sex-specific reference ranges and returns only the
+    out-of-range findings, most severe first (with severity and z-score), plus dietary notes for them.
+    Pass the marker rows from the Blood Test Marker Extractor."""
+    return call_sync(ReferenceRangeTool.evaluate_reference_ranges_tool(blood_report_data))
 
-        return f"Exercise planning functionality to be implemented. Received data snippet: {blood_report_data[:200]}..." # Returning a snippet for demonstration
+@tool("Exercise Planning Tool")
+def create_exercise_plan(blood_report_data: str) -> str:
+    """Creates a personalized exercise plan based on blood test markers and overall health indicators."""
+    return call_sync(ExerciseTool.create_exercise_plan_tool(blood_report_data))
 
 # Example of how you might use these tools (for testing purposes)
 async def main():
@@ -146,9 +293,9 @@ async def main():
     print("\n--- PDF Report ---")
     print(pdf_report)
 
-    nutrition_analysis = await NutritionTool.analyze_nutrition_tool(pdf_report)
-    print("\n--- Nutrition Analysis ---")
-    print(nutrition_analysis)
+    findings = await ReferenceRangeTool.evaluate_reference_ranges_tool(pdf_report)
+    print("\n--- Reference Range Findings ---")
+    print(findings)
 
     exercise_plan = await ExerciseTool.create_exercise_plan_tool(pdf_report)
     print("\n--- Exercise Plan ---")
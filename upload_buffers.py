@@ -0,0 +1,216 @@
+## In-memory upload registry
+# Every upload used to be written to data/, read back by the PDF parser and
+# deleted afterwards. Uploads up to config.UPLOAD_MEMORY_THRESHOLD bytes now stay
+# in memory instead: the registry maps an upload id to its bytes and hands out a
+# handle ("mem://<id>.pdf") that is used wherever a file path was, including
+# the {file_path} the agents pass to their reader tools. Larger uploads, and
+# uploads arriving while the registry is at config.UPLOAD_MEMORY_MAX_BYTES, are
+# spooled to disk as before (see uploads.py).
+#
+# Readers get zero-copy views (memoryview / BytesIO over the same bytes), so a
+# buffer released by its owner stays alive until the last reader is done with
+# it and is then freed by the interpreter. Buffers whose owner never released
+# them are evicted after config.UPLOAD_MEMORY_TTL_SECONDS without use.
+import importlib.util
+import io
+import logging
+import os
+import threading
+import time
+import uuid
+
+import config
+
+logger = logging.getLogger(__name__)
+
+MEMORY_PREFIX = "mem://"
+
+# The in-memory path needs pypdf, which reads from streams; the langchain
+# fallback loader only takes file paths
+BUFFERS_SUPPORTED = importlib.util.find_spec("pypdf") is not None
+
+
+class _Buffer:
+    def __init__(self, data: bytes, sha256: str, filename: str):
+        self.data = data
+        self.sha256 = sha256
+        self.filename = filename
+        self.refs = 1
+        self.last_used = time.monotonic()
+
+
+class UploadBufferRegistry:
+    """Upload ids mapped to their bytes, reference counted by their owners.
+
+    Args:
+        max_bytes (int): Total size of the buffers held at once.
+        idle_ttl (float): Seconds after which an unused buffer is evicted even
+            though it was never released.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, idle_ttl: float = 3600.0):
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self._buffers = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stored = 0
+        self.spilled = 0
+        self.expired = 0
+        self.peak_bytes = 0
+
+    def put(self, data: bytes, sha256: str, filename: str = None, suffix: str = ".pdf"):
+        """Registers data and returns its handle, owned once by the caller.
+
+        Returns None (and counts a spill) if the registry has no room left; the
+        caller then stores the upload on disk.
+        """
+        self.sweep()
+        handle = f"{MEMORY_PREFIX}{uuid.uuid4().hex}{suffix}"
+        with self._lock:
+            if self._bytes + len(data) > self.max_bytes:
+                self.spilled += 1
+                return None
+            self._buffers[handle] = _Buffer(data, sha256, filename)
+            self._bytes += len(data)
+            self.peak_bytes = max(self.peak_bytes, self._bytes)
+            self.stored += 1
+        return handle
+
+    def acquire(self, handle: str):
+        """Adds an owner to the buffer (e.g. a second job sharing the upload).
+
+        Raises:
+            KeyError: If the handle is unknown or already evicted.
+        """
+        with self._lock:
+            self._get(handle).refs += 1
+
+    def release(self, handle: str) -> bool:
+        """Drops one owner; the buffer is evicted when none are left.
+
+        Returns:
+            bool: True if this call evicted the buffer.
+        """
+        with self._lock:
+            buffer = self._buffers.get(handle)
+            if buffer is None:
+                return False
+            buffer.refs -= 1
+            if buffer.refs > 0:
+                return False
+            self._evict(handle)
+        return True
+
+    def contains(self, handle: str) -> bool:
+        with self._lock:
+            return handle in self._buffers
+
+    def view(self, handle: str) -> memoryview:
+        """Read-only view of the upload bytes (no copy).
+
+        Raises:
+            KeyError: If the handle is unknown or already evicted.
+        """
+        with self._lock:
+            return memoryview(self._get(handle).data)
+
+    def data(self, handle: str) -> bytes:
+        """The upload bytes themselves, e.g. to hand to a worker process."""
+        with self._lock:
+            return self._get(handle).data
+
+    def sha256(self, handle: str) -> str:
+        with self._lock:
+            return self._get(handle).sha256
+
+    def sweep(self) -> int:
+        """Evicts buffers unused for longer than idle_ttl; returns how many."""
+        cutoff = time.monotonic() - self.idle_ttl
+        with self._lock:
+            expired = [handle for handle, buffer in self._buffers.items() if buffer.last_used < cutoff]
+            for handle in expired:
+                self._evict(handle)
+            self.expired += len(expired)
+        for handle in expired:
+            logger.warning("Evicted in-memory upload %s after %.0fs without use", handle, self.idle_ttl)
+        return len(expired)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "buffers": len(self._buffers),
+                "bytes": self._bytes,
+                "peak_bytes": self.peak_bytes,
+                "max_bytes": self.max_bytes,
+                "stored": self.stored,
+                "spilled_to_disk": self.spilled,
+                "expired": self.expired,
+            }
+
+    def _get(self, handle: str) -> _Buffer:
+        # Caller holds the lock
+        buffer = self._buffers.get(handle)
+        if buffer is None:
+            raise KeyError(f"Upload {handle} is no longer in memory")
+        buffer.last_used = time.monotonic()
+        return buffer
+
+    def _evict(self, handle: str):
+        # Caller holds the lock; readers still holding a view keep the bytes alive
+        buffer = self._buffers.pop(handle)
+        self._bytes -= len(buffer.data)
+
+
+upload_buffers = UploadBufferRegistry(
+    max_bytes=config.UPLOAD_MEMORY_MAX_BYTES,
+    idle_ttl=config.UPLOAD_MEMORY_TTL_SECONDS,
+)
+
+
+def is_memory_handle(path) -> bool:
+    return isinstance(path, str) and path.startswith(MEMORY_PREFIX)
+
+
+def report_exists(path: str) -> bool:
+    """os.path.exists for stored uploads, in memory or on disk."""
+    if is_memory_handle(path):
+        return upload_buffers.contains(path)
+    return os.path.exists(path)
+
+
+def open_source(path: str):
+    """What to hand to a reader taking a path or a stream (PdfReader, ZipFile, open()).
+
+    Returns:
+        str | io.BytesIO: path itself for files on disk, a BytesIO sharing the
+        buffer's bytes for memory handles.
+    """
+    if is_memory_handle(path):
+        return io.BytesIO(upload_buffers.data(path))
+    return path
+
+
+def read_head(path: str, size: int) -> bytes:
+    """The first size bytes of a stored upload."""
+    if is_memory_handle(path):
+        return bytes(upload_buffers.view(path)[:size])
+    with open(path, "rb") as f:
+        return f.read(size)
+
+
+def discard_upload(path: str) -> bool:
+    """Releases a memory handle or deletes a file on disk.
+
+    Returns:
+        bool: True if the upload is gone as a result of this call.
+
+    Raises:
+        OSError: If the file exists but cannot be deleted.
+    """
+    if is_memory_handle(path):
+        return upload_buffers.release(path)
+    if os.path.exists(path):
+        os.remove(path)
+        return True
+    return False
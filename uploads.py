@@ -0,0 +1,188 @@
+## Streaming storage of uploaded reports
+# Uploads are read chunk by chunk instead of `await file.read()` and hashed on
+# the way through for the report text cache. Small ones stay in memory (see
+# upload_buffers.py); once an upload grows past the memory threshold it is
+# spooled to disk, so a large scanned PDF costs one chunk of memory rather than
+# its full size.
+import hashlib
+import os
+import uuid
+import zipfile
+
+import config
+from upload_buffers import upload_buffers, is_memory_handle, open_source, discard_upload, BUFFERS_SUPPORTED
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds the configured maximum size."""
+
+    def __init__(self, max_bytes: int):
+        super().__init__(f"Upload exceeds the maximum size of {max_bytes} bytes")
+        self.max_bytes = max_bytes
+
+
+class StoredUpload:
+    """An upload that has been fully received.
+
+    `path` is a file on disk or, for uploads kept in memory, a "mem://" handle;
+    both are accepted by the report readers.
+    """
+
+    def __init__(self, path: str, sha256: str, size: int, filename: str):
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+        self.filename = filename
+
+    @property
+    def in_memory(self) -> bool:
+        return is_memory_handle(self.path)
+
+
+def _memory_threshold(memory_threshold: int = None) -> int:
+    if not BUFFERS_SUPPORTED:
+        return 0
+    return config.UPLOAD_MEMORY_THRESHOLD if memory_threshold is None else memory_threshold
+
+
+class _Spooler:
+    """Collects an upload in memory up to memory_threshold bytes, then on disk.
+
+    Disk bytes go to a temporary file next to dest_path which is atomically
+    renamed by finish(), so dest_path never holds a partial upload.
+    """
+
+    def __init__(self, dest_path: str, filename: str, max_bytes: int, memory_threshold: int):
+        self.dest_path = dest_path
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.memory_threshold = memory_threshold
+        self.tmp_path = f"{dest_path}.{uuid.uuid4().hex}.part"
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.buffer = bytearray()
+        self.file = None
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.max_bytes and self.size > self.max_bytes:
+            raise UploadTooLargeError(self.max_bytes)
+        self.digest.update(chunk)
+        if self.file is None and self.size <= self.memory_threshold:
+            self.buffer += chunk
+            return
+        if self.file is None:
+            self._spill()
+        self.file.write(chunk)
+
+    def finish(self) -> StoredUpload:
+        sha256 = self.digest.hexdigest()
+        if self.file is None and self.memory_threshold > 0:
+            suffix = os.path.splitext(self.dest_path)[1] or ".pdf"
+            handle = upload_buffers.put(bytes(self.buffer), sha256, self.filename, suffix)
+            if handle is not None:
+                return StoredUpload(handle, sha256, self.size, self.filename)
+            # Registry full: this one goes to disk after all
+        if self.file is None:
+            self._spill()
+        self.file.close()
+        os.replace(self.tmp_path, self.dest_path)
+        return StoredUpload(self.dest_path, sha256, self.size, self.filename)
+
+    def discard(self):
+        """Removes the partial upload after a failure."""
+        if self.file is not None:
+            self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def _spill(self):
+        os.makedirs(os.path.dirname(self.dest_path) or ".", exist_ok=True)
+        self.file = open(self.tmp_path, "wb")
+        self.file.write(self.buffer)
+        self.buffer = bytearray()
+
+
+async def store_upload(file, dest_path: str, max_bytes: int = None, chunk_size: int = None,
+                       memory_threshold: int = None) -> StoredUpload:
+    """Receives an UploadFile in memory, or on disk at dest_path if it is large.
+
+    Args:
+        file (UploadFile): The incoming upload.
+        dest_path (str): Location of the file if it is spooled to disk.
+        max_bytes (int, optional): Size limit. Defaults to config.UPLOAD_MAX_BYTES.
+        chunk_size (int, optional): Read size. Defaults to config.UPLOAD_CHUNK_SIZE.
+        memory_threshold (int, optional): Largest upload kept in memory; 0 always
+            writes to disk. Defaults to config.UPLOAD_MEMORY_THRESHOLD.
+
+    Raises:
+        UploadTooLargeError: As soon as more than max_bytes have been received.
+    """
+    max_bytes = config.UPLOAD_MAX_BYTES if max_bytes is None else max_bytes
+    chunk_size = config.UPLOAD_CHUNK_SIZE if chunk_size is None else chunk_size
+
+    spooler = _Spooler(dest_path, file.filename, max_bytes, _memory_threshold(memory_threshold))
+    try:
+        while True:
+            chunk = await file.read(chunk_size)
+            if not chunk:
+                break
+            spooler.write(chunk)
+        return spooler.finish()
+    except BaseException:
+        spooler.discard()
+        raise
+
+
+def is_zip_upload(filename: str, content_type: str = None) -> bool:
+    """True if an upload looks like a zip archive of reports."""
+    return (os.path.splitext(filename or "")[1].lower() == ".zip"
+            or content_type in ("application/zip", "application/x-zip-compressed"))
+
+
+def extract_zip_reports(zip_path: str, dest_dir: str, max_files: int = None, max_bytes: int = None,
+                        chunk_size: int = None, memory_threshold: int = None) -> list:
+    """Unpacks the PDFs of a zip archive (on disk or in memory), hashing each one.
+
+    Members that are not .pdf files are skipped. Sizes are enforced while
+    decompressing rather than trusted from the archive headers. Like uploads,
+    small members stay in memory and the rest is written to dest_dir.
+
+    Returns:
+        list: A StoredUpload per PDF, named after its path inside the archive.
+
+    Raises:
+        ValueError: If the file is not a zip or holds more than max_files PDFs.
+        UploadTooLargeError: If a member decompresses to more than max_bytes.
+    """
+    max_bytes = config.UPLOAD_MAX_BYTES if max_bytes is None else max_bytes
+    chunk_size = config.UPLOAD_CHUNK_SIZE if chunk_size is None else chunk_size
+    memory_threshold = _memory_threshold(memory_threshold)
+
+    stored = []
+    try:
+        with zipfile.ZipFile(open_source(zip_path)) as archive:
+            members = [info for info in archive.infolist()
+                       if not info.is_dir()
+                       and info.filename.lower().endswith(".pdf")
+                       and not info.filename.startswith("__MACOSX/")]
+            if max_files is not None and len(members) > max_files:
+                raise ValueError(f"Archive holds {len(members)} reports, more than the limit of {max_files}")
+            for info in members:
+                dest_path = os.path.join(dest_dir, f"blood_test_report_{uuid.uuid4()}.pdf")
+                spooler = _Spooler(dest_path, info.filename, max_bytes, memory_threshold)
+                try:
+                    with archive.open(info) as src:
+                        for chunk in iter(lambda: src.read(chunk_size), b""):
+                            spooler.write(chunk)
+                    stored.append(spooler.finish())
+                except BaseException:
+                    spooler.discard()
+                    raise
+    except BaseException as e:
+        for upload in stored:
+            discard_upload(upload.path)
+        if isinstance(e, zipfile.BadZipFile):
+            raise ValueError(f"Not a valid zip archive: {e}") from e
+        raise
+    return stored